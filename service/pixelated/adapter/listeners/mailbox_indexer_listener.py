@@ -24,6 +24,7 @@ class MailboxIndexerListener(object):
     """ Listens for new mails, keeping the index updated """
 
     SEARCH_ENGINE = None
+    INDEX_QUEUE = None
 
     @classmethod
     @defer.inlineCallbacks
@@ -42,13 +43,14 @@ class MailboxIndexerListener(object):
     @defer.inlineCallbacks
     def newMessages(self, exists, recent):
         try:
-            indexed_idents = set(self.SEARCH_ENGINE.search('tag:' + self.mailbox_name.lower(), all_mails=True))
+            indexed_idents = set((yield self.SEARCH_ENGINE.search('tag:' + self.mailbox_name.lower(), all_mails=True)))
             soledad_idents = yield self.mail_store.get_mailbox_mail_ids(self.mailbox_name)
             soledad_idents = set(soledad_idents)
 
             missing_idents = soledad_idents.difference(indexed_idents)
 
-            self.SEARCH_ENGINE.index_mails((yield self.mail_store.get_mails(missing_idents)))
+            index_writer = self.INDEX_QUEUE or self.SEARCH_ENGINE
+            index_writer.index_mails((yield self.mail_store.get_mails(missing_idents)))
         except Exception, e:  # this is a event handler, don't let exceptions escape
             logger.error(e)
 
@@ -63,8 +65,9 @@ class MailboxIndexerListener(object):
 
 
 @defer.inlineCallbacks
-def listen_all_mailboxes(account, search_engine, mail_store):
+def listen_all_mailboxes(account, search_engine, mail_store, index_queue=None):
     MailboxIndexerListener.SEARCH_ENGINE = search_engine
+    MailboxIndexerListener.INDEX_QUEUE = index_queue
     mailboxes = yield account.account.list_all_mailbox_names()
     for mailbox_name in mailboxes:
         yield MailboxIndexerListener.listen(account, mailbox_name, mail_store)
@@ -0,0 +1,132 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import base64
+import quopri
+import re
+
+
+_NOT_BASE64 = re.compile('[^A-Za-z0-9+/=]')
+
+
+class AttachmentContent(object):
+    """
+    The content of an attachment as stored in its content doc. It is decoded chunk by chunk
+    while being read, so the decoded attachment never has to be in memory at once.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, raw, content_type, content_transfer_encoding):
+        self._raw = raw.encode('utf-8') if isinstance(raw, unicode) else raw
+        self.content_type = content_type
+        self._encoding = (content_transfer_encoding or '').lower()
+        self._size = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            if self._encoding == 'base64':
+                self._size = _base64_decoded_size(self._raw, self.CHUNK_SIZE)
+            else:
+                self._size = sum(len(chunk) for chunk in self.chunks())
+        return self._size
+
+    def chunks(self):
+        if self._encoding == 'base64':
+            return _base64_chunks(self._raw, self.CHUNK_SIZE)
+        elif self._encoding == 'quoted-printable':
+            return _quoted_printable_chunks(self._raw, self.CHUNK_SIZE)
+        else:
+            return _plain_chunks(self._raw, self.CHUNK_SIZE)
+
+    def decoded(self):
+        """ A copy holding the decoded bytes, which are cheaper to read again """
+        return AttachmentContent(''.join(self.chunks()), self.content_type, None)
+
+    def open(self, start=0, end=None):
+        """
+        Returns a file like object for FileSender, reading the decoded bytes from start up to
+        and including end.
+        """
+        return _DecodedReader(self.chunks(), start, self.size - 1 if end is None else end)
+
+
+class _DecodedReader(object):
+
+    def __init__(self, chunks, start, end):
+        self._chunks = chunks
+        self._to_skip = start
+        self._remaining = end - start + 1
+        self._buffer = ''
+
+    def read(self, size):
+        while len(self._buffer) < size and self._remaining > len(self._buffer):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if self._to_skip:
+                skipped = min(self._to_skip, len(chunk))
+                chunk = chunk[skipped:]
+                self._to_skip -= skipped
+            self._buffer += chunk
+
+        data = self._buffer[:min(size, self._remaining)]
+        self._buffer = self._buffer[len(data):]
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._chunks = iter(())
+        self._buffer = ''
+
+
+def _base64_decoded_size(raw, chunk_size):
+    # counted like _base64_chunks decodes: characters outside the alphabet are dropped and missing padding is added
+    encoded_length = 0
+    tail = ''
+    for offset in xrange(0, len(raw), chunk_size):
+        encoded = _NOT_BASE64.sub('', raw[offset:offset + chunk_size])
+        encoded_length += len(encoded)
+        tail = (tail + encoded)[-16:]
+    padding = len(tail) - len(tail.rstrip('='))
+    return (encoded_length - padding) * 3 / 4
+
+
+def _base64_chunks(raw, chunk_size):
+    pending = ''
+    for offset in xrange(0, len(raw), chunk_size):
+        encoded = pending + _NOT_BASE64.sub('', raw[offset:offset + chunk_size])
+        usable = len(encoded) - len(encoded) % 4
+        pending = encoded[usable:]
+        if usable:
+            yield base64.b64decode(encoded[:usable])
+    if pending:
+        yield base64.b64decode(pending + '=' * (-len(pending) % 4))
+
+
+def _quoted_printable_chunks(raw, chunk_size):
+    offset = 0
+    while offset < len(raw):
+        # soft line breaks and escapes never span lines, so chunks end after a line break
+        end = raw.find('\n', offset + chunk_size)
+        end = len(raw) if end == -1 else end + 1
+        yield quopri.decodestring(raw[offset:end])
+        offset = end
+
+
+def _plain_chunks(raw, chunk_size):
+    for offset in xrange(0, len(raw), chunk_size):
+        yield raw[offset:offset + chunk_size]
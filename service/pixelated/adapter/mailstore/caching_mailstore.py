@@ -0,0 +1,248 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import logging
+import sys
+
+from twisted.internet import defer
+from pixelated.support.lru_cache import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachingMailStore(object):  # implements MailStore
+    """
+    Keeps recently used mails in memory, so that opening a mail, marking it as read and
+    refreshing the list do not load and parse the same documents again.
+
+    Every entry remembers the revisions of the documents it was built from. Entries are
+    dropped when the mail is changed through this store and, after a sync, when the
+    revisions in soledad no longer match. Changes of flags and tags only touch the flags
+    doc, cached entries take them over along with its new revision.
+
+    Decoded attachments are kept as well. They are addressed by their payload hash and
+    never change, so they are only evicted to stay within their budget.
+    """
+
+    # only these are delegated implicitly, every method that changes mails is implemented here
+    READ_ONLY_METHODS = ('get_mail_attachment', 'get_mail_summaries', 'get_mail_revisions', 'all_mails', 'iter_mails',
+                         'mail_changes_since', 'current_generation', 'get_mailbox_names', 'get_mailbox_mail_ids')
+
+    DEFAULT_MEMORY_BUDGET = 32 * 1024 * 1024
+    DEFAULT_ATTACHMENT_BUDGET = 16 * 1024 * 1024
+
+    def __init__(self, delegate, memory_budget=DEFAULT_MEMORY_BUDGET, attachment_budget=DEFAULT_ATTACHMENT_BUDGET):
+        self._delegate = delegate
+        self._mails = LRUCache(memory_budget)
+        self._attachments = LRUCache(attachment_budget)
+
+    @classmethod
+    def _create_delegator(cls, method_name):
+        def delegator(self, *args, **kw):
+            return getattr(self._delegate, method_name)(*args, **kw)
+
+        setattr(cls, method_name, delegator)
+
+    def stats(self):
+        return dict(self._mails.stats(), attachments=self._attachments.stats())
+
+    @defer.inlineCallbacks
+    def get_mail(self, mail_id, include_body=False):
+        mail = self._lookup(mail_id, include_body)
+        if mail is None:
+            revisions = yield self._delegate.get_mail_revisions([mail_id])
+            mail = yield self._delegate.get_mail(mail_id, include_body=include_body)
+            self._remember(mail, revisions.get(mail_id), include_body)
+
+        defer.returnValue(_copy(mail))
+
+    @defer.inlineCallbacks
+    def get_mails(self, mail_ids, include_body=False):
+        mail_ids = list(mail_ids)
+        cached = dict((mail_id, self._lookup(mail_id, include_body)) for mail_id in mail_ids)
+        missing_ids = [mail_id for mail_id, mail in cached.items() if mail is None]
+
+        if missing_ids:
+            revisions = yield self._delegate.get_mail_revisions(missing_ids)
+            loaded = yield self._delegate.get_mails(missing_ids, include_body=include_body)
+            for mail_id, mail in zip(missing_ids, loaded):
+                self._remember(mail, revisions.get(mail_id), include_body)
+                cached[mail_id] = mail
+
+        defer.returnValue([_copy(cached[mail_id]) for mail_id in mail_ids])
+
+    @defer.inlineCallbacks
+    def get_mail_attachment_content(self, attachment_id):
+        content = self._attachments.get(attachment_id)
+        if content is None:
+            content = yield self._delegate.get_mail_attachment_content(attachment_id)
+            if content.size <= self._attachments.budget:
+                content = content.decoded()
+                self._attachments.put(attachment_id, content, content.size)
+
+        defer.returnValue(content)
+
+    @defer.inlineCallbacks
+    def add_mail(self, mailbox_name, mail):
+        added_mail = yield self._delegate.add_mail(mailbox_name, mail)
+        self._evict_relocated(added_mail)
+        defer.returnValue(added_mail)
+
+    @defer.inlineCallbacks
+    def copy_mail_to_mailbox(self, mail_id, mailbox_name):
+        copied_mail = yield self._delegate.copy_mail_to_mailbox(mail_id, mailbox_name)
+        self._evict_relocated(copied_mail)
+        defer.returnValue(copied_mail)
+
+    def _evict_relocated(self, mail):
+        # the id may have belonged to a mail moved out of the mailbox before, which now lives on under another id
+        self._evict(mail.mail_id)
+        if mail.relocated_mail_id is not None:
+            self._evict(mail.relocated_mail_id)
+
+    def add_mailbox(self, mailbox_name):
+        return self._delegate.add_mailbox(mailbox_name)
+
+    @defer.inlineCallbacks
+    def delete_mailbox(self, mailbox_name):
+        for mail_id, entry in self._mails.items():
+            if entry.mail.mailbox_name == mailbox_name:
+                self._evict(mail_id)
+        yield self._delegate.delete_mailbox(mailbox_name)
+
+    @defer.inlineCallbacks
+    def update_mail(self, mail):
+        self._evict(mail.mail_id)
+        yield self._delegate.update_mail(mail)
+
+    @defer.inlineCallbacks
+    def update_flags(self, mail_ids, add=(), remove=()):
+        updated_ids = yield self._delegate.update_flags(mail_ids, add, remove)
+
+        def change_flags(mail):
+            mail.flags.update(add)
+            mail.flags.difference_update(remove)
+
+        yield self._change_cached(updated_ids, change_flags)
+        defer.returnValue(updated_ids)
+
+    @defer.inlineCallbacks
+    def update_tags(self, mail_ids, tags):
+        updated_ids = yield self._delegate.update_tags(mail_ids, tags)
+
+        def change_tags(mail):
+            mail.tags = set(tags)
+
+        yield self._change_cached(updated_ids, change_tags)
+        defer.returnValue(updated_ids)
+
+    @defer.inlineCallbacks
+    def _change_cached(self, mail_ids, change):
+        mail_ids = set(mail_ids)
+        cached = dict((mail_id, entry) for mail_id, entry in self._mails.items() if mail_id in mail_ids)
+        if not cached:
+            return
+
+        revisions = yield self._delegate.get_mail_revisions(cached.keys())
+        for mail_id, entry in cached.items():
+            if revisions.get(mail_id) is None:
+                self._evict(mail_id)
+            else:
+                change(entry.mail)
+                entry.revision = revisions[mail_id]
+
+    @defer.inlineCallbacks
+    def delete_mail(self, mail_id):
+        self._evict(mail_id)
+        yield self._delegate.delete_mail(mail_id)
+
+    def delete_mails(self, mail_ids):
+        for mail_id in mail_ids:
+            self._evict(mail_id)
+        return self._delegate.delete_mails(mail_ids)
+
+    @defer.inlineCallbacks
+    def move_mail_to_mailbox(self, mail_id, mailbox_name):
+        self._evict(mail_id)
+        moved_mail = yield self._delegate.move_mail_to_mailbox(mail_id, mailbox_name)
+        defer.returnValue(moved_mail)
+
+    def move_mails_to_mailbox(self, mail_ids, mailbox_name):
+        for mail_id in mail_ids:
+            self._evict(mail_id)
+        return self._delegate.move_mails_to_mailbox(mail_ids, mailbox_name)
+
+    @defer.inlineCallbacks
+    def refresh_after_sync(self):
+        yield self._delegate.refresh_after_sync()
+        cached_revisions = dict((mail_id, entry.revision) for mail_id, entry in self._mails.items())
+        if not cached_revisions:
+            return
+
+        current_revisions = yield self._delegate.get_mail_revisions(cached_revisions.keys())
+        for mail_id, revision in cached_revisions.items():
+            if current_revisions.get(mail_id) != revision:
+                self._evict(mail_id)
+
+    def _lookup(self, mail_id, include_body):
+        entry = self._mails.get(mail_id, usable=lambda entry: entry.include_body or not include_body)
+        return entry.mail if entry is not None else None
+
+    def _remember(self, mail, revision, include_body):
+        if mail is None or revision is None:
+            return
+
+        self._mails.put(mail.mail_id, _CacheEntry(mail, revision, include_body), _estimated_size(mail))
+        logger.debug('Cached mail %s: %s' % (mail.mail_id, self._mails.stats()))
+
+    def _evict(self, mail_id):
+        self._mails.pop(mail_id)
+
+    def __getattr__(self, name):
+        """
+        Acts like method missing. If a read only method of MailStore is not implemented in
+        this class, a delegate method is created.
+
+        :param name: attribute name
+        :return: method or attribute
+        """
+        if name in self.READ_ONLY_METHODS:
+            CachingMailStore._create_delegator(name)
+            return super(CachingMailStore, self).__getattribute__(name)
+        else:
+            raise NotImplementedError('No attribute %s' % name)
+
+
+class _CacheEntry(object):
+    __slots__ = ('mail', 'revision', 'include_body')
+
+    def __init__(self, mail, revision, include_body):
+        self.mail = mail
+        self.revision = revision
+        self.include_body = include_body
+
+
+def _estimated_size(mail):
+    headers = mail._headers
+    header_size = sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in headers.items())
+    return sys.getsizeof(mail) + sys.getsizeof(headers) + header_size + sys.getsizeof(mail.body)
+
+
+def _copy(mail):
+    """ Callers change tags and flags of the mails they get, which must not leak into the cache """
+    if mail is None:
+        return None
+    return mail.with_body(mail.body)
@@ -20,12 +20,20 @@ import quopri
 from uuid import uuid4
 
 import re
+import sys
 from leap.mail.adaptors.soledad import SoledadMailAdaptor, ContentDocWrapper
 from twisted.internet import defer
+from pixelated.adapter.mailstore.attachment_content import AttachmentContent
 from pixelated.adapter.mailstore.body_parser import BodyParser
 from pixelated.adapter.mailstore.mailstore import MailStore, underscore_uuid
+from pixelated.adapter.mailstore.soledad_changes import SoledadChanges
+from leap.mail import constants
 from leap.mail.mail import Message
 from pixelated.adapter.model.mail import Mail, InputMail
+from pixelated.adapter.model.status import Status
+from pixelated.support.functional import flatten, unique
+from pixelated.support.lru_cache import LRUCache
+from pixelated.support.scheduler import shared_scheduler
 
 
 class AttachmentInfo(object):
@@ -35,25 +43,116 @@ class AttachmentInfo(object):
         self.encoding = encoding
 
 
+def _split_recipient_headers(headers):
+    cpy = dict(headers)
+
+    for name in set(headers.keys()).intersection(['To', 'Cc', 'Bcc']):
+        cpy[name] = headers[name].split(',') if headers[name] else []
+
+    return cpy
+
+
+def _decoded_header_utf_8(header_value):
+    if isinstance(header_value, list):
+        return list(set([_decoded_header_utf_8(v) for v in header_value]))
+    elif header_value is not None:
+        def encode_chunk(content, encoding):
+            return unicode(content, encoding=encoding or 'ascii', errors='ignore')
+
+        try:
+            encoded_chunks = [encode_chunk(content, encoding) for content, encoding in decode_header(header_value)]
+            return ' '.join(encoded_chunks)  # decode_header strips whitespaces on all chunks, joining over ' ' is only a workaround, not a proper fix
+        except UnicodeEncodeError:
+            return unicode(header_value.encode('ascii', errors='ignore'))
+
+
+def _attachments_as_dicts(attachments):
+    return [{'ident': attachment.ident, 'name': attachment.name, 'encoding': attachment.encoding} for attachment in attachments]
+
+
+class MailSummary(object):
+    """ The part of a mail the mail list shows, without body, security casing and reply information """
+
+    __slots__ = ('_mail_id', '_mailbox_name', '_headers', 'tags', '_flags', '_attachments')
+
+    def __init__(self, mail_id, mailbox_name, headers=None, tags=set(), flags=set(), attachments=[]):
+        self._mail_id = mail_id
+        self._mailbox_name = mailbox_name
+        self._headers = headers if headers is not None else {}
+        self.tags = set(tags)
+        self._flags = set(flags)
+        self._attachments = attachments
+
+    @property
+    def ident(self):
+        return self._mail_id
+
+    @property
+    def mail_id(self):
+        return self._mail_id
+
+    @property
+    def mailbox_name(self):
+        return self._mailbox_name
+
+    @property
+    def flags(self):
+        return self._flags
+
+    @property
+    def status(self):
+        return Status.from_flags(self._flags)
+
+    @property
+    def headers(self):
+        return _split_recipient_headers(self._headers)
+
+    def as_dict(self):
+        return {
+            'header': {k.lower(): _decoded_header_utf_8(v) for k, v in self.headers.items()},
+            'ident': self._mail_id,
+            'tags': self.tags,
+            'status': list(self.status),
+            'mailbox': self._mailbox_name.lower(),
+            'attachments': _attachments_as_dicts(self._attachments)
+        }
+
+
 class LeapMail(Mail):
+    """
+    The headers of a mail never change, so the recipient lists and the decoded values are
+    only derived from them once. Callers must not change the dicts they get.
+
+    A mail just added or copied has the ``relocated_mail_id`` of the mail that was stored under
+    its id before and was moved out of its way, or None.
+    """
+
+    __slots__ = ('_mail_id', '_mailbox_name', '_headers', '_split_headers', '_decoded_headers', '_body', 'tags', '_flags', '_attachments',
+                 'relocated_mail_id')
 
     def __init__(self, mail_id, mailbox_name, headers=None, tags=set(), flags=set(), body=None, attachments=[]):
         self._mail_id = mail_id
         self._mailbox_name = mailbox_name
         self._headers = headers if headers is not None else {}
+        self._split_headers = None
+        self._decoded_headers = None
         self._body = body
         self.tags = set(tags)   # TODO test that asserts copy
         self._flags = set(flags)  # TODO test that asserts copy
         self._attachments = attachments
+        self.relocated_mail_id = None
 
     @property
     def headers(self):
-        cpy = dict(self._headers)
-
-        for name in set(self._headers.keys()).intersection(['To', 'Cc', 'Bcc']):
-            cpy[name] = self._headers[name].split(',') if self._headers[name] else []
+        if self._split_headers is None:
+            self._split_headers = _split_recipient_headers(self._headers)
+        return self._split_headers
 
-        return cpy
+    @property
+    def _decoded_header_values(self):
+        if self._decoded_headers is None:
+            self._decoded_headers = {k.lower(): self._decoded_header_utf_8(v) for k, v in self.headers.items()}
+        return self._decoded_headers
 
     @property
     def ident(self):
@@ -112,21 +211,17 @@ class LeapMail(Mail):
         return result
 
     def _decoded_header_utf_8(self, header_value):
-        if isinstance(header_value, list):
-            return self.remove_duplicates([self._decoded_header_utf_8(v) for v in header_value])
-        elif header_value is not None:
-            def encode_chunk(content, encoding):
-                return unicode(content, encoding=encoding or 'ascii', errors='ignore')
-
-            try:
-                encoded_chunks = [encode_chunk(content, encoding) for content, encoding in decode_header(header_value)]
-                return ' '.join(encoded_chunks)  # decode_header strips whitespaces on all chunks, joining over ' ' is only a workaround, not a proper fix
-            except UnicodeEncodeError:
-                return unicode(header_value.encode('ascii', errors='ignore'))
+        return _decoded_header_utf_8(header_value)
+
+    def with_body(self, body):
+        mail = LeapMail(self._mail_id, self._mailbox_name, self._headers, self.tags, self._flags, body=body, attachments=self._attachments)
+        mail._split_headers = self._split_headers
+        mail._decoded_headers = self._decoded_headers
+        return mail
 
     def as_dict(self):
         return {
-            'header': {k.lower(): self._decoded_header_utf_8(v) for k, v in self.headers.items()},
+            'header': dict(self._decoded_header_values),
             'ident': self._mail_id,
             'tags': self.tags,
             'status': list(self.status),
@@ -135,7 +230,7 @@ class LeapMail(Mail):
             'textPlainBody': self._body,
             'replying': self._replying_dict(),
             'mailbox': self._mailbox_name.lower(),
-            'attachments': [{'ident': attachment.ident, 'name': attachment.name, 'encoding': attachment.encoding} for attachment in self._attachments]
+            'attachments': _attachments_as_dicts(self._attachments)
         }
 
     def _replying_dict(self):
@@ -205,10 +300,17 @@ def _extract_filename(content_disposition):
 
 
 class LeapMailStore(MailStore):
-    __slots__ = ('soledad')
+    __slots__ = ('soledad', '_mailbox_names_by_uuid', '_scheduler', '_parsed_bodies')
 
-    def __init__(self, soledad):
+    BATCH_SIZE = 250
+    PARSED_BODY_BUDGET = 16 * 1024 * 1024
+
+    def __init__(self, soledad, scheduler=shared_scheduler):
         self.soledad = soledad
+        self._mailbox_names_by_uuid = None
+        self._scheduler = scheduler
+        self._parsed_bodies = LRUCache(self.PARSED_BODY_BUDGET)
+        self._changes = SoledadChanges(soledad)
 
     @defer.inlineCallbacks
     def get_mail(self, mail_id, include_body=False):
@@ -220,20 +322,45 @@ class LeapMailStore(MailStore):
 
         defer.returnValue(leap_mail)
 
-    def get_mails(self, mail_ids):
-        deferreds = []
-        for mail_id in mail_ids:
-            deferreds.append(self.get_mail(mail_id))
+    def get_mails(self, mail_ids, include_body=False):
+        return self._get_in_batches(mail_ids, self._build_leap_mail, include_body)
+
+    def get_mail_summaries(self, mail_ids):
+        return self._get_in_batches(mail_ids, self._build_mail_summary)
+
+    @defer.inlineCallbacks
+    def get_mail_revisions(self, mail_ids):
+        # the flags doc is the only document of a mail that changes after it was stored
+        fdocs = yield self._get_docs_by_id([_mdoc_id_to_fdoc_id(mail_id) for mail_id in mail_ids])
+        defer.returnValue({_fdoc_id_to_mdoc_id(doc_id): doc.rev for doc_id, doc in fdocs.items()})
+
+    @defer.inlineCallbacks
+    def _get_in_batches(self, mail_ids, build, include_body=False):
+        batches = yield self._scheduler.map(lambda batch: self._get_mails_batch(batch, build, include_body), _batches(list(mail_ids), self.BATCH_SIZE))
+        defer.returnValue(flatten(batches))
 
-        return defer.gatherResults(deferreds, consumeErrors=True)
+    @defer.inlineCallbacks
+    def _get_mails_batch(self, mail_ids, build, include_body):
+        mdocs = yield self._get_docs_by_id(mail_ids)
+        mails = yield self._leap_mails_from_mdocs(mail_ids, mdocs, build, include_body)
+        defer.returnValue(mails)
 
     @defer.inlineCallbacks
     def get_mail_attachment(self, attachment_id):
+        content = yield self._get_attachment_content_doc(attachment_id)
+        defer.returnValue({'content-type': content.content_type, 'content': self._try_decode(
+            content.raw, content.content_transfer_encoding)})
+
+    @defer.inlineCallbacks
+    def get_mail_attachment_content(self, attachment_id):
+        content = yield self._get_attachment_content_doc(attachment_id)
+        defer.returnValue(AttachmentContent(content.raw, content.content_type, content.content_transfer_encoding))
+
+    @defer.inlineCallbacks
+    def _get_attachment_content_doc(self, attachment_id):
         results = yield self.soledad.get_from_index('by-type-and-payloadhash', 'cnt', attachment_id) if attachment_id else []
         if len(results):
-            content = ContentDocWrapper(**results[0].content)
-            defer.returnValue({'content-type': content.content_type, 'content': self._try_decode(
-                content.raw, content.content_transfer_encoding)})
+            defer.returnValue(ContentDocWrapper(**results[0].content))
         else:
             raise ValueError('No attachment with id %s found!' % attachment_id)
 
@@ -255,14 +382,64 @@ class LeapMailStore(MailStore):
         message.get_wrapper().set_flags(tuple(mail.flags))
         yield self._update_mail(message)  # TODO assert this is yielded (otherwise asynchronous)
 
+    def update_flags(self, mail_ids, add=(), remove=()):
+        def change_flags(fdoc):
+            _set_fdoc_flags(fdoc, (set(fdoc.content.get('flags', [])) | set(add)) - set(remove))
+
+        return self._update_fdocs(mail_ids, change_flags)
+
+    def update_tags(self, mail_ids, tags):
+        def change_tags(fdoc):
+            fdoc.content['tags'] = list(tags)
+
+        return self._update_fdocs(mail_ids, change_tags)
+
+    @defer.inlineCallbacks
+    def _update_fdocs(self, mail_ids, change):
+        # flags and tags live in the flags doc, so the headers and the body are never loaded
+        fdocs = yield self._get_docs_by_id([_mdoc_id_to_fdoc_id(mail_id) for mail_id in mail_ids])
+        for fdoc in fdocs.values():
+            change(fdoc)
+        yield self._scheduler.map(self.soledad.put_doc, fdocs.values())
+        defer.returnValue([_fdoc_id_to_mdoc_id(doc_id) for doc_id in fdocs])
+
     @defer.inlineCallbacks
     def all_mails(self):
         mdocs = yield self.soledad.get_from_index('by-type', 'meta')
 
         mail_ids = map(lambda doc: doc.doc_id, mdocs)
 
-        mails = yield self.get_mails(mail_ids)
-        defer.returnValue(mails)
+        mdocs_by_id = {doc.doc_id: doc for doc in mdocs}
+
+        batches = yield self._scheduler.map(lambda batch: self._leap_mails_from_mdocs(batch, mdocs_by_id, self._build_leap_mail), _batches(mail_ids, self.BATCH_SIZE))
+        defer.returnValue(flatten(batches))
+
+    @defer.inlineCallbacks
+    def iter_mails(self, batch_size=BATCH_SIZE):
+        """
+        Fires with an iterator of deferreds, each firing with the next ``batch_size`` mails.
+        A batch is only loaded when the iterator gets to it.
+        """
+        mdocs = yield self.soledad.get_from_index('by-type', 'meta')
+        defer.returnValue(self._iter_mail_batches(mdocs, batch_size))
+
+    def _iter_mail_batches(self, mdocs, batch_size):
+        for batch in _batches(mdocs, batch_size):
+            mdocs_by_id = {doc.doc_id: doc for doc in batch}
+            yield self._leap_mails_from_mdocs([doc.doc_id for doc in batch], mdocs_by_id, self._build_leap_mail)
+
+    @defer.inlineCallbacks
+    def mail_changes_since(self, generation):
+        """
+        Fires with the current generation of the local soledad db and the ids of the mails
+        whose meta or flags doc changed after generation, including deleted ones.
+        """
+        current_generation, doc_ids = yield self._changes.doc_ids_changed_since(generation)
+        mail_ids = unique([_fdoc_id_to_mdoc_id(doc_id) for doc_id in doc_ids if doc_id.startswith(('M-', 'F-'))])
+        defer.returnValue((current_generation, mail_ids))
+
+    def current_generation(self):
+        return self._changes.current_generation()
 
     @defer.inlineCallbacks
     def add_mailbox(self, mailbox_name):
@@ -277,6 +454,15 @@ class LeapMailStore(MailStore):
 
     @defer.inlineCallbacks
     def _mailbox_uuid_to_name_map(self):
+        if self._mailbox_names_by_uuid is None:
+            mailbox_names_by_uuid = yield self._load_mailbox_uuid_to_name_map()
+            if self._mailbox_names_by_uuid is None:
+                self._mailbox_names_by_uuid = mailbox_names_by_uuid
+
+        defer.returnValue(self._mailbox_names_by_uuid)
+
+    @defer.inlineCallbacks
+    def _load_mailbox_uuid_to_name_map(self):
         map = {}
         mbox_docs = yield self.soledad.get_from_index('by-type', 'mbox')
         for doc in mbox_docs:
@@ -284,16 +470,31 @@ class LeapMailStore(MailStore):
 
         defer.returnValue(map)
 
+    def refresh_after_sync(self):
+        # a sync may have brought in mailboxes created or deleted on another device
+        self._mailbox_names_by_uuid = None
+        return self._mailbox_uuid_to_name_map()
+
+    def _remember_mailbox(self, mailbox):
+        if self._mailbox_names_by_uuid is not None:
+            self._mailbox_names_by_uuid[underscore_uuid(mailbox.uuid)] = mailbox.mbox
+
+    def _forget_mailbox(self, mailbox):
+        if self._mailbox_names_by_uuid is not None and mailbox.uuid is not None:
+            self._mailbox_names_by_uuid.pop(underscore_uuid(mailbox.uuid), None)
+
     @defer.inlineCallbacks
     def add_mail(self, mailbox_name, raw_msg):
         mailbox = yield self._get_or_create_mailbox(mailbox_name)
         message = SoledadMailAdaptor().get_msg_from_string(Message, raw_msg)
         message.get_wrapper().set_mbox_uuid(mailbox.uuid)
 
+        relocated_id = yield self._free_mail_id(message.get_wrapper().mdoc.future_doc_id)
         yield SoledadMailAdaptor().create_msg(self.soledad, message)
 
         # add behavious from insert_mdoc_id from mail.py
         mail = yield self._leap_message_to_leap_mail(message.get_wrapper().mdoc.doc_id, message, include_body=True)  # TODO test that asserts include_body
+        mail.relocated_mail_id = relocated_id
         defer.returnValue(mail)
 
     @defer.inlineCallbacks
@@ -301,6 +502,21 @@ class LeapMailStore(MailStore):
         message = yield self._fetch_msg_from_soledad(mail_id)
         yield message.get_wrapper().delete(self.soledad)
 
+    @defer.inlineCallbacks
+    def delete_mails(self, mail_ids):
+        """
+        Deletes the meta and flags docs of the mails, like delete_mail does, but loads them
+        in batches. Fires with the ids of the mails that were found and deleted.
+        """
+        batches = yield self._scheduler.map(self._delete_mails_batch, _batches(list(mail_ids), self.BATCH_SIZE))
+        defer.returnValue(flatten(batches))
+
+    @defer.inlineCallbacks
+    def _delete_mails_batch(self, mail_ids):
+        docs = yield self._get_docs_by_id(flatten([(mail_id, _mdoc_id_to_fdoc_id(mail_id)) for mail_id in mail_ids]))
+        yield defer.gatherResults([self.soledad.delete_doc(doc) for doc in docs.values()], consumeErrors=True)
+        defer.returnValue([mail_id for mail_id in mail_ids if mail_id in docs])
+
     @defer.inlineCallbacks
     def get_mailbox_mail_ids(self, mailbox_name):
         mailbox = yield self._get_or_create_mailbox(mailbox_name)
@@ -314,24 +530,70 @@ class LeapMailStore(MailStore):
     def delete_mailbox(self, mailbox_name):
         mbx_wrapper = yield self._get_or_create_mailbox(mailbox_name)
         yield SoledadMailAdaptor().delete_mbox(self.soledad, mbx_wrapper)
+        self._forget_mailbox(mbx_wrapper)
 
     @defer.inlineCallbacks
     def copy_mail_to_mailbox(self, mail_id, mailbox_name):
-        message = yield self._fetch_msg_from_soledad(mail_id, load_body=True)
         mailbox = yield self._get_or_create_mailbox(mailbox_name)
+        copy_id = _mail_id_in_mailbox(mail_id, mailbox.uuid)
+        relocated_id = yield self._free_mail_id(copy_id)
+        if copy_id == mail_id and relocated_id is not None:
+            # the mail to copy was the one in the way, it is copied from where it lives now
+            mail_id = relocated_id
+
+        message = yield self._fetch_msg_from_soledad(mail_id, load_body=True)
         copy_wrapper = yield message.get_wrapper().copy(self.soledad, mailbox.uuid)
 
         leap_message = Message(copy_wrapper)
 
         mail = yield self._leap_message_to_leap_mail(copy_wrapper.mdoc.doc_id, leap_message, include_body=False)
+        mail.relocated_mail_id = relocated_id
 
         defer.returnValue(mail)
 
     @defer.inlineCallbacks
     def move_mail_to_mailbox(self, mail_id, mailbox_name):
-        mail_copy = yield self.copy_mail_to_mailbox(mail_id, mailbox_name)
-        yield self.delete_mail(mail_id)
-        defer.returnValue(mail_copy)
+        moved_mails = yield self.move_mails_to_mailbox([mail_id], mailbox_name)
+        defer.returnValue(moved_mails[0] if moved_mails else None)
+
+    @defer.inlineCallbacks
+    def move_mails_to_mailbox(self, mail_ids, mailbox_name):
+        """
+        Moves mails by pointing their flags docs to the other mailbox, without copying any
+        content. The mail ids stay the same, so they keep naming the mailbox a mail was
+        added to, until add_mail or copy_mail_to_mailbox need such an id again.
+        """
+        mailbox = yield self._get_or_create_mailbox(mailbox_name)
+        mbox_uuid = underscore_uuid(mailbox.uuid)
+
+        def change_mailbox(fdoc):
+            fdoc.content['mbox_uuid'] = mbox_uuid
+
+        moved_ids = yield self._update_fdocs(mail_ids, change_mailbox)
+        moved_mails = yield self.get_mails(moved_ids)
+        defer.returnValue(moved_mails)
+
+    @defer.inlineCallbacks
+    def _free_mail_id(self, mail_id):
+        """
+        Mails moved in place keep ids naming the mailbox they were added to, so adding or
+        copying the same content into that mailbox again would collide with them. A mail in
+        the way is moved the former way, by copying it within its current mailbox, which
+        gives it an id naming that mailbox, and deleting it under the old id.
+        Fires with the new id of the mail that was in the way, or None.
+        """
+        fdoc_id = _mdoc_id_to_fdoc_id(mail_id)
+        fdoc = (yield self._get_docs_by_id([fdoc_id])).get(fdoc_id)
+        mbox_uuid = underscore_uuid(fdoc.content['mbox_uuid']) if fdoc is not None else None
+        if mbox_uuid is None or mbox_uuid == _mbox_uuid_of(mail_id):
+            defer.returnValue(None)
+
+        relocated_id = _mail_id_in_mailbox(mail_id, mbox_uuid)
+        if relocated_id not in (yield self._get_docs_by_id([relocated_id])):
+            message = yield self._fetch_msg_from_soledad(mail_id, load_body=True)
+            yield message.get_wrapper().copy(self.soledad, mbox_uuid)
+        yield self._delete_mails_batch([mail_id])
+        defer.returnValue(relocated_id)
 
     def _update_mail(self, message):
         return message.get_wrapper().update(self.soledad)
@@ -344,19 +606,63 @@ class LeapMailStore(MailStore):
         else:
             body = None
 
-        # fetch mailbox name by mbox_uuid
-        mbox_uuid = message.get_wrapper().fdoc.mbox_uuid
-        mbox_name = yield self._mailbox_name_from_uuid(mbox_uuid)
+        mbox_map = yield self._mailbox_uuid_to_name_map()
+        defer.returnValue(self._build_leap_mail(mail_id, message, mbox_map, body=body))
+
+    @defer.inlineCallbacks
+    def _leap_mails_from_mdocs(self, mail_ids, mdocs_by_id, build, include_body=False):
+        mdocs = [mdocs_by_id[mail_id] for mail_id in mail_ids if mail_id in mdocs_by_id]
+        part_ids = flatten([(mdoc.content['fdoc'], mdoc.content['hdoc']) for mdoc in mdocs])
+        part_docs_by_id = yield self._get_docs_by_id(part_ids)
+        mbox_map = yield self._mailbox_uuid_to_name_map()
 
-        mail = LeapMail(mail_id, mbox_name, message.get_wrapper().hdoc.headers, set(message.get_tags()), set(message.get_flags()), body=body, attachments=self._extract_attachment_info_from(message))   # TODO assert flags are passed on
+        messages = [self._leap_message_from_docs(mdocs_by_id.get(mail_id), part_docs_by_id) for mail_id in mail_ids]
+        if include_body:
+            bodies = yield defer.gatherResults([defer.succeed(None) if _is_empty_message(message) else self._raw_message_body(message) for message in messages])
+
+        mails = []
+        for index, (mail_id, message) in enumerate(zip(mail_ids, messages)):
+            if _is_empty_message(message):
+                mails.append(None)
+            elif include_body:
+                mails.append(build(mail_id, message, mbox_map, body=bodies[index]))
+            else:
+                mails.append(build(mail_id, message, mbox_map))
 
-        defer.returnValue(mail)
+        defer.returnValue(mails)
+
+    def _leap_message_from_docs(self, mdoc, part_docs_by_id):
+        if mdoc is None:
+            return None
+        fdoc = part_docs_by_id.get(mdoc.content['fdoc'])
+        hdoc = part_docs_by_id.get(mdoc.content['hdoc'])
+        if fdoc is None or hdoc is None:
+            return None
+        return SoledadMailAdaptor().get_msg_from_docs(Message, mdoc, fdoc, hdoc)
+
+    @defer.inlineCallbacks
+    def _get_docs_by_id(self, doc_ids):
+        docs = (yield self.soledad.get_docs(doc_ids)) if doc_ids else []
+        defer.returnValue({doc.doc_id: doc for doc in docs if doc is not None})
+
+    def _build_leap_mail(self, mail_id, message, mbox_map, body=None):
+        mbox_name = mbox_map.get(message.get_wrapper().fdoc.mbox_uuid, '')
+        return LeapMail(mail_id, mbox_name, message.get_wrapper().hdoc.headers, set(message.get_tags()), set(message.get_flags()), body=body, attachments=self._extract_attachment_info_from(message))   # TODO assert flags are passed on
+
+    def _build_mail_summary(self, mail_id, message, mbox_map):
+        mbox_name = mbox_map.get(message.get_wrapper().fdoc.mbox_uuid, '')
+        return MailSummary(mail_id, mbox_name, message.get_wrapper().hdoc.headers, set(message.get_tags()), set(message.get_flags()), attachments=self._extract_attachment_info_from(message))
 
     @defer.inlineCallbacks
     def _raw_message_body(self, message):
         content_doc = (yield message.get_wrapper().get_body(self.soledad))
-        parser = BodyParser(content_doc.raw, content_type=content_doc.content_type, content_transfer_encoding=content_doc.content_transfer_encoding)
-        defer.returnValue(parser.parsed_content())
+        # content docs are addressed by the hash of their payload, so a parsed body never changes
+        body = self._parsed_bodies.get(content_doc.phash)
+        if body is None:
+            parser = BodyParser(content_doc.raw, content_type=content_doc.content_type, content_transfer_encoding=content_doc.content_transfer_encoding)
+            body = parser.parsed_content()
+            self._parsed_bodies.put(content_doc.phash, body, sys.getsizeof(body))
+        defer.returnValue(body)
 
     @defer.inlineCallbacks
     def _mailbox_name_from_uuid(self, uuid):
@@ -370,6 +676,7 @@ class LeapMailStore(MailStore):
         if mbx.uuid is None:
             mbx.uuid = str(uuid4())
             yield mbx.update(self.soledad)
+        self._remember_mailbox(mbx)
         defer.returnValue(mbx)
 
     def _fetch_msg_from_soledad(self, mail_id, load_body=False):
@@ -409,5 +716,28 @@ def _is_empty_message(message):
     return (message is None) or (message.get_wrapper().mdoc.doc_id is None)
 
 
+def _set_fdoc_flags(fdoc, flags):
+    fdoc.content['flags'] = list(flags)
+    fdoc.content['seen'] = Status.SEEN in flags
+    fdoc.content['deleted'] = Status.DELETED in flags
+    fdoc.content['recent'] = Status.RECENT in flags
+
+
+def _batches(items, batch_size):
+    return [items[i:i + batch_size] for i in xrange(0, len(items), batch_size)]
+
+
 def _fdoc_id_to_mdoc_id(fdoc_id):
     return 'M' + fdoc_id[1:]
+
+
+def _mdoc_id_to_fdoc_id(mdoc_id):
+    return 'F' + mdoc_id[1:]
+
+
+def _mbox_uuid_of(mdoc_id):
+    return mdoc_id[len('M-'):].rsplit('-', 1)[0]
+
+
+def _mail_id_in_mailbox(mdoc_id, mbox_uuid):
+    return constants.METAMSGID.format(mbox_uuid=underscore_uuid(mbox_uuid), chash=mdoc_id.rsplit('-', 1)[1])
@@ -16,24 +16,51 @@
 
 
 class MailStore(object):
-    def get_mail(self, mail_id):
+    def get_mail(self, mail_id, include_body=False):
         pass
 
     def get_mail_attachment(self, attachment_id):
         pass
 
-    def get_mails(self, mail_ids):
+    def get_mail_attachment_content(self, attachment_id):
+        pass
+
+    def get_mails(self, mail_ids, include_body=False):
+        pass
+
+    def get_mail_summaries(self, mail_ids):
+        pass
+
+    def get_mail_revisions(self, mail_ids):
         pass
 
     def all_mails(self):
         pass
 
+    def iter_mails(self, batch_size=None):
+        pass
+
+    def mail_changes_since(self, generation):
+        pass
+
+    def current_generation(self):
+        pass
+
     def delete_mail(self, mail_id):
         pass
 
+    def delete_mails(self, mail_ids):
+        pass
+
     def update_mail(self, mail):
         pass
 
+    def update_flags(self, mail_ids, add=(), remove=()):
+        pass
+
+    def update_tags(self, mail_ids, tags):
+        pass
+
     def add_mail(self, mailbox_name, mail):
         pass
 
@@ -55,6 +82,12 @@ class MailStore(object):
     def move_mail_to_mailbox(self, mail_id, mailbox_name):
         pass
 
+    def move_mails_to_mailbox(self, mail_ids, mailbox_name):
+        pass
+
+    def refresh_after_sync(self):
+        pass
+
 
 def underscore_uuid(uuid):
     return uuid.replace('-', '_')
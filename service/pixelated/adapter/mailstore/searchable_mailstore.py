@@ -16,13 +16,16 @@
 from twisted.internet import defer
 from types import FunctionType
 from pixelated.adapter.mailstore import MailStore
+from pixelated.adapter.search.indexed_mail_change import IndexedMailChange
 
 
 class SearchableMailStore(object):  # implementes MailStore
 
-    def __init__(self, delegate, search_engine):
+    def __init__(self, delegate, search_engine, index_queue=None):
         self._delegate = delegate
         self._search_engine = search_engine
+        # changes go through the queue when there is one, and straight into the index otherwise
+        self._index_writer = index_queue or search_engine
 
     @classmethod
     def _create_delegator(cls, method_name):
@@ -34,30 +37,65 @@ class SearchableMailStore(object):  # implementes MailStore
     @defer.inlineCallbacks
     def add_mail(self, mailbox_name, mail):
         stored_mail = yield self._delegate.add_mail(mailbox_name, mail)
-        self._search_engine.index_mail(stored_mail)
+        self._index_writer.index_mail(stored_mail)
+        yield self._index_relocated(stored_mail)
         defer.returnValue(stored_mail)
 
+    @defer.inlineCallbacks
+    def _index_relocated(self, mail):
+        # the mail stored under the id before lives on under another id, its index entry now belongs to the new mail
+        if mail.relocated_mail_id is not None:
+            relocated_mails = yield self._delegate.get_mails([mail.relocated_mail_id], include_body=True)
+            self._index_writer.index_mails(filter(None, relocated_mails))
+
     @defer.inlineCallbacks
     def delete_mail(self, mail_id):
         yield self._delegate.delete_mail(mail_id)
-        self._search_engine.remove_from_index(mail_id)
+        self._index_writer.remove_from_index(mail_id)
+
+    @defer.inlineCallbacks
+    def delete_mails(self, mail_ids):
+        deleted_ids = yield self._delegate.delete_mails(mail_ids)
+        self._index_writer.remove_all_from_index(mail_ids)
+        defer.returnValue(deleted_ids)
 
     @defer.inlineCallbacks
     def update_mail(self, mail):
         yield self._delegate.update_mail(mail)
-        self._search_engine.index_mail(mail)
+        self._index_writer.index_mail(mail)
+
+    # the index keeps what the mails were indexed with, so it is changed without loading them again
+
+    @defer.inlineCallbacks
+    def update_flags(self, mail_ids, add=(), remove=()):
+        updated_ids = yield self._delegate.update_flags(mail_ids, add, remove)
+        self._index_writer.change_mails(updated_ids, IndexedMailChange(add_flags=add, remove_flags=remove))
+        defer.returnValue(updated_ids)
+
+    @defer.inlineCallbacks
+    def update_tags(self, mail_ids, tags):
+        updated_ids = yield self._delegate.update_tags(mail_ids, tags)
+        self._index_writer.change_mails(updated_ids, IndexedMailChange(tags=tags))
+        defer.returnValue(updated_ids)
 
     @defer.inlineCallbacks
     def move_mail_to_mailbox(self, mail_id, mailbox_name):
         moved_mail = yield self._delegate.move_mail_to_mailbox(mail_id, mailbox_name)
-        self._search_engine.remove_from_index(mail_id)
-        self._search_engine.index_mail(moved_mail)
+        if moved_mail is not None:
+            self._index_writer.change_mails([moved_mail.mail_id], IndexedMailChange(mailbox_name=mailbox_name))
         defer.returnValue(moved_mail)
 
+    @defer.inlineCallbacks
+    def move_mails_to_mailbox(self, mail_ids, mailbox_name):
+        moved_mails = yield self._delegate.move_mails_to_mailbox(mail_ids, mailbox_name)
+        self._index_writer.change_mails([mail.mail_id for mail in moved_mails], IndexedMailChange(mailbox_name=mailbox_name))
+        defer.returnValue(moved_mails)
+
     @defer.inlineCallbacks
     def copy_mail_to_mailbox(self, mail_id, mailbox_name):
         copied_mail = yield self._delegate.copy_mail_to_mailbox(mail_id, mailbox_name)
-        self._search_engine.index_mail(copied_mail)
+        self._index_writer.index_mail(copied_mail)
+        yield self._index_relocated(copied_mail)
         defer.returnValue(copied_mail)
 
     def delete_mailbox(self, mailbox_name):
@@ -0,0 +1,45 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from twisted.internet import defer
+
+
+class SoledadChanges(object):
+    """
+    Reads the generation and the changes feed of the local soledad database.
+
+    Soledad does not expose them, so they are queried from the underlying u1db database
+    through the connection pool of soledad. This class is the only place relying on that
+    private attribute, keep it that way.
+    """
+
+    def __init__(self, soledad):
+        self._soledad = soledad
+
+    def current_generation(self):
+        """ Fires with the generation of the local database """
+        return self._run_query('_get_generation')
+
+    @defer.inlineCallbacks
+    def doc_ids_changed_since(self, generation):
+        """
+        Fires with the current generation and the ids of the documents changed after
+        generation, deleted ones included, in the order of their last change.
+        """
+        current_generation, _, changes = yield self._run_query('whats_changed', generation)
+        defer.returnValue((current_generation, [doc_id for doc_id, _, _ in changes]))
+
+    def _run_query(self, method_name, *args):
+        return self._soledad._dbpool.runU1DBQuery(method_name, *args)
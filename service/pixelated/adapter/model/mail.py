@@ -48,6 +48,8 @@ SIZE_KEY = 'size'
 
 
 class Mail(object):
+    __slots__ = ()
+
     @property
     def from_sender(self):
         return self.headers['From']
@@ -16,32 +16,65 @@
 
 from pixelated.support.encrypted_file_storage import EncryptedFileStorage
 
+import json
+import logging
 import os
 import re
+import threading
+from collections import defaultdict
 import dateutil.parser
 import time
+from twisted.internet import defer
 from pixelated.adapter.model.status import Status
 from pixelated.adapter.search.contacts import contacts_suggestions
+from pixelated.adapter.search.searcher_pool import SearcherPool
+from pixelated.adapter.search.tag_counter import TagCounter
 from whoosh.index import FileIndex
-from whoosh.fields import Schema, ID, KEYWORD, TEXT, NUMERIC
+from whoosh.columns import CompressedBytesColumn
+from whoosh.fields import Schema, ID, KEYWORD, TEXT, NUMERIC, COLUMN
 from whoosh.qparser import QueryParser
 from whoosh.qparser import MultifieldParser
+from whoosh.query import Or, Term
 from whoosh.writing import AsyncWriter
 from whoosh import sorting
 from pixelated.support.functional import unique
+from pixelated.support.lru_cache import LRUCache
+from pixelated.support.thread_pool import MeasuredThreadPool
 import traceback
 
 
+logger = logging.getLogger(__name__)
+
+
 class SearchEngine(object):
     DEFAULT_INDEX_HOME = os.path.join(os.environ['HOME'], '.leap')
     DEFAULT_TAGS = ['inbox', 'sent', 'drafts', 'trash']
-
-    def __init__(self, key, agent_home=DEFAULT_INDEX_HOME):
+    # increase whenever _mail_schema or the way mails are indexed changes, so the index gets rebuilt
+    SCHEMA_VERSION = 3
+    CHECKPOINT_FILE = 'checkpoint'
+    SEARCH_THREADS = 2
+    # number of mail idents kept of recent paginated search results
+    RESULT_CACHE_BUDGET = 5000
+    PARSED_QUERY_CACHE_SIZE = 256
+
+    def __init__(self, key, agent_home=DEFAULT_INDEX_HOME, search_pool=None, compression_level=None,
+                 temp_memory_limit=None):
         self.key = key
+        self.compression_level = compression_level
+        self.temp_memory_limit = temp_memory_limit
+        # queries run in a pool of their own, so a slow one neither blocks the reactor nor waits for soledad
+        self.search_pool = search_pool or MeasuredThreadPool('search', self.SEARCH_THREADS)
         self.index_folder = os.path.join(agent_home, 'search_index')
         if not os.path.exists(self.index_folder):
             os.makedirs(self.index_folder)
+        self.indexed_generation = None
         self._index = self._create_index()
+        self._searchers = SearcherPool(self._index)
+        self._tag_counter = TagCounter()
+        self._tag_counter.seed(self._indexed_tags())
+        self._cache_lock = threading.Lock()
+        self._results = LRUCache(self.RESULT_CACHE_BUDGET)
+        self._parsed_queries = LRUCache(self.PARSED_QUERY_CACHE_SIZE)
 
     def _add_to_tags(self, tags, group, skip_default_tags, count_type, query=None):
         query_matcher = re.compile(".*%s.*" % query.lower()) if query else re.compile(".*")
@@ -61,7 +94,7 @@ class SearchEngine(object):
         query_parser = QueryParser('tag', self._index.schema)
         options = {'limit': None, 'groupedby': sorting.FieldFacet('tag', allow_overlap=True), 'maptype': sorting.Count}
 
-        with self._index.searcher() as searcher:
+        with self._searchers.searcher() as searcher:
             total = searcher.search(query_parser.parse('*'), **options).groups()
             if not is_filtering_tags:
                 seen = searcher.search(query_parser.parse("* AND flags:%s" % Status.SEEN), **options).groups()
@@ -92,9 +125,51 @@ class SearchEngine(object):
         return tags.values()
 
     def tags(self, query, skip_default_tags):
-        is_filtering_tags = True if query else False
-        seen, total = self._search_tag_groups(is_filtering_tags=is_filtering_tags)
-        return self._build_tags(seen, total, skip_default_tags, query)
+        # the counts are kept up to date while indexing, so there is nothing to search for
+        return defer.succeed(self._tags(query, skip_default_tags))
+
+    def _tags(self, query, skip_default_tags):
+        seen = None if query else self._tag_counter.read()
+        return self._build_tags(seen, self._tag_counter.totals(), skip_default_tags, query)
+
+    def check_tag_counts(self):
+        """ Counts the tags in the index again and fires with True if the kept counts had drifted """
+        return self.search_pool.run(self._check_tag_counts)
+
+    def _check_tag_counts(self):
+        seen, total = self._search_tag_groups(is_filtering_tags=False)
+        drifted = dict(total) != self._tag_counter.totals() or dict(seen) != self._tag_counter.read()
+        if drifted:
+            logger.warn('Tag counts drifted from the index, counting them again')
+            self._tag_counter.seed(self._indexed_tags())
+        return drifted
+
+    def _indexed_tags(self):
+        """
+        Yields (mail id, tags, seen) of the indexed mails that have tags. Only the term postings
+        are read, which is a fraction of the stored documents.
+        """
+        with self._searchers.searcher() as searcher:
+            reader = searcher.reader()
+            tags_by_docnum = defaultdict(list)
+            for tag in reader.field_terms('tag'):
+                for docnum in reader.postings('tag', tag).all_ids():
+                    tags_by_docnum[docnum].append(tag)
+            seen = self._docnums(reader, 'flags', unicode(Status.SEEN))
+
+            for mail_id in reader.field_terms('ident'):
+                for docnum in reader.postings('ident', mail_id).all_ids():
+                    if docnum in tags_by_docnum:
+                        yield mail_id, tags_by_docnum[docnum], docnum in seen
+
+    def _docnums(self, reader, fieldname, text):
+        if (fieldname, text) not in reader:
+            return set()
+        return set(reader.postings(fieldname, text).all_ids())
+
+    def _keywords(self, value):
+        # splits a KEYWORD field value the way whoosh's comma tokenizer does
+        return [keyword.strip() for keyword in (value or u'').split(',') if keyword.strip()]
 
     def _mail_schema(self):
         return Schema(
@@ -108,37 +183,91 @@ class SearchEngine(object):
             body=TEXT(stored=False),
             tag=KEYWORD(stored=True, commas=True),
             flags=KEYWORD(stored=True, commas=True),
-            raw=TEXT(stored=False))
+            raw=TEXT(stored=False),
+            # what a mail was indexed with, so a change of its flags, tags or mailbox is indexed without
+            # loading it again. A column is only read when asked for, not along with the stored fields
+            document=COLUMN(CompressedBytesColumn()))
 
     def _create_index(self):
-        storage = EncryptedFileStorage(self.index_folder, self.key)
-        return FileIndex.create(storage, self._mail_schema(), indexname='mails')
+        self._storage = EncryptedFileStorage(self.index_folder, self.key, compression_level=self.compression_level,
+                                             temp_memory_limit=self.temp_memory_limit)
+        quarantined = self._storage.recover()
+        checkpoint = {} if quarantined else self._read_checkpoint()
+        if quarantined:
+            logger.warn('Rebuilding the search index without the corrupt files %s' % ', '.join(quarantined))
+        if checkpoint.get('schema_version') == self.SCHEMA_VERSION and self._storage.index_exists(indexname='mails'):
+            self.indexed_generation = checkpoint.get('generation')
+            return self._storage.open_index(indexname='mails')
+
+        if self._storage.file_exists(self.CHECKPOINT_FILE):
+            self._storage.delete_file(self.CHECKPOINT_FILE)
+        return FileIndex.create(self._storage, self._mail_schema(), indexname='mails')
+
+    def save_checkpoint(self, generation):
+        """ Remembers that the mails of all soledad docs up to generation are indexed """
+        with self._storage.create_file(self.CHECKPOINT_FILE) as checkpoint_file:
+            checkpoint_file.write(json.dumps({'schema_version': self.SCHEMA_VERSION, 'generation': generation}))
+        self._storage.sync()
+        self.indexed_generation = generation
+
+    def _read_checkpoint(self):
+        if not self._storage.file_exists(self.CHECKPOINT_FILE):
+            return {}
+        try:
+            with self._storage.open_file(self.CHECKPOINT_FILE) as checkpoint_file:
+                return json.loads(checkpoint_file.read())
+        except Exception:
+            traceback.print_exc()
+            return {}
 
     def index_mail(self, mail):
-        with AsyncWriter(self._index) as writer:
-                self._index_mail(writer, mail)
+        self.write_changes([mail], [])
 
-    def _index_mail(self, writer, mail):
+    def _mail_document(self, mail):
         mdict = mail.as_dict()
         header = mdict['header']
-        tags = set(mdict.get('tags', {}))
-        tags.add(mail.mailbox_name.lower())
-
-        index_data = {
+        return {
+            'ident': unicode(mdict['ident']),
+            'mailbox': mail.mailbox_name,
+            'tags': sorted(mdict.get('tags', {})),
+            'flags': sorted(mail.flags),
             'sender': self._empty_string_to_none(header.get('from', '')),
             'subject': self._empty_string_to_none(header.get('subject', '')),
             'date': self._format_utc_integer(header.get('date', '')),
             'to': self._format_recipient(header, 'to'),
             'cc': self._format_recipient(header, 'cc'),
             'bcc': self._format_recipient(header, 'bcc'),
-            'tag': u','.join(unique(tags)),
             'body': unicode(mdict['textPlainBody'] if 'textPlainBody' in mdict else mdict['body']),
-            'ident': unicode(mdict['ident']),
-            'flags': unicode(','.join(unique(mail.flags))),
             'raw': unicode(mail.raw)
         }
 
+    def _indexed_documents(self, mail_ids):
+        """ The documents the mails were indexed with, mails that are not indexed are left out """
+        documents = []
+        if not mail_ids:
+            return documents
+        with self._index.searcher() as searcher:
+            reader = searcher.reader()
+            if not reader.has_column('document'):
+                return documents
+            column = reader.column_reader('document')
+            for mail_id in mail_ids:
+                docnum = searcher.document_number(ident=unicode(mail_id))
+                if docnum is not None:
+                    documents.append(json.loads(column[docnum]))
+        return documents
+
+    def _index_document(self, writer, document):
+        tags = unique(list(document['tags']) + [document['mailbox'].lower()])
+        index_data = dict((key, value) for key, value in document.items() if key not in ('mailbox', 'tags'))
+        index_data.update({
+            'tag': u','.join(tags),
+            'flags': u','.join(document['flags']),
+            'document': json.dumps(document)
+        })
+
         writer.update_document(**index_data)
+        return document['ident'], self._keywords(index_data['tag']), Status.SEEN in document['flags']
 
     def _format_utc_integer(self, date):
         timetuple = dateutil.parser.parse(date).utctimetuple()
@@ -156,42 +285,58 @@ class SearchEngine(object):
 
     def index_mails(self, mails, callback=None):
         try:
-            with AsyncWriter(self._index) as writer:
-                for mail in mails:
-                    self._index_mail(writer, mail)
+            self.write_changes(mails, [])
             if callback:
                 callback()
         except Exception, e:
             traceback.print_exc(e)
             raise
 
-    def _search_with_options(self, options, query):
-        with self._index.searcher() as searcher:
-            query = QueryParser('raw', self._index.schema).parse(query)
-            results = searcher.search(query, **options)
-        return results
-
     def search(self, query, window=25, page=1, all_mails=False):
-        query = self.prepare_query(query)
-        return self._search_all_mails(query) if all_mails else self._paginated_search_mails(query, window, page)
+        return self.search_pool.run(self._search, query, window, page, all_mails)
+
+    def _search(self, query, window, page, all_mails):
+        if all_mails:
+            return self._search_all_mails(self.prepare_query(query))
+
+        page = int(page) if page is not None and int(page) > 1 else 1
+        window = int(window) if window is not None else 25
+        # a result is only used as long as nothing was committed to the index since it was searched
+        generation = self._index.latest_generation()
+        key = (query, window, page)
+        with self._cache_lock:
+            cached = self._results.get(key, usable=lambda cached: cached[0] == generation)
+        if cached is not None:
+            return cached[1]
+
+        result = self._paginated_search_mails(self.prepare_query(query), window, page)
+        with self._cache_lock:
+            self._results.put(key, (generation, result), size=len(result[0]) + 1)
+        return result
 
     def _search_all_mails(self, query):
-        with self._index.searcher() as searcher:
+        with self._searchers.searcher() as searcher:
             sorting_facet = sorting.FieldFacet('date', reverse=True)
             results = searcher.search(query, sortedby=sorting_facet, reverse=True, limit=None)
             return unique([mail['ident'] for mail in results])
 
     def _paginated_search_mails(self, query, window, page):
-        page = int(page) if page is not None and int(page) > 1 else 1
-        window = int(window) if window is not None else 25
-
-        with self._index.searcher() as searcher:
-            tags_facet = sorting.FieldFacet('tag', allow_overlap=True, maptype=sorting.Count)
+        with self._searchers.searcher() as searcher:
             sorting_facet = sorting.FieldFacet('date', reverse=True)
-            results = searcher.search_page(query, page, pagelen=window, groupedby=tags_facet, sortedby=sorting_facet)
-            return unique([mail['ident'] for mail in results]), sum(results.results.groups().values())
+            results = searcher.search_page(query, page, pagelen=window, sortedby=sorting_facet)
+            # the collector counted every match while sorting, so this is exact and costs nothing more
+            return unique([mail['ident'] for mail in results]), results.total
 
     def prepare_query(self, query):
+        with self._cache_lock:
+            parsed = self._parsed_queries.get(query)
+        if parsed is None:
+            parsed = self._parse_query(query)
+            with self._cache_lock:
+                self._parsed_queries.put(query, parsed, size=1)
+        return parsed
+
+    def _parse_query(self, query):
         query = (
             query
             .replace('-in:', 'AND NOT tag:')
@@ -199,10 +344,47 @@ class SearchEngine(object):
         )
         return MultifieldParser(['raw', 'body'], self._index.schema).parse(query)
 
+    def search_cache_stats(self):
+        return {'results': self._results.stats(), 'parsed_queries': self._parsed_queries.stats()}
+
     def remove_from_index(self, mail_id):
+        self.remove_all_from_index([mail_id])
+
+    def write_changes(self, mails, removed_mail_ids, changes=None):
+        """
+        Indexes the mails, applies the lists of IndexedMailChange by mail id to the mails as
+        they are indexed and removes the others in a single commit
+        """
+        changes = dict((unicode(mail_id), mail_changes) for mail_id, mail_changes in (changes or {}).items())
+        documents = [self._mail_document(mail) for mail in mails]
+        indexed_ids = set(document['ident'] for document in documents)
+        documents += self._indexed_documents([mail_id for mail_id in changes if mail_id not in indexed_ids])
+        for document in documents:
+            for change in changes.get(document['ident'], []):
+                change.apply(document)
+
         with AsyncWriter(self._index) as writer:
-            writer.delete_by_term('ident', mail_id)
+            if removed_mail_ids:
+                writer.delete_by_query(Or([Term('ident', unicode(mail_id)) for mail_id in removed_mail_ids]))
+            indexed = [self._index_document(writer, document) for document in documents]
+
+        for mail_id in removed_mail_ids:
+            self._tag_counter.remove(unicode(mail_id))
+        for mail_id, tags, seen in indexed:
+            self._tag_counter.update(mail_id, tags, seen)
+
+    def remove_all_from_index(self, mail_ids):
+        if mail_ids:
+            self.write_changes([], mail_ids)
+
+    def change_mails(self, mail_ids, change):
+        """ Applies the IndexedMailChange to the indexed mails """
+        if mail_ids:
+            self.write_changes([], [], dict((mail_id, [change]) for mail_id in mail_ids))
 
     def contacts(self, query):
-        with self._index.searcher() as searcher:
+        return self.search_pool.run(self._contacts, query)
+
+    def _contacts(self, query):
+        with self._searchers.searcher() as searcher:
             return contacts_suggestions(query, searcher)
@@ -0,0 +1,182 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import logging
+from collections import OrderedDict
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+from pixelated.support.thread_pool import MeasuredThreadPool
+
+
+logger = logging.getLogger(__name__)
+
+# queued in place of a mail that is to be removed from the index
+_REMOVED = object()
+
+
+class IndexQueue(object):
+    """
+    Collects changes to the search index and writes them to the SearchEngine in batches, so
+    a burst of changes ends up in a single commit instead of one commit per mail.
+
+    A batch is committed once it holds ``max_batch_size`` mails or its oldest change waited
+    ``max_delay`` seconds. Commits run one after the other in a thread of their own. Several
+    changes to the same mail are coalesced: indexing or removing a mail replaces what was queued
+    for it, changes of its flags, tags or mailbox are applied after what was queued.
+
+    It has the same methods to change the index as the SearchEngine, so either can be used.
+    """
+
+    DEFAULT_MAX_BATCH_SIZE = 100
+    DEFAULT_MAX_DELAY = 0.25
+
+    def __init__(self, search_engine, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY, clock=reactor, run_in_writer=None):
+        self._search_engine = search_engine
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._clock = clock
+        if run_in_writer is None:
+            run_in_writer = MeasuredThreadPool('search-index-writer', 1, reactor=clock).run
+            clock.addSystemEventTrigger('before', 'shutdown', self.flush)
+        self._run_in_writer = run_in_writer
+        self._pending = OrderedDict()
+        self._oldest_change = None
+        self._timer = None
+        self._writing = False
+        self._commit_requested = False
+        self._waiting_for_commit = []
+        self._waiting_for_writer = []
+        self._commits = 0
+        self._last_commit_size = 0
+        self._last_commit_duration = 0.0
+
+    def index_mail(self, mail):
+        self.index_mails([mail])
+
+    def index_mails(self, mails):
+        for mail in mails:
+            if mail is not None:
+                self._enqueue(mail.mail_id, mail, [])
+
+    def remove_from_index(self, mail_id):
+        self.remove_all_from_index([mail_id])
+
+    def remove_all_from_index(self, mail_ids):
+        for mail_id in mail_ids:
+            self._enqueue(mail_id, _REMOVED, [])
+
+    def change_mails(self, mail_ids, change):
+        for mail_id in mail_ids:
+            # without a queued mail the change is applied to the mail as it is indexed
+            mail, changes = self._pending.get(mail_id, (None, []))
+            if mail is not _REMOVED:
+                self._enqueue(mail_id, mail, changes + [change])
+
+    def flush(self):
+        """ Commits the queued changes now and fires once they are in the index """
+        if not self._pending and not self._writing:
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+        if self._pending:
+            self._waiting_for_commit.append(d)
+            self._commit()
+        else:
+            self._waiting_for_writer.append(d)
+        return d
+
+    @property
+    def lag(self):
+        """ Seconds the oldest queued change has been waiting for its commit """
+        if self._oldest_change is None:
+            return 0.0
+        return self._clock.seconds() - self._oldest_change
+
+    def stats(self):
+        return {
+            'queued': len(self._pending),
+            'lag': self.lag,
+            'writing': self._writing,
+            'commits': self._commits,
+            'last_commit_size': self._last_commit_size,
+            'last_commit_duration': self._last_commit_duration
+        }
+
+    def _enqueue(self, mail_id, mail, changes):
+        self._pending.pop(mail_id, None)
+        self._pending[mail_id] = (mail, changes)
+        if self._oldest_change is None:
+            self._oldest_change = self._clock.seconds()
+
+        if len(self._pending) >= self.max_batch_size:
+            self._commit()
+        elif self._timer is None:
+            self._timer = self._clock.callLater(self.max_delay, self._commit)
+
+    def _commit(self):
+        if self._timer is not None:
+            if self._timer.active():
+                self._timer.cancel()
+            self._timer = None
+
+        if self._writing:
+            # there is a single writer, so the next batch is committed after the current one
+            self._commit_requested = True
+            return
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, OrderedDict()
+        waiting, self._waiting_for_commit = self._waiting_for_commit, []
+        self._oldest_change = None
+        self._writing = True
+        started = self._clock.seconds()
+
+        mails = [mail for mail, _ in batch.values() if mail not in (None, _REMOVED)]
+        removed_ids = [mail_id for mail_id, (mail, _) in batch.items() if mail is _REMOVED]
+        changes = dict((mail_id, changes) for mail_id, (_, changes) in batch.items() if changes)
+        d = defer.maybeDeferred(self._run_in_writer, self._search_engine.write_changes, mails, removed_ids, changes)
+
+        def committed(result):
+            self._commits += 1
+            self._last_commit_size = len(batch)
+            self._last_commit_duration = self._clock.seconds() - started
+            logger.debug('Committed %d index changes: %s' % (len(batch), self.stats()))
+            return result
+
+        def failed(failure):
+            logger.error('Could not commit %d index changes: %s' % (len(batch), failure.getErrorMessage()))
+            return failure
+
+        d.addCallbacks(committed, failed)
+        d.addBoth(self._written, waiting)
+
+    def _written(self, result, waiting):
+        self._writing = False
+        for d in waiting:
+            d.errback(result) if isinstance(result, Failure) else d.callback(None)
+
+        if self._pending and (self._commit_requested or len(self._pending) >= self.max_batch_size):
+            self._commit_requested = False
+            self._commit()
+        elif self._pending:
+            if self._timer is None:
+                self._timer = self._clock.callLater(self.max_delay, self._commit)
+        else:
+            self._commit_requested = False
+            waiting, self._waiting_for_writer = self._waiting_for_writer, []
+            for d in waiting:
+                d.callback(None)
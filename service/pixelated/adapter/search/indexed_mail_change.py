@@ -0,0 +1,35 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+
+
+class IndexedMailChange(object):
+    """
+    A change to the flags, tags or mailbox of an indexed mail. It is applied to the document
+    the mail was indexed with, so the mail does not have to be loaded again.
+    """
+
+    def __init__(self, add_flags=(), remove_flags=(), tags=None, mailbox_name=None):
+        self.add_flags = set(add_flags)
+        self.remove_flags = set(remove_flags)
+        self.tags = set(tags) if tags is not None else None
+        self.mailbox_name = mailbox_name
+
+    def apply(self, document):
+        document['flags'] = sorted((set(document['flags']) | self.add_flags) - self.remove_flags)
+        if self.tags is not None:
+            document['tags'] = sorted(self.tags)
+        if self.mailbox_name is not None:
+            document['mailbox'] = self.mailbox_name
@@ -0,0 +1,71 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import threading
+from contextlib import contextmanager
+
+
+class SearcherPool(object):
+    """
+    Keeps the searchers of an index open between queries. Opening a searcher reads and
+    decrypts all segment files of the index, so doing it for every query is expensive.
+
+    A searcher is used by one thread at a time. It is refreshed when it is checked out and
+    the index generation changed since, which only reopens the segments that changed.
+    """
+
+    def __init__(self, index):
+        self._index = index
+        self._idle = []
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._refreshed = 0
+
+    @contextmanager
+    def searcher(self):
+        searcher = self._checkout()
+        try:
+            yield searcher
+        finally:
+            self._checkin(searcher)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for searcher in idle:
+            searcher.close()
+
+    def stats(self):
+        return {'idle': len(self._idle), 'opened': self._opened, 'refreshed': self._refreshed}
+
+    def _checkout(self):
+        with self._lock:
+            searcher = self._idle.pop() if self._idle else None
+
+        if searcher is None:
+            self._count('_opened')
+            return self._index.searcher()
+        if searcher.up_to_date():
+            return searcher
+        self._count('_refreshed')
+        return searcher.refresh()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _checkin(self, searcher):
+        with self._lock:
+            self._idle.append(searcher)
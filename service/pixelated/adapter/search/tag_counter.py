@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import threading
+from collections import Counter
+
+
+class TagCounter(object):
+    """
+    Counts the indexed mails and the read ones per tag, so they don't have to be counted
+    by searching the whole index.
+
+    It remembers the tags of every mail to know which counts change when a mail is indexed
+    again or removed. Mails with the same tags share one set of them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def seed(self, mails):
+        """ Starts over with the given (mail id, tags, seen) tuples """
+        with self._lock:
+            self._reset()
+            for mail_id, tags, seen in mails:
+                self._update(mail_id, tags, seen)
+
+    def update(self, mail_id, tags, seen):
+        with self._lock:
+            self._update(mail_id, tags, seen)
+
+    def remove(self, mail_id):
+        with self._lock:
+            self._remove(mail_id)
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+    def read(self):
+        with self._lock:
+            return dict(self._read)
+
+    def _reset(self):
+        self._mails = {}
+        self._tag_sets = {}
+        self._totals = Counter()
+        self._read = Counter()
+
+    def _update(self, mail_id, tags, seen):
+        self._remove(mail_id)
+        tags = frozenset(tags)
+        tags = self._tag_sets.setdefault(tags, tags)
+        self._mails[mail_id] = (tags, seen)
+        self._count(tags, seen, 1)
+
+    def _remove(self, mail_id):
+        if mail_id in self._mails:
+            tags, seen = self._mails.pop(mail_id)
+            self._count(tags, seen, -1)
+
+    def _count(self, tags, seen, step):
+        for tag in tags:
+            self._change(self._totals, tag, step)
+            if seen:
+                self._change(self._read, tag, step)
+
+    def _change(self, counter, tag, step):
+        counter[tag] += step
+        if counter[tag] <= 0:
+            del counter[tag]
@@ -33,12 +33,24 @@ class MailService(object):
         mails = yield self.mail_store.all_mails()
         defer.returnValue(mails)
 
+    def iter_mails(self):
+        return self.mail_store.iter_mails()
+
+    def mail_changes_since(self, generation):
+        return self.mail_store.mail_changes_since(generation)
+
+    def current_generation(self):
+        return self.mail_store.current_generation()
+
+    def mails_by_id(self, mail_ids, include_body=False):
+        return self.mail_store.get_mails(mail_ids, include_body=include_body)
+
     @defer.inlineCallbacks
     def mails(self, query, window_size, page):
-        mail_ids, total = self.search_engine.search(query, window_size, page)
+        mail_ids, total = yield self.search_engine.search(query, window_size, page)
 
         try:
-            mails = yield self.mail_store.get_mails(mail_ids)
+            mails = yield self.mail_store.get_mail_summaries(mail_ids)
             defer.returnValue((mails, total))
         except Exception, e:
             import traceback
@@ -51,24 +63,24 @@ class MailService(object):
         reserved_words = extract_reserved_tags(new_tags)
         if len(reserved_words):
             raise ValueError('None of the following words can be used as tags: ' + ' '.join(reserved_words))
-        new_tags = self._favor_existing_tags_casing(new_tags)
-        mail = yield self.mail(mail_id)
-        mail.tags = set(new_tags)
-        yield self.mail_store.update_mail(mail)
+        new_tags = yield self._favor_existing_tags_casing(new_tags)
+        yield self.mail_store.update_tags([mail_id], set(new_tags))
+        mail = yield self.mail_store.get_mail(mail_id, include_body=False)
 
         defer.returnValue(mail)
 
     def _filter_white_space_tags(self, tags):
         return [tag.strip() for tag in tags if not tag.isspace()]
 
+    @defer.inlineCallbacks
     def _favor_existing_tags_casing(self, new_tags):
-        current_tags = [tag['name'] for tag in self.search_engine.tags(query='', skip_default_tags=True)]
+        current_tags = [tag['name'] for tag in (yield self.search_engine.tags(query='', skip_default_tags=True))]
         current_tags_lower = [tag.lower() for tag in current_tags]
 
         def _use_current_casing(new_tag_lower):
             return current_tags[current_tags_lower.index(new_tag_lower)]
 
-        return [_use_current_casing(new_tag.lower()) if new_tag.lower() in current_tags_lower else new_tag for new_tag in new_tags]
+        defer.returnValue([_use_current_casing(new_tag.lower()) if new_tag.lower() in current_tags_lower else new_tag for new_tag in new_tags])
 
     def mail(self, mail_id):
         return self.mail_store.get_mail(mail_id, include_body=True)
@@ -76,6 +88,9 @@ class MailService(object):
     def attachment(self, attachment_id):
         return self.mail_store.get_mail_attachment(attachment_id)
 
+    def attachment_content(self, attachment_id):
+        return self.mail_store.get_mail_attachment_content(attachment_id)
+
     @defer.inlineCallbacks
     def mail_exists(self, mail_id):
         try:
@@ -106,29 +121,45 @@ class MailService(object):
         yield self.mail_store.update_mail(sent_mail)
         defer.returnValue(sent_mail)
 
-    @defer.inlineCallbacks
-    def mark_as_read(self, mail_id):
-        mail = yield self.mail(mail_id)
-        mail.flags.add(Status.SEEN)
-        yield self.mail_store.update_mail(mail)
+    def mark_as_read(self, mail_ids):
+        return self.mail_store.update_flags(mail_ids, add=[Status.SEEN])
+
+    def mark_as_unread(self, mail_ids):
+        return self.mail_store.update_flags(mail_ids, remove=[Status.SEEN])
+
+    def delete_mail(self, mail_id):
+        return self.delete_mails([mail_id])
 
     @defer.inlineCallbacks
-    def mark_as_unread(self, mail_id):
-        mail = yield self.mail(mail_id)
-        mail.flags.remove(Status.SEEN)
-        yield self.mail_store.update_mail(mail)
+    def delete_mails(self, mail_ids):
+        """ Moves the mails to the trash, deleting those that already are in it """
+        mails = yield self.mail_store.get_mails(mail_ids)
+        mails = filter(None, mails)
+        trashed_ids = [mail.mail_id for mail in mails if mail.mailbox_name.upper() == u'TRASH']
+        other_ids = [mail.mail_id for mail in mails if mail.mailbox_name.upper() != u'TRASH']
+
+        if trashed_ids:
+            yield self.mail_store.delete_mails(trashed_ids)
+        if other_ids:
+            yield self.mail_store.move_mails_to_mailbox(other_ids, 'TRASH')
 
     @defer.inlineCallbacks
-    def delete_mail(self, mail_id):
-        mail = yield self.mail(mail_id)
-        if mail.mailbox_name.upper() == u'TRASH':
-            yield self.mail_store.delete_mail(mail_id)
+    def empty_mailbox(self, mailbox_name):
+        """ Does what delete_mails does to every mail in the mailbox """
+        mail_ids = yield self.mail_store.get_mailbox_mail_ids(mailbox_name)
+        if not mail_ids:
+            return
+        if mailbox_name.upper() == u'TRASH':
+            yield self.mail_store.delete_mails(mail_ids)
         else:
-            yield self.mail_store.move_mail_to_mailbox(mail_id, 'TRASH')
+            yield self.mail_store.move_mails_to_mailbox(mail_ids, 'TRASH')
 
-    @defer.inlineCallbacks
     def recover_mail(self, mail_id):
-        yield self.mail_store.move_mail_to_mailbox(mail_id, 'INBOX')
+        return self.recover_mails([mail_id])
+
+    @defer.inlineCallbacks
+    def recover_mails(self, mail_ids):
+        yield self.mail_store.move_mails_to_mailbox(mail_ids, 'INBOX')
 
     @defer.inlineCallbacks
     def delete_permanent(self, mail_id):
@@ -71,6 +71,7 @@ class LeapSession(object):
         self.nicknym = nicknym
         self.fresh_account = False
         register(events.KEYMANAGER_FINISHED_KEY_GENERATION, self._set_fresh_account)
+        register(events.SOLEDAD_DONE_DATA_SYNC, self._on_soledad_sync)
 
     @defer.inlineCallbacks
     def initial_sync(self):
@@ -96,6 +97,17 @@ class LeapSession(object):
     def _set_fresh_account(self, *args):
         self.fresh_account = True
 
+    def _on_soledad_sync(self, *args):
+        reactor.callFromThread(self._refresh_after_sync)
+
+    def _refresh_after_sync(self):
+        d = defer.maybeDeferred(self.mail_store.refresh_after_sync)
+        d.addErrback(self._print_refresh_failure)
+        return d
+
+    def _print_refresh_failure(self, failure):
+        failure.printTraceback(file=sys.stderr)
+
     def account_email(self):
         name = self.user_auth.username
         return self.provider.address_for(name)
@@ -1,8 +1,10 @@
 from pixelated.adapter.mailstore.searchable_mailstore import SearchableMailStore
+from pixelated.adapter.mailstore.caching_mailstore import CachingMailStore
 from pixelated.adapter.services.mail_service import MailService
 from pixelated.adapter.model.mail import InputMail
 from pixelated.adapter.services.mail_sender import MailSender
 from pixelated.adapter.search import SearchEngine
+from pixelated.adapter.search.index_queue import IndexQueue
 from pixelated.adapter.services.draft_service import DraftService
 from pixelated.adapter.listeners.mailbox_indexer_listener import listen_all_mailboxes
 from twisted.internet import defer
@@ -24,9 +26,10 @@ class Services(object):
             leap_home,
             search_index_storage_key)
 
+        self.index_queue = IndexQueue(self.search_engine)
         self.wrap_mail_store_with_indexing_mail_store(leap_session)
 
-        yield listen_all_mailboxes(leap_session.account, self.search_engine, leap_session.mail_store)
+        yield listen_all_mailboxes(leap_session.account, self.search_engine, leap_session.mail_store, self.index_queue)
 
         self.mail_service = self.setup_mail_service(
             leap_session,
@@ -39,12 +42,37 @@ class Services(object):
         yield self.index_all_mails()
 
     def wrap_mail_store_with_indexing_mail_store(self, leap_session):
-        leap_session.mail_store = SearchableMailStore(leap_session.mail_store, self.search_engine)
+        leap_session.mail_store = SearchableMailStore(CachingMailStore(leap_session.mail_store), self.search_engine, self.index_queue)
 
     @defer.inlineCallbacks
     def index_all_mails(self):
-        all_mails = yield self.mail_service.all_mails()
-        self.search_engine.index_mails(all_mails)
+        if self.search_engine.indexed_generation is None:
+            yield self._rebuild_index()
+        else:
+            yield self._index_changes_since(self.search_engine.indexed_generation)
+
+    @defer.inlineCallbacks
+    def _rebuild_index(self):
+        # mails changed while indexing are newer than this generation and get indexed on the next start
+        generation = yield self.mail_service.current_generation()
+        batches = yield self.mail_service.iter_mails()
+        for batch in batches:
+            mails = yield batch
+            self.index_queue.index_mails(mails)
+            # keeps at most one batch of mails waiting for the index
+            yield self.index_queue.flush()
+        self.search_engine.save_checkpoint(generation)
+
+    @defer.inlineCallbacks
+    def _index_changes_since(self, generation):
+        generation, mail_ids = yield self.mail_service.mail_changes_since(generation)
+        if mail_ids:
+            mails = yield self.mail_service.mails_by_id(mail_ids, include_body=True)
+            self.index_queue.index_mails(mails)
+            self.index_queue.remove_all_from_index([mail_id for mail_id, mail in zip(mail_ids, mails) if mail is None])
+        # the checkpoint must not claim changes that are still waiting in the queue
+        yield self.index_queue.flush()
+        self.search_engine.save_checkpoint(generation)
 
     @defer.inlineCallbacks
     def setup_search_engine(self, leap_home, search_index_storage_key):
@@ -26,6 +26,7 @@ from pixelated.config import logger, arguments
 
 from leap.mail.constants import MessageFlags
 from pixelated.support.mail_generator import MailGenerator
+from pixelated.support.scheduler import shared_scheduler
 
 REPAIR_COMMAND = 'repair'
 
@@ -154,8 +155,12 @@ def _add_mail(store, folder_name, mail, flags, tags):
     yield store.update_mail(leap_mail)
 
 
+def _add_mails(store, pending_mails):
+    return shared_scheduler.map(lambda (folder_name, mail, flags, tags): _add_mail(store, folder_name, mail, flags, tags), pending_mails)
+
+
 @defer.inlineCallbacks
-def add_mail_folder(store, mailbox, folder_name, deferreds):
+def add_mail_folder(store, mailbox, folder_name, pending_mails):
     yield store.add_mailbox(folder_name)
 
     for mail in mailbox:
@@ -174,7 +179,7 @@ def add_mail_folder(store, mailbox, folder_name, deferreds):
 
         tags = mail['X-Tags'].split() if mail['X-Tags'] else []
 
-        deferreds.append(_add_mail(store, folder_name, mail, flags, tags))
+        pending_mails.append((folder_name, mail, flags, tags))
 
 
 @defer.inlineCallbacks
@@ -189,20 +194,20 @@ def load_mails(args, mail_paths):
 
 @defer.inlineCallbacks
 def _load_mails_as_is(mail_paths, store):
-    deferreds = []
+    pending_mails = []
 
     for path in mail_paths:
         if isfile(path):
             mbox_mails = mbox(path, factory=None)
-            yield add_mail_folder(store, mbox_mails, 'INBOX', deferreds)
+            yield add_mail_folder(store, mbox_mails, 'INBOX', pending_mails)
         else:
             maildir = Maildir(path, factory=None)
-            yield add_mail_folder(store, maildir, 'INBOX', deferreds)
+            yield add_mail_folder(store, maildir, 'INBOX', pending_mails)
             for mail_folder_name in maildir.list_folders():
                 mail_folder = maildir.get_folder(mail_folder_name)
-                yield add_mail_folder(store, mail_folder, mail_folder_name, deferreds)
+                yield add_mail_folder(store, mail_folder, mail_folder_name, pending_mails)
 
-    yield defer.gatherResults(deferreds, consumeErrors=True)
+    yield _add_mails(store, pending_mails)
 
 
 @defer.inlineCallbacks
@@ -214,9 +219,9 @@ def markov_generate(args, mail_paths, limit, seed):
     server_name = leap_session.provider.server_name
 
     markov_mails = _generate_mails(limit, mail_paths, seed, server_name, username)
-    deferreds = []
-    yield add_mail_folder(store, markov_mails, 'INBOX', deferreds)
-    yield defer.gatherResults(deferreds, consumeErrors=True)
+    pending_mails = []
+    yield add_mail_folder(store, markov_mails, 'INBOX', pending_mails)
+    yield _add_mails(store, pending_mails)
 
     defer.returnValue(args)
 
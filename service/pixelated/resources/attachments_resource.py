@@ -14,8 +14,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
-import io
-
 import re
 from twisted.protocols.basic import FileSender
 from twisted.python.log import msg
@@ -40,6 +38,13 @@ class AttachmentResource(Resource):
             request.finish()
         encoding = request.args.get('encoding', [None])[0]
         filename = request.args.get('filename', [self.attachment_id])[0]
+
+        if _etag_matches(request.getHeader(b'If-None-Match'), self._etag()):
+            self._set_cache_headers(request)
+            request.code = 304
+            request.finish()
+            return server.NOT_DONE_YET
+
         request.setHeader(b'Content-Type', b'application/force-download')
         request.setHeader(b'Content-Disposition', bytes('attachment; filename=' + filename))
 
@@ -50,22 +55,80 @@ class AttachmentResource(Resource):
 
     @defer.inlineCallbacks
     def _send_attachment(self, encoding, filename, request):
-        attachment = yield self.mail_service.attachment(self.attachment_id)
-
-        bytes_io = io.BytesIO(attachment['content'])
+        content = yield self.mail_service.attachment_content(self.attachment_id)
+        size = content.size
+        self._set_cache_headers(request)
+        byte_range = _requested_range(request.getHeader(b'Range'), size)
+
+        request.setHeader(b'Accept-Ranges', b'bytes')
+        if byte_range is _UNSATISFIABLE:
+            request.code = 416
+            request.setHeader(b'Content-Range', bytes('bytes */%d' % size))
+            request.finish()
+            return
+
+        if byte_range:
+            start, end = byte_range
+            request.code = 206
+            request.setHeader(b'Content-Range', bytes('bytes %d-%d/%d' % (start, end, size)))
+        else:
+            start, end = 0, size - 1
+            request.code = 200
+        request.setHeader(b'Content-Length', bytes(end - start + 1))
 
+        reader = content.open(start, end)
         try:
-            request.code = 200
-            yield FileSender().beginFileTransfer(bytes_io, request)
+            yield FileSender().beginFileTransfer(reader, request)
         finally:
-            bytes_io.close()
+            reader.close()
             request.finish()
 
+    def _etag(self):
+        return bytes('"%s"' % self.attachment_id)
+
+    def _set_cache_headers(self, request):
+        # attachments are addressed by the hash of their content, so they never change
+        request.setHeader(b'ETag', self._etag())
+        request.setHeader(b'Cache-Control', b'private, max-age=31536000, immutable')
+
     def _extract_mimetype(self, content_type):
         match = re.compile('([A-Za-z-]+\/[A-Za-z-]+)').search(content_type)
         return match.group(1)
 
 
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    return any(tag.strip() in ('*', etag) for tag in if_none_match.split(','))
+
+
+_RANGE = re.compile('^bytes=(\d*)-(\d*)$')
+_UNSATISFIABLE = object()
+
+
+def _requested_range(header, size):
+    """
+    The (start, end) of a single byte range request, None to send the whole attachment
+    or _UNSATISFIABLE if the range lies outside of it.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if match is None or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if int(last) == 0 or size == 0:
+            return _UNSATISFIABLE
+        return max(size - int(last), 0), size - 1
+
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return _UNSATISFIABLE
+    return start, min(int(last), size - 1) if last else size - 1
+
+
 class AttachmentsResource(Resource):
 
     def __init__(self, mail_service):
@@ -15,7 +15,6 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
 from pixelated.resources import respond_json_deferred
-from twisted.internet.threads import deferToThread
 from twisted.web import server
 from twisted.web.resource import Resource
 
@@ -30,7 +29,7 @@ class ContactsResource(Resource):
 
     def render_GET(self, request):
         query = request.args.get('q', [''])
-        d = deferToThread(lambda: self._search_engine.contacts(query))
+        d = self._search_engine.contacts(query)
         d.addCallback(lambda tags: respond_json_deferred(tags, request))
 
         def handle_error(error):
@@ -22,13 +22,10 @@ class MailsUnreadResource(Resource):
 
     def render_POST(self, request):
         idents = json.load(request.content).get('idents')
-        deferreds = []
-        for ident in idents:
-            deferreds.append(self._mail_service.mark_as_unread(ident))
 
-        d = defer.gatherResults(deferreds, consumeErrors=True)
-        d.addCallback(lambda _: respond_json_deferred(None, request))
-        d.addErrback(lambda _: respond_json_deferred(None, request, status_code=500))
+        d = self._mail_service.mark_as_unread(idents)
+        d.addCallbacks(lambda _: respond_json_deferred(None, request),
+                       lambda _: respond_json_deferred(None, request, status_code=500))
 
         return NOT_DONE_YET
 
@@ -42,13 +39,10 @@ class MailsReadResource(Resource):
 
     def render_POST(self, request):
         idents = json.load(request.content).get('idents')
-        deferreds = []
-        for ident in idents:
-            deferreds.append(self._mail_service.mark_as_read(ident))
 
-        d = defer.gatherResults(deferreds, consumeErrors=True)
-        d.addCallback(lambda _: respond_json_deferred(None, request))
-        d.addErrback(lambda _: respond_json_deferred(None, request, status_code=500))
+        d = self._mail_service.mark_as_read(idents)
+        d.addCallbacks(lambda _: respond_json_deferred(None, request),
+                       lambda _: respond_json_deferred(None, request, status_code=500))
 
         return NOT_DONE_YET
 
@@ -65,14 +59,13 @@ class MailsDeleteResource(Resource):
             err(failure, 'something failed')
             request.finish()
 
-        idents = json.loads(request.content.read())['idents']
-        deferreds = []
-        for ident in idents:
-            deferreds.append(self._mail_service.delete_mail(ident))
+        content = json.loads(request.content.read())
+        if 'mailbox' in content:
+            d = self._mail_service.empty_mailbox(content['mailbox'])
+        else:
+            d = self._mail_service.delete_mails(content['idents'])
 
-        d = defer.gatherResults(deferreds, consumeErrors=True)
-        d.addCallback(lambda _: respond_json_deferred(None, request))
-        d.addErrback(response_failed)
+        d.addCallbacks(lambda _: respond_json_deferred(None, request), response_failed)
         return NOT_DONE_YET
 
 
@@ -85,12 +78,10 @@ class MailsRecoverResource(Resource):
 
     def render_POST(self, request):
         idents = json.loads(request.content.read())['idents']
-        deferreds = []
-        for ident in idents:
-            deferreds.append(self._mail_service.recover_mail(ident))
-        d = defer.gatherResults(deferreds, consumeErrors=True)
-        d.addCallback(lambda _: respond_json_deferred(None, request))
-        d.addErrback(lambda _: respond_json_deferred(None, request, status_code=500))
+
+        d = self._mail_service.recover_mails(idents)
+        d.addCallbacks(lambda _: respond_json_deferred(None, request),
+                       lambda _: respond_json_deferred(None, request, status_code=500))
         return NOT_DONE_YET
 
 
@@ -123,7 +114,7 @@ class MailsResource(Resource):
             "stats": {
                 "total": total,
             },
-            "mails": [mail.as_dict() for mail in mails]
+            "mails": [mail.as_dict() for mail in mails if mail]
         })
         d.addCallback(lambda res: respond_json_deferred(res, request))
 
@@ -15,7 +15,6 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
 from pixelated.resources import respond_json_deferred
-from twisted.internet.threads import deferToThread
 from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET
 
@@ -32,7 +31,7 @@ class TagsResource(Resource):
         query = request.args.get('q', [''])[0]
         skip_default_tags = request.args.get('skipDefaultTags', [False])[0]
 
-        d = deferToThread(lambda: self._search_engine.tags(query=query, skip_default_tags=skip_default_tags))
+        d = self._search_engine.tags(query=query, skip_default_tags=skip_default_tags)
         d.addCallback(lambda tags: respond_json_deferred(tags, request))
 
         return NOT_DONE_YET
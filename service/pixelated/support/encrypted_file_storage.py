@@ -15,28 +15,347 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
 import io
+import logging
+import struct
+from collections import namedtuple
+from cStringIO import StringIO
 from hashlib import sha256
 
 import os
+import errno
 import hmac
-from whoosh.filedb.filestore import FileStorage
+import shutil
+import threading
+import zlib
+from Queue import Queue
+from whoosh.filedb.filestore import FileStorage, Storage, ReadOnlyError
 from whoosh.filedb.structfile import StructFile, BufferFile
 from leap.soledad.client.crypto import encrypt_sym
 from leap.soledad.client.crypto import decrypt_sym
 from leap.soledad.common.crypto import EncryptionMethods
 from whoosh.util import random_name
+from pixelated.support.lru_cache import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+MAC_SIZE = 32
+IV_SIZE = 25
+
+
+class ChunkAuthenticationError(Exception):
+    pass
+
+
+def _remove_if_present(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+FileHeader = namedtuple('FileHeader', ['file_id', 'chunk_size', 'length', 'content_hash', 'compressed', 'data_offset', 'record_offsets'])
+
+
+class SharedBufferFile(BufferFile):
+    """ A BufferFile reading straight from a string that other files share, instead of from a copy of it """
+
+    def __init__(self, content, name=None, onclose=None):
+        self._buf = buffer(content)
+        self._name = name
+        self.file = StringIO(content)
+        self.onclose = onclose
+
+        self.is_real = False
+        self.is_closed = False
+
+    def subset(self, position, length, name=None):
+        # the files inside a compound segment file share its buffer, too
+        return SharedBufferFile(buffer(self._buf, position, length), name=name or self._name)
+
+
+class TempFile(io.BytesIO):
+    """ Hands its content over when closed, also when whoosh closes it without its StructFile """
+
+    def __init__(self, onclose):
+        io.BytesIO.__init__(self)
+        self._onclose = onclose
+
+    def close(self):
+        if not self.closed:
+            self._onclose(self.getvalue())
+        io.BytesIO.close(self)
+
+
+class TempStorage(Storage):
+    """
+    Keeps the sort runs and column files whoosh writes while indexing and merging in memory, as
+    long as they take up to limit bytes. Files that don't fit anymore are written to the
+    encrypted storage create_disk_storage returns, which is only created when needed.
+    """
+
+    supports_mmap = False
+
+    def __init__(self, limit, create_disk_storage):
+        self.limit = limit
+        self.folder = ''
+        self._create_disk_storage = create_disk_storage
+        self._disk = None
+        self._files = {}
+        self._size = 0
+
+    def create(self):
+        return self
+
+    def destroy(self):
+        self._files = {}
+        self._size = 0
+        if self._disk is not None:
+            self._disk.destroy()
+            self._disk = None
+
+    def stats(self):
+        return {'memory_size': self._size, 'memory_files': len(self._files), 'disk_files': len(self._disk.list()) if self._disk else 0}
+
+    def list(self):
+        return self._files.keys() + (self._disk.list() if self._disk else [])
+
+    def file_exists(self, name):
+        return name in self._files or (self._disk is not None and self._disk.file_exists(name))
+
+    def file_length(self, name):
+        if name in self._files:
+            return len(self._files[name])
+        return self._disk_with(name).file_length(name)
+
+    def file_modified(self, name):
+        return -1
+
+    def create_file(self, name, **kwargs):
+        return StructFile(TempFile(lambda content: self._store(name, content)), name=name)
+
+    def open_file(self, name, **kwargs):
+        if name in self._files:
+            return SharedBufferFile(self._files[name], name=name)
+        return self._disk_with(name).open_file(name)
+
+    def delete_file(self, name):
+        if name in self._files:
+            self._size -= len(self._files.pop(name))
+            return
+
+        self._disk_with(name).delete_file(name)
+        # whoosh does not destroy every temporary storage it uses, so the folder goes with its last file
+        if not [other for other in self._disk.list() if not self._disk._being_removed(other)]:
+            self._disk.destroy()
+            self._disk = None
+
+    def rename_file(self, name, newname, safe=False):
+        if safe and self.file_exists(newname):
+            raise NameError("File %r exists" % newname)
+        with self.open_file(name) as f:
+            content = f.read()
+        self.delete_file(name)
+        self._store(newname, content)
+
+    def _store(self, name, content):
+        if self.file_exists(name):
+            self.delete_file(name)
+        if self._size + len(content) <= self.limit:
+            self._files[name] = content
+            self._size += len(content)
+            return
+
+        if self._disk is None:
+            self._disk = self._create_disk_storage()
+        with self._disk.create_file(name) as f:
+            f.write(content)
+
+    def _disk_with(self, name):
+        if self._disk is None or not self._disk.file_exists(name):
+            raise NameError(name)
+        return self._disk
+
+
+class ChunkedFile(object):
+    """
+    Reads a file of the chunked format. Only the chunks that are read from get decrypted.
+    """
+
+    def __init__(self, storage, name, header):
+        self._storage = storage
+        self._name = name
+        self._header = header
+        self._file = open(storage._fpath(name), 'rb')
+        self._cache_key = (storage._fpath(name), storage._key_id)
+        self._position = 0
+        self._chunk_number = None
+        self._chunk = ''
+
+    def read(self, size=-1):
+        end = self._header.length if size is None or size < 0 else min(self._header.length, self._position + size)
+        parts = []
+        while self._position < end:
+            chunk, offset = self._chunk_at(self._position)
+            part = chunk[offset:offset + end - self._position]
+            parts.append(part)
+            self._position += len(part)
+        return parts[0] if len(parts) == 1 else ''.join(parts)
+
+    def readline(self, size=-1):
+        parts = []
+        while self._position < self._header.length:
+            chunk, offset = self._chunk_at(self._position)
+            newline = chunk.find('\n', offset)
+            part = chunk[offset:] if newline < 0 else chunk[offset:newline + 1]
+            parts.append(part)
+            self._position += len(part)
+            if newline >= 0:
+                break
+        return ''.join(parts)
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self._header.length
+        self._position = position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._file.close()
+        self._chunk = None
+
+    def _chunk_at(self, position):
+        chunk_number, offset = divmod(position, self._header.chunk_size)
+        if chunk_number != self._chunk_number:
+            try:
+                self._chunk = self._storage._read_chunk(self._file, self._cache_key, self._header, chunk_number)
+            except ChunkAuthenticationError:
+                self._storage._mark_corrupt(self._name)
+                raise
+            self._chunk_number = chunk_number
+        return self._chunk, offset
+
+
+class FileRemover(object):
+    """
+    Removes files in a thread of its own, so whoosh doesn't wait for the file system to free
+    the segments a commit or merge supersedes.
+    """
+
+    def __init__(self):
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def remove(self, path):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='index-file-remover')
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put(path)
+
+    def wait(self):
+        """ Blocks until the files handed over so far are removed """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                _remove_if_present(path)
+            except OSError as e:
+                logger.warn('Could not remove %s: %s' % (path, e))
+            finally:
+                self._queue.task_done()
 
 
 class EncryptedFileStorage(FileStorage):
-    def __init__(self, path, masterkey=None):
+    """
+    Keeps whoosh files encrypted and authenticated with the search index key.
+
+    Files are split in chunks of CHUNK_SIZE bytes that are encrypted and authenticated on
+    their own, so a search only decrypts the parts of a segment it reads. The authenticated
+    header of a file holds its length, the hash of its content and a random id that binds the
+    chunks to the file. Files of the former format, one MAC, IV and ciphertext for the whole
+    file, are written in the chunked format the first time they are opened.
+
+    Chunks are compressed before they are encrypted when compression_level is above 0. The header
+    then flags the file as compressed and lists the sizes of the chunks, as they differ. That is
+    off by default: the sizes are in the clear, and how well a chunk compresses tells something
+    about its plaintext, the length side channel of compressing before encrypting. Only turn it
+    on where disk space matters more than that.
+
+    Files are written next to their final name and renamed into place, so a crash never leaves
+    half a file behind. They are synced in groups: before whoosh puts the table of contents of
+    a commit in place, or when sync is called. Deleted files are renamed out of the way and
+    removed in the background, the storage is only destroyed once they are gone. recover
+    quarantines the files that fail to authenticate: small files are checked completely, large
+    ones by their header and size, and a chunk of them that fails to authenticate when it is
+    read has the file quarantined by the next recover.
+    """
+
+    FORMAT_MAGIC = 'PXIX'
+    FORMAT_VERSION = 3
+    CHUNK_SIZE = 64 * 1024
+    COMPRESSED = 0x01
+    DEFAULT_COMPRESSION_LEVEL = 0
+    # bytes of temporary files kept in memory by each temporary storage, more go to disk encrypted
+    DEFAULT_TEMP_MEMORY_LIMIT = 128 * 1024 * 1024
+    # version 2 files have no flags, they are never compressed
+    _header_formats = {2: struct.Struct('>4sB16sIQ32s'), 3: struct.Struct('>4sBB16sIQ32s')}
+
+    # decrypted chunks are shared by all storages, whoosh opens the same segment files for every searcher,
+    # unless a storage is given a cache of its own
+    DECRYPTED_CACHE_BUDGET = 64 * 1024 * 1024
+    _decrypted = LRUCache(DECRYPTED_CACHE_BUDGET)
+    _decrypted_lock = threading.Lock()
+
+    # the folders of temporary storages end with this, whatever a crash left of them is removed
+    TEMP_FOLDER_SUFFIX = 'tmp'
+
+    # files being written or removed start with this, they are never part of the index
+    TRANSIENT_PREFIX = '~'
+    QUARANTINE_FOLDER = 'quarantine'
+    # files found corrupt while whoosh reads them are marked with an empty file of this suffix in the quarantine folder
+    CORRUPT_MARK_SUFFIX = '.corrupt'
+    # recover checks the MAC of every chunk of files up to this size, of larger ones only the header
+    FULLY_VERIFIED_SIZE = 1024 * 1024
+    _remover = FileRemover()
+
+    def __init__(self, path, masterkey=None, compression_level=None, temp_memory_limit=None,
+                 migrate_former_format=True, decrypted_cache=None):
         self.masterkey = masterkey[:32]
         self.signkey = masterkey[32:]
+        self._key_id = sha256(masterkey).digest()
+        self.compression_level = self.DEFAULT_COMPRESSION_LEVEL if compression_level is None else compression_level
+        self.temp_memory_limit = self.DEFAULT_TEMP_MEMORY_LIMIT if temp_memory_limit is None else temp_memory_limit
+        # the former format is still read, it is only left as it is to compare both
+        self.migrate_former_format = migrate_former_format
+        if decrypted_cache is not None:
+            self._decrypted = decrypted_cache
+        self._unsynced = set()
+        self._unsynced_lock = threading.Lock()
         self._tmp_storage = self.temp_storage
         self.length_cache = {}
         FileStorage.__init__(self, path, supports_mmap=False)
 
+    @classmethod
+    def cache_stats(cls):
+        with cls._decrypted_lock:
+            stats = cls._decrypted.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        return stats
+
     def open_file(self, name, **kwargs):
-        return self._open_encrypted_file(name, onclose=self._encrypt_index_on_close(name))
+        # whoosh only reads the files it opens, so there is nothing to write back when they are closed
+        return self._open_encrypted_file(name)
 
     def create_file(self, name, excl=False, mode="w+b", **kwargs):
         f = StructFile(io.BytesIO(), name=name, onclose=self._encrypt_index_on_close(name))
@@ -44,11 +363,14 @@ class EncryptedFileStorage(FileStorage):
         return f
 
     def temp_storage(self, name=None):
-        name = name or "%s.tmp" % random_name()
-        path = os.path.join(self.folder, name)
-        return EncryptedFileStorage(path, self.masterkey).create()
+        # whoosh gives all temporary storages of an index the same name, each needs a folder of its own
+        path = os.path.join(self.folder, '%s.%s' % (random_name(), name or self.TEMP_FOLDER_SUFFIX))
+        return TempStorage(self.temp_memory_limit,
+                           lambda: EncryptedFileStorage(path, self.masterkey + self.signkey).create())
 
     def file_length(self, name):
+        if name not in self.length_cache:
+            self._open_encrypted_file(name).close()
         return self.length_cache[name][0]
 
     def gen_mac(self, iv, ciphertext):
@@ -61,12 +383,15 @@ class EncryptedFileStorage(FileStorage):
         return ''.join((mac, iv, ciphertext))
 
     def decrypt(self, payload):
-        payload_mac, iv, ciphertext = payload[:32], payload[32:57], payload[57:]
+        payload_mac, iv, ciphertext = payload[:MAC_SIZE], payload[MAC_SIZE:MAC_SIZE + IV_SIZE], payload[MAC_SIZE + IV_SIZE:]
         generated_mac = self.gen_mac(iv, ciphertext)
-        if sha256(payload_mac).digest() != sha256(generated_mac).digest():
+        if not self._same_mac(payload_mac, generated_mac):
             raise Exception("EncryptedFileStorage  - Error opening file. Wrong MAC")
         return decrypt_sym(ciphertext, self.masterkey, iv)
 
+    def _same_mac(self, mac, expected_mac):
+        return sha256(mac).digest() == sha256(expected_mac).digest()
+
     def _encrypt_index_on_close(self, name):
         def wrapper(struct_file):
             struct_file.seek(0)
@@ -74,14 +399,256 @@ class EncryptedFileStorage(FileStorage):
             file_hash = sha256(content).digest()
             if name in self.length_cache and file_hash == self.length_cache[name][1]:
                 return
-            self.length_cache[name] = (len(content), file_hash)
-            encrypted_content = self.encrypt(content)
-            with open(self._fpath(name), 'w+b') as f:
-                f.write(encrypted_content)
+            self._write_chunked(name, content, file_hash)
         return wrapper
 
+    def _write_chunked(self, name, content, file_hash):
+        file_id = os.urandom(16)
+        compressed = self.compression_level > 0
+        records = []
+        for chunk_number, position in enumerate(xrange(0, len(content), self.CHUNK_SIZE)):
+            chunk = content[position:position + self.CHUNK_SIZE]
+            iv, ciphertext = encrypt_sym(zlib.compress(chunk, self.compression_level) if compressed else chunk, self.masterkey)
+            records.append(''.join((self._chunk_mac(file_id, chunk_number, iv, ciphertext), iv, ciphertext)))
+            self._cache_chunk((self._fpath(name), self._key_id), file_id, chunk_number, chunk)
+
+        header_bytes = self._header_formats[self.FORMAT_VERSION].pack(
+            self.FORMAT_MAGIC, self.FORMAT_VERSION, self.COMPRESSED if compressed else 0, file_id, self.CHUNK_SIZE, len(content), file_hash)
+        if compressed:
+            header_bytes += struct.pack('>%dI' % len(records), *[len(record) for record in records])
+        writing = self._fpath(self._transient_name(name, 'writing'))
+        with open(writing, 'wb') as f:
+            f.write(header_bytes)
+            f.write(hmac.new(self.signkey, header_bytes, sha256).digest())
+            f.write(''.join(records))
+        os.rename(writing, self._fpath(name))
+        with self._unsynced_lock:
+            self._unsynced.add(name)
+        self.length_cache[name] = (len(content), file_hash)
+
+    def _transient_name(self, name, purpose):
+        return '%s%s.%s.%s' % (self.TRANSIENT_PREFIX, name, random_name(), purpose)
+
+    def sync(self):
+        """ Makes the files written since the last sync durable """
+        with self._unsynced_lock:
+            names, self._unsynced = self._unsynced, set()
+        for name in names:
+            self._fsync(self._fpath(name))
+        self._fsync(self.folder)
+
+    def _fsync(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def recover(self):
+        """
+        Removes what a crash left of files being written or removed and of temporary storages and
+        moves the files that fail to authenticate, are cut short or were marked corrupt while being
+        read to the quarantine folder. Returns their names.
+        """
+        quarantined = []
+        for name in self.list():
+            path = self._fpath(name)
+            if os.path.isdir(path) and name.endswith('.' + self.TEMP_FOLDER_SUFFIX):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if not os.path.isfile(path) or name.endswith('WRITELOCK'):
+                continue
+            if name.startswith(self.TRANSIENT_PREFIX):
+                _remove_if_present(path)
+                continue
+            try:
+                if os.path.exists(self._corrupt_mark(name)):
+                    raise Exception("EncryptedFileStorage  - A chunk failed to authenticate while it was read")
+                self._verify(name)
+            except Exception as e:
+                logger.error('Quarantining corrupt index file %s: %s' % (name, e))
+                self._quarantine(name)
+                quarantined.append(name)
+        return quarantined
+
+    def _verify(self, name):
+        with open(self._fpath(name), 'rb') as f:
+            header = self._read_header(f)
+            if header is None:
+                f.seek(0)
+                payload = f.read()
+                mac, iv, ciphertext = payload[:MAC_SIZE], payload[MAC_SIZE:MAC_SIZE + IV_SIZE], payload[MAC_SIZE + IV_SIZE:]
+                if not self._same_mac(mac, self.gen_mac(iv, ciphertext)):
+                    raise Exception("EncryptedFileStorage  - Wrong MAC")
+                return
+
+            number_of_chunks = (header.length + header.chunk_size - 1) // header.chunk_size
+            if header.record_offsets is not None:
+                records_size = header.record_offsets[-1]
+            else:
+                records_size = number_of_chunks * (MAC_SIZE + IV_SIZE) + header.length
+            if os.path.getsize(self._fpath(name)) != header.data_offset + records_size:
+                raise Exception("EncryptedFileStorage  - File size does not match its header")
+
+            # reading every chunk of the large segments would make starting as slow as searching all mails
+            if records_size <= self.FULLY_VERIFIED_SIZE:
+                for chunk_number in xrange(number_of_chunks):
+                    self._read_record(f, header, chunk_number)
+
+    def _quarantine(self, name):
+        os.rename(self._fpath(name), os.path.join(self._quarantine_folder(), name))
+        _remove_if_present(self._corrupt_mark(name))
+        self._forget(name)
+
+    def _mark_corrupt(self, name):
+        # whoosh may still read the other chunks, the file is moved away when the index is opened next
+        logger.error('Index file %s failed to authenticate, it is quarantined on the next start' % name)
+        open(os.path.join(self._quarantine_folder(), name + self.CORRUPT_MARK_SUFFIX), 'w').close()
+
+    def _corrupt_mark(self, name):
+        return os.path.join(self.folder, self.QUARANTINE_FOLDER, name + self.CORRUPT_MARK_SUFFIX)
+
+    def _quarantine_folder(self):
+        quarantine = os.path.join(self.folder, self.QUARANTINE_FOLDER)
+        if not os.path.exists(quarantine):
+            os.makedirs(quarantine)
+        return quarantine
+
     def _open_encrypted_file(self, name, onclose=lambda x: None):
-        file_content = open(self._fpath(name), "rb").read()
-        decrypted = self.decrypt(file_content)
-        self.length_cache[name] = (len(decrypted), sha256(decrypted).digest())
-        return BufferFile(buffer(decrypted), name=name, onclose=onclose)
+        with open(self._fpath(name), 'rb') as f:
+            header = self._read_header(f)
+            if header is None:
+                f.seek(0)
+                return self._open_former_format(name, f.read(), onclose)
+
+        self.length_cache[name] = (header.length, header.content_hash)
+        return StructFile(ChunkedFile(self, name, header), name=name, onclose=onclose)
+
+    def _open_former_format(self, name, payload, onclose):
+        content = self.decrypt(payload)
+        file_hash = sha256(content).digest()
+        if self.migrate_former_format:
+            self._write_chunked(name, content, file_hash)
+        self.length_cache[name] = (len(content), file_hash)
+        return SharedBufferFile(content, name=name, onclose=onclose)
+
+    def _read_header(self, f):
+        header_bytes = f.read(len(self.FORMAT_MAGIC) + 1)
+        if len(header_bytes) < len(self.FORMAT_MAGIC) + 1 or not header_bytes.startswith(self.FORMAT_MAGIC):
+            return None
+        version = ord(header_bytes[-1])
+        if version not in self._header_formats:
+            raise Exception("EncryptedFileStorage  - Unknown file format version %d" % version)
+
+        header_format = self._header_formats[version]
+        header_bytes += f.read(header_format.size - len(header_bytes))
+        if version == 2:
+            _, _, file_id, chunk_size, length, content_hash = header_format.unpack(header_bytes)
+            flags = 0
+        else:
+            _, _, flags, file_id, chunk_size, length, content_hash = header_format.unpack(header_bytes)
+
+        record_offsets = None
+        if flags & self.COMPRESSED:
+            number_of_chunks = (length + chunk_size - 1) // chunk_size
+            record_sizes = f.read(4 * number_of_chunks)
+            header_bytes += record_sizes
+            record_offsets = [0]
+            for record_size in struct.unpack('>%dI' % number_of_chunks, record_sizes):
+                record_offsets.append(record_offsets[-1] + record_size)
+
+        if not self._same_mac(f.read(MAC_SIZE), hmac.new(self.signkey, header_bytes, sha256).digest()):
+            raise Exception("EncryptedFileStorage  - Error opening file. Wrong header MAC")
+        return FileHeader(file_id, chunk_size, length, content_hash, bool(flags & self.COMPRESSED), f.tell(), record_offsets)
+
+    def _chunk_mac(self, file_id, chunk_number, iv, ciphertext):
+        # binding the chunk to its file and position keeps chunks from being swapped or reordered
+        verifiable_payload = ''.join((file_id, struct.pack('>Q', chunk_number), iv, ciphertext))
+        return hmac.new(self.signkey, verifiable_payload, sha256).digest()
+
+    def _read_chunk(self, f, cache_key, header, chunk_number):
+        with self._decrypted_lock:
+            cached = self._decrypted.get(cache_key + (chunk_number,), usable=lambda entry: entry[0] == header.file_id)
+        if cached is not None:
+            return cached[1]
+
+        iv, ciphertext = self._read_record(f, header, chunk_number)
+        chunk = decrypt_sym(ciphertext, self.masterkey, iv)
+        if header.compressed:
+            chunk = zlib.decompress(chunk)
+        self._cache_chunk(cache_key, header.file_id, chunk_number, chunk)
+        return chunk
+
+    def _read_record(self, f, header, chunk_number):
+        if header.record_offsets is not None:
+            start, end = header.record_offsets[chunk_number], header.record_offsets[chunk_number + 1]
+        else:
+            start = chunk_number * (MAC_SIZE + IV_SIZE + header.chunk_size)
+            end = start + MAC_SIZE + IV_SIZE + min(header.chunk_size, header.length - chunk_number * header.chunk_size)
+        f.seek(header.data_offset + start)
+        record = f.read(end - start)
+        mac, iv, ciphertext = record[:MAC_SIZE], record[MAC_SIZE:MAC_SIZE + IV_SIZE], record[MAC_SIZE + IV_SIZE:]
+        if not self._same_mac(mac, self._chunk_mac(header.file_id, chunk_number, iv, ciphertext)):
+            raise ChunkAuthenticationError("EncryptedFileStorage  - Error reading file. Wrong MAC of chunk %d" % chunk_number)
+        return iv, ciphertext
+
+    def _cache_chunk(self, cache_key, file_id, chunk_number, chunk):
+        with self._decrypted_lock:
+            self._decrypted.put(cache_key + (chunk_number,), (file_id, chunk), size=len(chunk))
+
+    def _forget_decrypted(self, name):
+        cache_key = (self._fpath(name), self._key_id)
+        with self._decrypted_lock:
+            for key, _ in self._decrypted.items():
+                if key[:2] == cache_key:
+                    self._decrypted.pop(key)
+
+    def _forget(self, name):
+        self._forget_decrypted(name)
+        self.length_cache.pop(name, None)
+        with self._unsynced_lock:
+            self._unsynced.discard(name)
+
+    def clean(self, ignore=False):
+        if self.readonly:
+            raise ReadOnlyError
+        # the files being removed in the background belong to the remover
+        for name in self.list():
+            if os.path.isfile(self._fpath(name)) and not self._being_removed(name):
+                try:
+                    _remove_if_present(self._fpath(name))
+                except OSError:
+                    if not ignore:
+                        raise
+            self._forget(name)
+
+    def destroy(self):
+        self.clean()
+        self._remover.wait()
+        os.rmdir(self.folder)
+
+    def _being_removed(self, name):
+        return name.startswith(self.TRANSIENT_PREFIX) and name.endswith('.removed')
+
+    def delete_file(self, name):
+        # once renamed the file is out of whoosh's way, removing a large segment can take a while
+        removed = self._fpath(self._transient_name(name, 'removed'))
+        os.rename(self._fpath(name), removed)
+        self._forget(name)
+        self._remover.remove(removed)
+
+    def rename_file(self, oldname, newname, safe=False):
+        committing = newname.endswith('.toc')
+        if committing:
+            # whoosh commits by putting the table of contents in place, what it lists has to be on disk first
+            self.sync()
+        FileStorage.rename_file(self, oldname, newname, safe=safe)
+        with self._unsynced_lock:
+            unsynced = oldname in self._unsynced
+        self._forget(oldname)
+        self._forget(newname)
+        if unsynced:
+            with self._unsynced_lock:
+                self._unsynced.add(newname)
+        if committing:
+            self._fsync(self.folder)
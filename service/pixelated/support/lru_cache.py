@@ -0,0 +1,73 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Keeps values up to a budget of their summed sizes, evicting the least recently used
+    ones first. Values larger than the whole budget are not kept at all.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, usable=lambda value: True):
+        entry = self._entries.get(key)
+        if entry is None or not usable(entry[0]):
+            self._misses += 1
+            return None
+
+        self._entries[key] = self._entries.pop(key)
+        self._hits += 1
+        return entry[0]
+
+    def put(self, key, value, size):
+        self.pop(key)
+        if size > self.budget:
+            return
+
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._size > self.budget:
+            self.pop(next(iter(self._entries)))
+            self._evictions += 1
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        self._size -= entry[1]
+        return entry[0]
+
+    def items(self):
+        return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'size': self._size,
+            'budget': self.budget,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions
+        }
@@ -0,0 +1,113 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+class Scheduler(object):
+    """
+    Runs a deferred returning function over many items while keeping at most
+    ``parallelism`` calls per map in flight, instead of starting all of them
+    at once and gathering the results.
+    """
+
+    DEFAULT_PARALLELISM = 10
+
+    def __init__(self, parallelism=None):
+        self.parallelism = parallelism or self.DEFAULT_PARALLELISM
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+
+    @property
+    def queue_depth(self):
+        return self._queued
+
+    @property
+    def in_flight(self):
+        return self._running
+
+    def stats(self):
+        return {
+            'parallelism': self.parallelism,
+            'queued': self._queued,
+            'in_flight': self._running,
+            'completed': self._completed
+        }
+
+    def map(self, function, items, parallelism=None):
+        """
+        Calls ``function`` for every item and fires with the results in the
+        order of ``items``. The first failure stops scheduling further items
+        and is passed on; cancelling the returned deferred does the same.
+        """
+        job = _MapJob(function, list(items))
+        self._queued += len(job.items)
+
+        workers = [self._work(job) for _ in xrange(min(parallelism or self.parallelism, len(job.items)))]
+        finished = defer.gatherResults(workers, consumeErrors=True)
+
+        def cancel(_):
+            job.stopped = True
+
+        result = defer.Deferred(canceller=cancel)
+
+        def done(_):
+            if result.called:
+                return
+            if job.failure is not None:
+                result.errback(job.failure)
+            else:
+                result.callback(job.results)
+
+        finished.addBoth(done)
+        return result
+
+    @defer.inlineCallbacks
+    def _work(self, job):
+        for index, item in job.pending:
+            self._queued -= 1
+            if job.stopped:
+                continue
+
+            self._running += 1
+            try:
+                job.results[index] = yield defer.maybeDeferred(job.function, item)
+            except Exception:
+                job.fail()
+            finally:
+                self._running -= 1
+                self._completed += 1
+
+
+class _MapJob(object):
+    __slots__ = ('function', 'items', 'pending', 'results', 'failure', 'stopped')
+
+    def __init__(self, function, items):
+        self.function = function
+        self.items = items
+        self.pending = iter(enumerate(items))
+        self.results = [None] * len(items)
+        self.failure = None
+        self.stopped = False
+
+    def fail(self):
+        if self.failure is None:
+            self.failure = Failure()
+        self.stopped = True
+
+
+shared_scheduler = Scheduler()
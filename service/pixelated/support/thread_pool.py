@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import time
+
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+
+class MeasuredThreadPool(object):
+    """
+    A thread pool of a fixed size, separate from the reactor's pool that soledad keeps busy.
+    It keeps track of how long calls wait for a thread and how long they run.
+
+    The threads are started with the first call and stopped when the reactor shuts down.
+    """
+
+    def __init__(self, name, size, reactor=reactor):
+        self.name = name
+        self.size = size
+        self._reactor = reactor
+        self._pool = None
+        self._pending = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+        self._max_run = 0.0
+
+    def run(self, function, *args, **kwargs):
+        """ Calls function in one of the threads and fires with its result """
+        if self._pool is None:
+            self._start()
+
+        submitted = time.time()
+        started = []
+
+        def measured():
+            started.append(time.time())
+            return function(*args, **kwargs)
+
+        def finished(result):
+            now = time.time()
+            self._record(submitted, started[0] if started else now, now)
+            return result
+
+        self._pending += 1
+        d = threads.deferToThreadPool(self._reactor, self._pool, measured)
+        d.addBoth(finished)
+        return d
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'size': self.size,
+            'pending': self._pending,
+            'completed': self._completed,
+            'average_wait': self._total_wait / self._completed if self._completed else 0.0,
+            'max_wait': self._max_wait,
+            'average_run': self._total_run / self._completed if self._completed else 0.0,
+            'max_run': self._max_run
+        }
+
+    def _start(self):
+        self._pool = ThreadPool(minthreads=1, maxthreads=self.size, name=self.name)
+        self._pool.start()
+        self._reactor.addSystemEventTrigger('during', 'shutdown', self._pool.stop)
+
+    def _record(self, submitted, started, finished):
+        wait, run = started - submitted, finished - started
+        self._pending -= 1
+        self._completed += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        self._total_run += run
+        self._max_run = max(self._max_run, run)
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 from uuid import uuid4
+from twisted.internet import reactor, threads
 from test.support.integration import MailBuilder
 from behave import given
 from common import wait_for_condition
@@ -26,6 +27,9 @@ def add_mail_impl(context):
     input_mail = MailBuilder().with_subject(subject).build_input_mail()
     context.client.add_mail_to_inbox(input_mail)
 
-    wait_for_condition(context, lambda _: context.client.search_engine.search(subject)[1] > 0, poll_frequency=0.1)
+    def mail_count(_):
+        return threads.blockingCallFromThread(reactor, context.client.search_engine.search, subject)[1]
+
+    wait_for_condition(context, lambda _: mail_count(_) > 0, poll_frequency=0.1)
 
     context.last_subject = subject
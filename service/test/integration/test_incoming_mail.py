@@ -36,7 +36,7 @@ class IncomingMailTest(SoledadTestBase):
         # then
         yield self.wait_in_reactor()  # event handlers are called async, wait for it
 
-        mails, mail_count = self.search_engine.search('in:all')
+        mails, mail_count = yield self.search_engine.search('in:all')
         self.assertEqual(1, mail_count)
         self.assertEqual(1, len(mails))
 
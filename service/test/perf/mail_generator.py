@@ -0,0 +1,45 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+"""
+Generates the mails the benchmarks index and render, so all of them measure the same mails.
+"""
+import random
+
+from pixelated.adapter.mailstore.leap_mailstore import LeapMail
+
+
+WORDS = ['word%d' % number for number in xrange(20000)]
+
+
+def generated_headers(number):
+    sender = number % 100
+    return {
+        'From': 'Sender %d <sender%d@example.test>' % (sender, sender),
+        'To': 'first@example.test, =?utf-8?b?w5xtbMOkw7x0?= <second@example.test>',
+        'Cc': 'third@example.test',
+        'Subject': '=?iso-8859-1?Q?Subject_number_%d?=' % number,
+        'Date': 'Thu, 01 Oct 2015 %02d:%02d:00 +0000' % (number / 60 % 24, number % 60),
+        'Message-Id': '<%d@example.test>' % number,
+        'X-Leap-Encryption': 'decrypted',
+        'X-Leap-Signature': 'valid'
+    }
+
+
+def generated_mails(first, count, body_words=0):
+    """ Yields count mails numbered from first, spread over ten tags, with bodies of body_words random words """
+    for number in xrange(first, first + count):
+        body = u' '.join(random.choice(WORDS) for _ in xrange(body_words)) if body_words else None
+        yield LeapMail('M-%d' % number, 'INBOX', generated_headers(number), tags={'tag%d' % (number % 10)}, body=body)
@@ -0,0 +1,66 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import multiprocessing
+import time
+import unittest
+
+from funkload.FunkLoadTestCase import FunkLoadTestCase
+from twisted.internet import defer, reactor
+from test.support.integration import AppTestClient
+
+
+def serve_mails(number_of_mails, ready):
+    client = AppTestClient()
+
+    @defer.inlineCallbacks
+    def start():
+        yield client.start_client()
+        yield client.add_multiple_to_mailbox(number_of_mails, 'INBOX')
+        client.listenTCP()
+        ready.set()
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+
+
+class GetMails(FunkLoadTestCase):
+
+    def setUpBench(self):
+        ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=serve_mails, args=(self.conf_getInt('main', 'number_of_mails'), ready))
+        self.process.start()
+        ready.wait()
+
+    def tearDownBench(self):
+        self.process.terminate()
+
+    def setUp(self):
+        """Setting up test."""
+        self.server_url = self.conf_get('main', 'url')
+        self.number_of_mails = self.conf_getInt('main', 'number_of_mails')
+
+    def test_get_mails(self):
+        """ Loads every mail of the mailbox in one page, the page time divided by the number of mails is the per mail cost """
+        url = self.server_url + '/mails?q=tag:inbox&p=1&w=%d' % self.number_of_mails
+
+        for i in range(self.conf_getInt('main', 'nb_time')):
+            start = time.time()
+            self.get(url, description='Get %d mails' % self.number_of_mails)
+            elapsed = time.time() - start
+            self.logi('%d mails in %.2fs, %.3fms per mail' % (self.number_of_mails, elapsed, elapsed * 1000 / self.number_of_mails))
+
+if __name__ in ('main', '__main__'):
+    unittest.main()
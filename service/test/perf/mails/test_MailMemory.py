@@ -0,0 +1,72 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import gc
+import resource
+import sys
+import time
+import unittest
+
+from funkload.FunkLoadTestCase import FunkLoadTestCase
+from pixelated.adapter.mailstore.leap_mailstore import LeapMail
+from test.perf.mail_generator import generated_headers
+
+
+def object_size(mail):
+    size = sys.getsizeof(mail)
+    if hasattr(mail, '__dict__'):
+        size += sys.getsizeof(mail.__dict__)
+    return size
+
+
+def max_rss_in_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class MailMemory(FunkLoadTestCase):
+
+    def setUp(self):
+        """Setting up test."""
+        self.number_of_mails = self.conf_getInt('main', 'number_of_mails')
+
+    def test_mail_memory(self):
+        """ Builds the mails and renders them as json twice, run it before and after a change to LeapMail """
+        all_headers = [generated_headers(number) for number in xrange(self.number_of_mails)]
+
+        gc.collect()
+        rss_before = max_rss_in_kb()
+        mails = [LeapMail('M-%d' % number, 'INBOX', all_headers[number], tags={'tag'}) for number in xrange(self.number_of_mails)]
+
+        start = time.time()
+        for mail in mails:
+            mail.as_dict()
+        first_render = time.time() - start
+
+        start = time.time()
+        for mail in mails:
+            mail.as_dict()
+        second_render = time.time() - start
+
+        gc.collect()
+        # the maximum rss only grows, so this is only meaningful for the first run of the process
+        rss_growth = max_rss_in_kb() - rss_before
+
+        self.logi('%d mails, object size %d bytes per mail' % (self.number_of_mails, object_size(mails[0])))
+        self.logi('max rss growth %.0f bytes per mail' % (rss_growth * 1024.0 / self.number_of_mails))
+        self.logi('first as_dict %.3fms, second as_dict %.3fms per mail' % (
+            first_render * 1000 / self.number_of_mails, second_render * 1000 / self.number_of_mails))
+
+if __name__ in ('main', '__main__'):
+    unittest.main()
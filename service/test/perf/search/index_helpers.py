@@ -0,0 +1,44 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+"""
+Times queries against an index as it is found on disk, so the search benchmarks compare storages alike.
+"""
+import os
+import time
+
+from whoosh import sorting
+from whoosh.qparser import MultifieldParser
+from pixelated.support.encrypted_file_storage import EncryptedFileStorage
+from pixelated.support.lru_cache import LRUCache
+
+
+QUERIES = ['tag:inbox', 'word42', 'sender7@example.test']
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+def cold_query(key, folder, query, **storage_args):
+    """ Times the first page of results of a query on an index opened without any decrypted chunk cached """
+    start = time.time()
+    storage = EncryptedFileStorage(folder, key, decrypted_cache=LRUCache(EncryptedFileStorage.DECRYPTED_CACHE_BUDGET),
+                                   **storage_args)
+    index = storage.open_index(indexname='mails')
+    with index.searcher() as searcher:
+        parsed = MultifieldParser(['raw', 'body'], index.schema).parse(query)
+        searcher.search_page(parsed, 1, pagelen=25, sortedby=sorting.FieldFacet('date', reverse=True))
+    return time.time() - start
@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import os
+import unittest
+
+from funkload.FunkLoadTestCase import FunkLoadTestCase
+from tempdir import TempDir
+from pixelated.adapter.search import SearchEngine
+from pixelated.support.encrypted_file_storage import EncryptedFileStorage
+from test.perf.mail_generator import generated_mails
+from test.perf.search.index_helpers import QUERIES, cold_query, folder_size
+
+
+BATCH_SIZE = 1000
+
+# the index is built once per bench, in the chunked format and as one encrypted blob per file
+INDEX = {}
+
+
+def copy_in_former_format(key, folder, target):
+    storage = EncryptedFileStorage(folder, key)
+    former = EncryptedFileStorage(target, key).create()
+    for name in storage.list():
+        if name.endswith('WRITELOCK'):
+            continue
+        with storage.open_file(name) as f:
+            content = f.read()
+        with open(former._fpath(name), 'wb') as f:
+            f.write(former.encrypt(content))
+
+
+class ColdQuery(FunkLoadTestCase):
+
+    def setUpBench(self):
+        size = self.conf_getInt('main', 'index_size_mb') * 1024 * 1024
+        INDEX['key'] = key = os.urandom(64)
+        INDEX['tempdir'] = TempDir()
+        search_engine = SearchEngine(key, agent_home=INDEX['tempdir'].name)
+        indexed = 0
+        while folder_size(search_engine.index_folder) < size:
+            search_engine.index_mails(list(generated_mails(indexed, BATCH_SIZE, body_words=300)))
+            indexed += BATCH_SIZE
+        search_engine.save_checkpoint(0)
+        INDEX['folder'] = search_engine.index_folder
+        INDEX['former_folder'] = os.path.join(INDEX['tempdir'].name, 'former_format')
+        copy_in_former_format(key, INDEX['folder'], INDEX['former_folder'])
+        self.logi('%d mails, %.0f MB index' % (indexed, folder_size(INDEX['folder']) / 1024.0 / 1024))
+
+    def tearDownBench(self):
+        INDEX.pop('tempdir').dissolve()
+
+    def setUp(self):
+        """Setting up test."""
+        self.key = INDEX['key']
+
+    def test_cold_query(self):
+        """ Times the first query after opening the index with whole encrypted files and with chunked ones """
+        for query in QUERIES:
+            # the former format is left as it is, so every query reads it as such
+            whole_file = cold_query(self.key, INDEX['former_folder'], query, migrate_former_format=False)
+            chunked = cold_query(self.key, INDEX['folder'], query)
+            self.logi('%s: whole file %.0fms, chunked %.0fms' % (query, whole_file * 1000, chunked * 1000))
+
+if __name__ in ('main', '__main__'):
+    unittest.main()
@@ -0,0 +1,60 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+import unittest
+
+from funkload.FunkLoadTestCase import FunkLoadTestCase
+from tempdir import TempDir
+from pixelated.adapter.search import SearchEngine
+from test.perf.mail_generator import generated_mails
+from test.perf.search.index_helpers import QUERIES, cold_query, folder_size
+
+
+BATCH_SIZE = 1000
+COMPRESSION_LEVELS = [0, 1, 6]
+
+
+class Compression(FunkLoadTestCase):
+
+    def setUp(self):
+        """Setting up test."""
+        self.key = os.urandom(64)
+        self.number_of_mails = self.conf_getInt('main', 'number_of_mails')
+
+    def _build_index(self, agent_home, level):
+        search_engine = SearchEngine(self.key, agent_home=agent_home, compression_level=level)
+        start = time.time()
+        for first in xrange(0, self.number_of_mails, BATCH_SIZE):
+            count = min(BATCH_SIZE, self.number_of_mails - first)
+            search_engine.index_mails(list(generated_mails(first, count, body_words=300)))
+        search_engine.save_checkpoint(0)
+        return search_engine.index_folder, time.time() - start
+
+    def test_compression(self):
+        """ Compares index size, indexing throughput and first query latency for several compression levels """
+        for level in COMPRESSION_LEVELS:
+            tempdir = TempDir()
+            try:
+                folder, elapsed = self._build_index(tempdir.name, level)
+                latencies = ['%.0fms' % (cold_query(self.key, folder, query) * 1000) for query in QUERIES]
+                self.logi('level %d: %.1f MB, %.0f mails/s, first query %s' % (
+                    level, folder_size(folder) / 1024.0 / 1024, self.number_of_mails / elapsed, ' / '.join(latencies)))
+            finally:
+                tempdir.dissolve()
+
+if __name__ in ('main', '__main__'):
+    unittest.main()
@@ -0,0 +1,81 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+import unittest
+
+from funkload.FunkLoadTestCase import FunkLoadTestCase
+from tempdir import TempDir
+from whoosh import sorting
+from pixelated.adapter.search import SearchEngine
+from pixelated.support.functional import unique
+from test.perf.mail_generator import generated_mails
+
+
+BATCH_SIZE = 10000
+QUERY = 'tag:inbox'
+
+# the index is built once per bench and searched by every test
+INDEX = {}
+
+
+def with_tag_facet(search_engine, query, window, page):
+    with search_engine._searchers.searcher() as searcher:
+        tags_facet = sorting.FieldFacet('tag', allow_overlap=True, maptype=sorting.Count)
+        sorting_facet = sorting.FieldFacet('date', reverse=True)
+        results = searcher.search_page(query, page, pagelen=window, groupedby=tags_facet, sortedby=sorting_facet)
+        return unique([mail['ident'] for mail in results]), sum(results.results.groups().values())
+
+
+def with_match_count(search_engine, query, window, page):
+    return search_engine._paginated_search_mails(query, window, page)
+
+
+class PaginatedSearch(FunkLoadTestCase):
+
+    def setUpBench(self):
+        number_of_mails = self.conf_getInt('main', 'number_of_mails')
+        INDEX['tempdir'] = TempDir()
+        search_engine = SearchEngine(os.urandom(64), agent_home=INDEX['tempdir'].name)
+        for first in xrange(0, number_of_mails, BATCH_SIZE):
+            search_engine.index_mails(list(generated_mails(first, min(BATCH_SIZE, number_of_mails - first), body_words=5)))
+        INDEX['search_engine'] = search_engine
+
+    def tearDownBench(self):
+        INDEX.pop('tempdir').dissolve()
+
+    def setUp(self):
+        """Setting up test."""
+        self.search_engine = INDEX['search_engine']
+        self.query = self.search_engine.prepare_query(QUERY)
+
+    def _measure(self, name, search):
+        # the result cache of the search engine is bypassed
+        search(self.search_engine, self.query, 25, 1)
+        repetitions = self.conf_getInt('main', 'nb_time')
+        start = time.time()
+        for _ in xrange(repetitions):
+            _, total = search(self.search_engine, self.query, 25, 1)
+        elapsed = time.time() - start
+        self.logi('%s: total %d, %.2fms per page' % (name, total, elapsed * 1000 / repetitions))
+
+    def test_paginated_search(self):
+        """ Times a page of results with the total summed from a tag facet and taken from the match count """
+        self._measure('tag facet', with_tag_facet)
+        self._measure('match count', with_match_count)
+
+if __name__ in ('main', '__main__'):
+    unittest.main()
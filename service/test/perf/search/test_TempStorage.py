@@ -0,0 +1,61 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+import unittest
+
+from funkload.FunkLoadTestCase import FunkLoadTestCase
+from tempdir import TempDir
+from pixelated.adapter.search import SearchEngine
+from pixelated.support.encrypted_file_storage import EncryptedFileStorage
+from test.perf.mail_generator import generated_mails
+
+
+BATCH_SIZE = 3000
+TEMP_MEMORY_LIMITS = [('encrypted disk', 0), ('memory', EncryptedFileStorage.DEFAULT_TEMP_MEMORY_LIMIT)]
+
+
+class TempStorage(FunkLoadTestCase):
+
+    def setUp(self):
+        """Setting up test."""
+        self.number_of_mails = self.conf_getInt('main', 'number_of_mails')
+
+    def _measure(self, name, limit):
+        tempdir = TempDir()
+        try:
+            search_engine = SearchEngine(os.urandom(64), agent_home=tempdir.name, temp_memory_limit=limit)
+            commits = []
+            for first in xrange(0, self.number_of_mails, BATCH_SIZE):
+                batch = list(generated_mails(first, min(BATCH_SIZE, self.number_of_mails - first), body_words=300))
+                start = time.time()
+                search_engine.index_mails(batch)
+                commits.append(time.time() - start)
+            start = time.time()
+            search_engine._index.optimize()
+            optimize = time.time() - start
+            self.logi('%s: commit %.1fs per %d mails, optimize %.1fs' % (
+                name, sum(commits) / len(commits), BATCH_SIZE, optimize))
+        finally:
+            tempdir.dissolve()
+
+    def test_temp_storage(self):
+        """ Times large commits and optimizing with temporary files written to disk encrypted and kept in memory """
+        for name, limit in TEMP_MEMORY_LIMITS:
+            self._measure(name, limit)
+
+if __name__ in ('main', '__main__'):
+    unittest.main()
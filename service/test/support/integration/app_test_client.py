@@ -36,6 +36,7 @@ from pixelated.config.site import PixelatedSite
 
 from pixelated.adapter.mailstore import LeapMailStore
 from pixelated.adapter.mailstore.searchable_mailstore import SearchableMailStore
+from pixelated.adapter.mailstore.caching_mailstore import CachingMailStore
 
 from pixelated.adapter.search import SearchEngine
 from pixelated.adapter.services.draft_service import DraftService
@@ -69,7 +70,7 @@ class AppTestClient(object):
         self.search_engine = SearchEngine(self.INDEX_KEY, agent_home=soledad_test_folder)
         self.mail_sender = self._create_mail_sender()
 
-        self.mail_store = SearchableMailStore(LeapMailStore(self.soledad), self.search_engine)
+        self.mail_store = SearchableMailStore(CachingMailStore(LeapMailStore(self.soledad)), self.search_engine)
 
         account_ready_cb = defer.Deferred()
         self.account = IMAPAccount(self.ACCOUNT, self.soledad, account_ready_cb)
@@ -0,0 +1,85 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import base64
+import quopri
+from twisted.trial.unittest import TestCase
+from pixelated.adapter.mailstore.attachment_content import AttachmentContent
+
+
+DATA = ''.join(chr(i % 256) for i in xrange(10000))
+
+
+def read_all(reader, size=1000):
+    result = ''
+    data = reader.read(size)
+    while data:
+        result += data
+        data = reader.read(size)
+    return result
+
+
+class TestAttachmentContent(TestCase):
+
+    def setUp(self):
+        AttachmentContent.CHUNK_SIZE = 100
+
+    def tearDown(self):
+        AttachmentContent.CHUNK_SIZE = 64 * 1024
+
+    def test_decodes_base64_in_chunks(self):
+        content = AttachmentContent(unicode(base64.encodestring(DATA)), 'application/octet-stream', 'base64')
+
+        self.assertEqual(len(DATA), content.size)
+        self.assertTrue(len(list(content.chunks())) > 1)
+        self.assertEqual(DATA, read_all(content.open()))
+
+    def test_size_of_base64_considers_padding(self):
+        content = AttachmentContent(base64.encodestring(DATA[:10]), 'application/octet-stream', 'base64')
+
+        self.assertEqual(10, content.size)
+        self.assertEqual(DATA[:10], read_all(content.open()))
+
+    def test_size_of_unpadded_base64(self):
+        for length in (10, 11, 12):
+            content = AttachmentContent(base64.b64encode(DATA[:length]).rstrip('='), 'application/octet-stream', 'base64')
+
+            self.assertEqual(length, content.size)
+            self.assertEqual(DATA[:length], read_all(content.open()))
+
+    def test_size_of_base64_ignores_stray_characters(self):
+        encoded = base64.encodestring(DATA[:1000]).replace('\n', '!\r\n').replace('A', 'A.')
+        content = AttachmentContent(encoded, 'application/octet-stream', 'base64')
+
+        self.assertEqual(1000, content.size)
+        self.assertEqual(DATA[:1000], read_all(content.open()))
+
+    def test_decodes_quoted_printable(self):
+        text = 'caf\xc3\xa9 ' * 500
+        content = AttachmentContent(quopri.encodestring(text), 'text/plain', 'quoted-printable')
+
+        self.assertEqual(len(text), content.size)
+        self.assertEqual(text, read_all(content.open()))
+
+    def test_plain_content_is_sent_as_is(self):
+        content = AttachmentContent(u'plain text', 'text/plain', '7bit')
+
+        self.assertEqual(10, content.size)
+        self.assertEqual('plain text', read_all(content.open()))
+
+    def test_reads_range(self):
+        content = AttachmentContent(base64.encodestring(DATA), 'application/octet-stream', 'base64')
+
+        self.assertEqual(DATA[4321:5678], read_all(content.open(4321, 5677), size=333))
@@ -0,0 +1,271 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import base64
+from types import FunctionType
+from mockito import verify, mock, when, times
+from twisted.internet import defer
+import test.support.mockito
+from twisted.trial.unittest import TestCase
+from pixelated.adapter.mailstore import MailStore
+from pixelated.adapter.mailstore.leap_mailstore import LeapMail
+from pixelated.adapter.mailstore.attachment_content import AttachmentContent
+from pixelated.adapter.mailstore.caching_mailstore import CachingMailStore
+
+
+class TestCachingMailStore(TestCase):
+
+    def setUp(self):
+        super(TestCachingMailStore, self).setUp()
+        self.delegate_mail_store = mock(mocked_obj=MailStore)
+        self.store = CachingMailStore(self.delegate_mail_store)
+        self.mail = LeapMail('mail id', 'INBOX', {'Subject': 'the subject'}, tags={'tag'}, body='the body')
+
+        when(self.delegate_mail_store).get_mail_revisions(['mail id']).thenAnswer(lambda: defer.succeed({'mail id': 'rev-1'}))
+        when(self.delegate_mail_store).get_mail('mail id', include_body=True).thenAnswer(lambda: defer.succeed(self.mail))
+
+    @defer.inlineCallbacks
+    def test_get_mail_is_loaded_only_once(self):
+        yield self.store.get_mail('mail id', include_body=True)
+        mail = yield self.store.get_mail('mail id', include_body=True)
+
+        self.assertEqual('the body', mail.body)
+        verify(self.delegate_mail_store, times=1).get_mail('mail id', include_body=True)
+        self.assertEqual(1, self.store.stats()['hits'])
+        self.assertEqual(1, self.store.stats()['misses'])
+
+    @defer.inlineCallbacks
+    def test_mail_with_body_also_serves_requests_without_body(self):
+        yield self.store.get_mail('mail id', include_body=True)
+        yield self.store.get_mail('mail id')
+
+        verify(self.delegate_mail_store, times=0).get_mail('mail id', include_body=False)
+
+    @defer.inlineCallbacks
+    def test_changes_to_returned_mails_do_not_leak_into_cache(self):
+        mail = yield self.store.get_mail('mail id', include_body=True)
+        mail.tags.add('other')
+
+        mail = yield self.store.get_mail('mail id', include_body=True)
+
+        self.assertEqual({'tag'}, mail.tags)
+
+    @defer.inlineCallbacks
+    def test_update_mail_invalidates_cached_mail(self):
+        when(self.delegate_mail_store).update_mail(self.mail).thenAnswer(lambda: defer.succeed(None))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.update_mail(self.mail)
+        yield self.store.get_mail('mail id', include_body=True)
+
+        verify(self.delegate_mail_store, times=2).get_mail('mail id', include_body=True)
+
+    @defer.inlineCallbacks
+    def test_update_flags_changes_cached_mails_in_place(self):
+        when(self.delegate_mail_store).update_flags(['mail id'], ['\\Seen'], ()).thenAnswer(lambda: defer.succeed(['mail id']))
+        when(self.delegate_mail_store).refresh_after_sync().thenAnswer(lambda: defer.succeed(None))
+        yield self.store.get_mail('mail id', include_body=True)
+        when(self.delegate_mail_store).get_mail_revisions(['mail id']).thenAnswer(lambda: defer.succeed({'mail id': 'rev-2'}))
+
+        result = yield self.store.update_flags(['mail id'], add=['\\Seen'])
+        yield self.store.refresh_after_sync()
+        mail = yield self.store.get_mail('mail id', include_body=True)
+
+        self.assertEqual(['mail id'], result)
+        self.assertEqual({'\\Seen'}, mail.flags)
+        self.assertEqual('the body', mail.body)
+        verify(self.delegate_mail_store, times=1).get_mail('mail id', include_body=True)
+
+    @defer.inlineCallbacks
+    def test_update_tags_changes_cached_mails_in_place(self):
+        when(self.delegate_mail_store).update_tags(['mail id'], {'work'}).thenAnswer(lambda: defer.succeed(['mail id']))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.update_tags(['mail id'], {'work'})
+        mail = yield self.store.get_mail('mail id', include_body=True)
+
+        self.assertEqual({'work'}, mail.tags)
+        verify(self.delegate_mail_store, times=1).get_mail('mail id', include_body=True)
+
+    @defer.inlineCallbacks
+    def test_update_flags_drops_cached_mails_deleted_meanwhile(self):
+        when(self.delegate_mail_store).update_flags(['mail id'], ['\\Seen'], ()).thenAnswer(lambda: defer.succeed(['mail id']))
+        yield self.store.get_mail('mail id', include_body=True)
+        when(self.delegate_mail_store).get_mail_revisions(['mail id']).thenAnswer(lambda: defer.succeed({}))
+
+        yield self.store.update_flags(['mail id'], add=['\\Seen'])
+
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_add_mail_invalidates_mail_cached_under_the_same_id(self):
+        when(self.delegate_mail_store).add_mail('INBOX', 'raw mail').thenAnswer(lambda: defer.succeed(LeapMail('mail id', 'INBOX')))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.add_mail('INBOX', 'raw mail')
+
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_copy_mail_invalidates_mail_cached_under_the_same_id(self):
+        when(self.delegate_mail_store).copy_mail_to_mailbox('other id', 'INBOX').thenAnswer(lambda: defer.succeed(LeapMail('mail id', 'INBOX')))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.copy_mail_to_mailbox('other id', 'INBOX')
+
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_copy_mail_invalidates_mail_cached_under_its_relocated_id(self):
+        copied_mail = LeapMail('other id', 'INBOX')
+        copied_mail.relocated_mail_id = 'mail id'
+        when(self.delegate_mail_store).copy_mail_to_mailbox('other id', 'INBOX').thenAnswer(lambda: defer.succeed(copied_mail))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.copy_mail_to_mailbox('other id', 'INBOX')
+
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_delete_mails_invalidates_cached_mails(self):
+        when(self.delegate_mail_store).delete_mails(['mail id']).thenAnswer(lambda: defer.succeed(['mail id']))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.delete_mails(['mail id'])
+
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_delete_mailbox_invalidates_its_cached_mails(self):
+        other_mail = LeapMail('other id', 'TRASH', {'Subject': 'other subject'}, body='other body')
+        when(self.delegate_mail_store).get_mail_revisions(['other id']).thenAnswer(lambda: defer.succeed({'other id': 'rev-1'}))
+        when(self.delegate_mail_store).get_mail('other id', include_body=True).thenAnswer(lambda: defer.succeed(other_mail))
+        when(self.delegate_mail_store).delete_mailbox('INBOX').thenAnswer(lambda: defer.succeed(None))
+        yield self.store.get_mail('mail id', include_body=True)
+        yield self.store.get_mail('other id', include_body=True)
+
+        yield self.store.delete_mailbox('INBOX')
+
+        self.assertEqual(1, self.store.stats()['entries'])
+        yield self.store.get_mail('other id', include_body=True)
+        verify(self.delegate_mail_store, times=1).get_mail('other id', include_body=True)
+
+    def test_every_method_changing_mails_is_implemented_explicitly(self):
+        methods = [name for name, value in MailStore.__dict__.items() if type(value) == FunctionType]
+
+        for name in methods:
+            if name not in CachingMailStore.READ_ONLY_METHODS:
+                self.assertIn(name, CachingMailStore.__dict__)
+        self.assertRaises(NotImplementedError, getattr, self.store, 'update_everything')
+
+    @defer.inlineCallbacks
+    def test_move_mail_invalidates_cached_mail(self):
+        when(self.delegate_mail_store).move_mail_to_mailbox('mail id', 'TRASH').thenAnswer(lambda: defer.succeed(None))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.move_mail_to_mailbox('mail id', 'TRASH')
+
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_move_mails_invalidates_cached_mails(self):
+        when(self.delegate_mail_store).move_mails_to_mailbox(['mail id'], 'TRASH').thenAnswer(lambda: defer.succeed([self.mail]))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.move_mails_to_mailbox(['mail id'], 'TRASH')
+
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_refresh_after_sync_drops_mails_with_changed_revisions(self):
+        when(self.delegate_mail_store).refresh_after_sync().thenAnswer(lambda: defer.succeed(None))
+        yield self.store.get_mail('mail id', include_body=True)
+        when(self.delegate_mail_store).get_mail_revisions(['mail id']).thenAnswer(lambda: defer.succeed({'mail id': 'rev-2'}))
+
+        yield self.store.refresh_after_sync()
+
+        verify(self.delegate_mail_store).refresh_after_sync()
+        self.assertEqual(0, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_refresh_after_sync_keeps_unchanged_mails(self):
+        when(self.delegate_mail_store).refresh_after_sync().thenAnswer(lambda: defer.succeed(None))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        yield self.store.refresh_after_sync()
+
+        self.assertEqual(1, self.store.stats()['entries'])
+
+    @defer.inlineCallbacks
+    def test_get_mails_only_loads_missing_mails(self):
+        other_mail = LeapMail('other id', 'INBOX')
+        when(self.delegate_mail_store).get_mail_revisions(['other id']).thenAnswer(lambda: defer.succeed({'other id': 'rev-1'}))
+        when(self.delegate_mail_store).get_mails(['other id'], include_body=False).thenAnswer(lambda: defer.succeed([other_mail]))
+        yield self.store.get_mail('mail id', include_body=True)
+
+        mails = yield self.store.get_mails(['mail id', 'other id'])
+
+        self.assertEqual(['mail id', 'other id'], [mail.mail_id for mail in mails])
+        verify(self.delegate_mail_store).get_mails(['other id'], include_body=False)
+
+    @defer.inlineCallbacks
+    def test_least_recently_used_mails_are_evicted_when_over_budget(self):
+        other_mail = LeapMail('other id', 'INBOX', {'Subject': 'the subject'}, body='the body')
+        when(self.delegate_mail_store).get_mail_revisions(['other id']).thenAnswer(lambda: defer.succeed({'other id': 'rev-1'}))
+        when(self.delegate_mail_store).get_mail('other id', include_body=True).thenAnswer(lambda: defer.succeed(other_mail))
+        yield self.store.get_mail('mail id', include_body=True)
+        self.store._mails.budget = 2 * self.store.stats()['size'] - 1
+
+        yield self.store.get_mail('other id', include_body=True)
+
+        self.assertEqual(1, self.store.stats()['entries'])
+        self.assertEqual(1, self.store.stats()['evictions'])
+        yield self.store.get_mail('other id', include_body=True)
+        yield self.store.get_mail('mail id', include_body=True)
+        self.assertEqual(1, self.store.stats()['hits'])
+        verify(self.delegate_mail_store, times=2).get_mail('mail id', include_body=True)
+
+    @defer.inlineCallbacks
+    def test_attachments_are_decoded_and_loaded_only_once(self):
+        content = AttachmentContent(base64.encodestring('attachment data'), 'text/plain', 'base64')
+        when(self.delegate_mail_store).get_mail_attachment_content('phash').thenAnswer(lambda: defer.succeed(content))
+
+        yield self.store.get_mail_attachment_content('phash')
+        cached = yield self.store.get_mail_attachment_content('phash')
+
+        self.assertEqual('attachment data', cached.open().read(100))
+        verify(self.delegate_mail_store, times=1).get_mail_attachment_content('phash')
+        self.assertEqual(1, self.store.stats()['attachments']['hits'])
+
+    @defer.inlineCallbacks
+    def test_attachments_larger_than_budget_are_not_cached(self):
+        self.store = CachingMailStore(self.delegate_mail_store, attachment_budget=10)
+        content = AttachmentContent(base64.encodestring('attachment data'), 'text/plain', 'base64')
+        when(self.delegate_mail_store).get_mail_attachment_content('phash').thenAnswer(lambda: defer.succeed(content))
+
+        result = yield self.store.get_mail_attachment_content('phash')
+
+        self.assertIs(content, result)
+        self.assertEqual(0, self.store.stats()['attachments']['entries'])
+
+    @defer.inlineCallbacks
+    def test_missing_mails_are_not_cached(self):
+        when(self.delegate_mail_store).get_mail_revisions(['unknown id']).thenAnswer(lambda: defer.succeed({}))
+        when(self.delegate_mail_store).get_mail('unknown id', include_body=False).thenAnswer(lambda: defer.succeed(None))
+
+        mail = yield self.store.get_mail('unknown id')
+
+        self.assertIsNone(mail)
+        self.assertEqual(0, self.store.stats()['entries'])
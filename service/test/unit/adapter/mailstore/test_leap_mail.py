@@ -17,7 +17,7 @@
 from mock import patch
 from twisted.trial.unittest import TestCase
 
-from pixelated.adapter.mailstore.leap_mailstore import LeapMail, AttachmentInfo
+from pixelated.adapter.mailstore.leap_mailstore import LeapMail, AttachmentInfo, MailSummary
 
 
 class TestLeapMail(TestCase):
@@ -210,6 +210,26 @@ class TestLeapMail(TestCase):
         self.assertEquals([], mail.headers['Cc'])
         self.assertEquals([], mail.headers['Bcc'])
 
+    def test_headers_are_split_only_once(self):
+        mail = LeapMail('id', 'INBOX', {'To': 'first@example.test,second@example.test'})
+
+        self.assertIs(mail.headers, mail.headers)
+        self.assertEqual(['first@example.test', 'second@example.test'], mail.headers['To'])
+
+    def test_copy_with_body_keeps_derived_headers(self):
+        mail = LeapMail('id', 'INBOX', {'Subject': 'A test Mail'})
+        mail.as_dict()
+
+        copy = mail.with_body('some body content')
+
+        self.assertIs(mail.headers, copy.headers)
+        self.assertEqual('A test Mail', copy.as_dict()['header']['subject'])
+
+    def test_leap_mail_has_no_instance_dict(self):
+        mail = LeapMail('id', 'INBOX', {})
+
+        self.assertFalse(hasattr(mail, '__dict__'))
+
     def test_security_casing(self):
         # No Encryption, no Signature
         mail = LeapMail('id', 'INBOX', {})
@@ -228,3 +248,28 @@ class TestLeapMail(TestCase):
 
         mail = LeapMail('id', 'INBOX', {'X-Leap-Signature': 'invalid'})
         self.assertEqual([], mail.security_casing['imprints'])
+
+
+class TestMailSummary(TestCase):
+    def test_as_dict(self):
+        summary = MailSummary('doc id', 'INBOX', {'From': 'test@example.test', 'Subject': 'A test Mail', 'To': 'receiver@example.test'}, ('foo', 'bar'), {'\\Seen'}, [AttachmentInfo('id', 'name', 'encoding')])
+
+        expected = {
+            'header': {
+                'from': 'test@example.test',
+                'subject': 'A test Mail',
+                'to': ['receiver@example.test'],
+            },
+            'ident': 'doc id',
+            'mailbox': 'inbox',
+            'tags': {'foo', 'bar'},
+            'status': ['read'],
+            'attachments': [{'ident': 'id', 'name': 'name', 'encoding': 'encoding'}]
+        }
+
+        self.assertEqual(expected, summary.as_dict())
+
+    def test_as_dict_headers_with_special_chars(self):
+        summary = MailSummary('', 'INBOX', {'Subject': '=?iso-8859-1?q?H=E4ll=F6_W=F6rld?='})
+
+        self.assertEqual(u'H\xe4ll\xf6 W\xf6rld', summary.as_dict()['header']['subject'])
@@ -26,7 +26,6 @@ from email.parser import Parser
 import os
 from leap.soledad.common.document import SoledadDocument
 from leap.mail.adaptors.soledad_indexes import MAIL_INDEXES
-from twisted.internet.defer import FirstError
 from twisted.trial.unittest import TestCase
 from leap.mail import constants
 from twisted.internet import defer
@@ -36,8 +35,9 @@ from leap.mail.adaptors.soledad import SoledadMailAdaptor, MailboxWrapper, Conte
 import pkg_resources
 from leap.mail.mail import Message
 from pixelated.adapter.mailstore import underscore_uuid
+from pixelated.adapter.model.status import Status
 
-from pixelated.adapter.mailstore.leap_mailstore import LeapMailStore, LeapMail, AttachmentInfo
+from pixelated.adapter.mailstore.leap_mailstore import LeapMailStore, LeapMail, AttachmentInfo, MailSummary
 
 
 class TestLeapMailStore(TestCase):
@@ -48,9 +48,16 @@ class TestLeapMailStore(TestCase):
         self.mbox_uuid_by_name = {}
         self.mbox_soledad_docs = []
 
+        self.get_docs_calls = []
+
         when(self.soledad).get_from_index('by-type', 'mbox').thenAnswer(lambda: defer.succeed(self.mbox_soledad_docs))
+        self.soledad.get_docs = self._get_docs
         self._mock_get_mailbox('INBOX')
 
+    def _get_docs(self, doc_ids):
+        self.get_docs_calls.append(list(doc_ids))
+        return defer.succeed([self.doc_by_id[doc_id] for doc_id in doc_ids if doc_id in self.doc_by_id])
+
     @defer.inlineCallbacks
     def test_get_mail_not_exist(self):
         when(self.soledad).get_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
@@ -114,14 +121,66 @@ class TestLeapMailStore(TestCase):
         self.assertEqual('Error illum dignissimos autem eos aspernatur.', mails[1].subject)
 
     @defer.inlineCallbacks
-    def test_get_mails_fails_for_invalid_mail_id(self):
+    def test_get_mails_returns_none_for_invalid_mail_id(self):
         store = LeapMailStore(self.soledad)
 
-        try:
-            yield store.get_mails(['invalid'])
-            self.fail('Exception expected')
-        except FirstError:
-            pass
+        mails = yield store.get_mails(['invalid'])
+
+        self.assertEqual([None], mails)
+
+    @defer.inlineCallbacks
+    def test_get_mails_fetches_docs_in_batches(self):
+        mail_ids = [self._add_mail_fixture_to_soledad_from_file(mail_file)[0] for mail_file in ('mbox00000000', 'mbox00000001')]
+
+        store = LeapMailStore(self.soledad)
+
+        mails = yield store.get_mails(mail_ids)
+
+        self.assertEqual(mail_ids, [mail.mail_id for mail in mails])
+        self.assertEqual(2, len(self.get_docs_calls))
+        self.assertEqual(mail_ids, self.get_docs_calls[0])
+        self.assertEqual(4, len(self.get_docs_calls[1]))
+        verify(self.soledad, times=0).get_doc(ANY())
+
+    @defer.inlineCallbacks
+    def test_get_mails_keeps_order_and_skips_missing_mails(self):
+        first_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        second_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000001')
+        missing_mdoc_id = _format_mdoc_id(underscore_uuid(self.mbox_uuid), 'ABCDEF')
+
+        store = LeapMailStore(self.soledad)
+
+        mails = yield store.get_mails([second_mdoc_id, missing_mdoc_id, first_mdoc_id])
+
+        self.assertEqual('Error illum dignissimos autem eos aspernatur.', mails[0].subject)
+        self.assertIsNone(mails[1])
+        self.assertEqual('Itaque consequatur repellendus provident sunt quia.', mails[2].subject)
+
+    @defer.inlineCallbacks
+    def test_get_mail_summaries(self):
+        first_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        second_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000001')
+
+        store = LeapMailStore(self.soledad)
+
+        summaries = yield store.get_mail_summaries([first_mdoc_id, second_mdoc_id])
+
+        self.assertIsInstance(summaries[0], MailSummary)
+        self.assertEqual([first_mdoc_id, second_mdoc_id], [summary.ident for summary in summaries])
+        self.assertEqual('Itaque consequatur repellendus provident sunt quia.', summaries[0].as_dict()['header']['subject'])
+        self.assertEqual('inbox', summaries[1].as_dict()['mailbox'])
+
+    @defer.inlineCallbacks
+    def test_get_mail_revisions_returns_revisions_of_flags_docs(self):
+        mdoc_id, fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        self.doc_by_id[fdoc_id].rev = 'replica:2'
+
+        store = LeapMailStore(self.soledad)
+
+        revisions = yield store.get_mail_revisions([mdoc_id, _format_mdoc_id(uuid4(), 1)])
+
+        self.assertEqual({mdoc_id: 'replica:2'}, revisions)
+        self.assertEqual(fdoc_id, self.get_docs_calls[0][0])
 
     @defer.inlineCallbacks
     def test_get_mail_with_body(self):
@@ -134,6 +193,18 @@ class TestLeapMailStore(TestCase):
 
         self.assertEqual(expeted_body, mail.body)
 
+    @defer.inlineCallbacks
+    def test_get_mail_parses_each_body_only_once(self):
+        mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        store = LeapMailStore(self.soledad)
+
+        first = yield store.get_mail(mdoc_id, include_body=True)
+        second = yield store.get_mail(mdoc_id, include_body=True)
+
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(1, store._parsed_bodies.stats()['hits'])
+        self.assertEqual(1, store._parsed_bodies.stats()['entries'])
+
     @defer.inlineCallbacks
     def test_get_mail_attachment(self):
         attachment_id = 'AAAA9AAD9E153D24265395203C53884506ABA276394B9FEC02B214BF9E77E48E'
@@ -162,6 +233,20 @@ class TestLeapMailStore(TestCase):
 
             self.assertEqual(bytearray(data), attachment['content'])
 
+    @defer.inlineCallbacks
+    def test_get_mail_attachment_content(self):
+        attachment_id = '1B0A9AAD9E153D24265395203C53884506ABA276394B9FEC02B214BF9E77E48E'
+        doc = SoledadDocument(json=json.dumps({'content_type': 'foo/bar', 'raw': 'YXNkZg==',
+                                               'content_transfer_encoding': 'base64'}))
+        when(self.soledad).get_from_index('by-type-and-payloadhash', 'cnt', attachment_id).thenReturn(defer.succeed([doc]))
+        store = LeapMailStore(self.soledad)
+
+        content = yield store.get_mail_attachment_content(attachment_id)
+
+        self.assertEqual('foo/bar', content.content_type)
+        self.assertEqual(4, content.size)
+        self.assertEqual('asdf', content.open().read(10))
+
     @defer.inlineCallbacks
     def test_get_mail_attachment_throws_exception_if_attachment_does_not_exist(self):
         attachment_id = '1B0A9AAD9E153D24265395203C53884506ABA276394B9FEC02B214BF9E77E48E'
@@ -190,6 +275,49 @@ class TestLeapMailStore(TestCase):
         verify(self.soledad).put_doc(soledad_fdoc)
         self.assertTrue('new_tag' in soledad_fdoc.content['tags'])
 
+    @defer.inlineCallbacks
+    def test_update_flags_only_touches_flags_docs(self):
+        first_mdoc_id, first_fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        second_mdoc_id, second_fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000001')
+        when(self.soledad).put_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
+
+        store = LeapMailStore(self.soledad)
+
+        updated_ids = yield store.update_flags([first_mdoc_id, second_mdoc_id], add=[Status.SEEN])
+
+        self.assertEqual({first_mdoc_id, second_mdoc_id}, set(updated_ids))
+        self.assertEqual([[first_fdoc_id, second_fdoc_id]], self.get_docs_calls)
+        verify(self.soledad, times=0).get_doc(ANY())
+        for fdoc_id in (first_fdoc_id, second_fdoc_id):
+            verify(self.soledad).put_doc(self.doc_by_id[fdoc_id])
+            self.assertIn(Status.SEEN, self.doc_by_id[fdoc_id].content['flags'])
+            self.assertTrue(self.doc_by_id[fdoc_id].content['seen'])
+
+    @defer.inlineCallbacks
+    def test_update_flags_removes_flags(self):
+        mdoc_id, fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        self.doc_by_id[fdoc_id].content['flags'] = [Status.SEEN, Status.ANSWERED]
+        when(self.soledad).put_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
+
+        store = LeapMailStore(self.soledad)
+
+        yield store.update_flags([mdoc_id], remove=[Status.SEEN])
+
+        self.assertEqual([Status.ANSWERED], self.doc_by_id[fdoc_id].content['flags'])
+        self.assertFalse(self.doc_by_id[fdoc_id].content['seen'])
+
+    @defer.inlineCallbacks
+    def test_update_tags(self):
+        mdoc_id, fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        when(self.soledad).put_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
+
+        store = LeapMailStore(self.soledad)
+
+        yield store.update_tags([mdoc_id], {'new_tag'})
+
+        verify(self.soledad).put_doc(self.doc_by_id[fdoc_id])
+        self.assertEqual(['new_tag'], self.doc_by_id[fdoc_id].content['tags'])
+
     @defer.inlineCallbacks
     def test_all_mails(self):
         first_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
@@ -205,6 +333,25 @@ class TestLeapMailStore(TestCase):
         self.assertEqual('Itaque consequatur repellendus provident sunt quia.', mails[0].subject)
         self.assertEqual('Error illum dignissimos autem eos aspernatur.', mails[1].subject)
 
+    @defer.inlineCallbacks
+    def test_iter_mails_loads_one_batch_at_a_time(self):
+        first_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        second_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000001')
+        when(self.soledad).get_from_index('by-type', 'meta').thenReturn(defer.succeed([self.doc_by_id[first_mdoc_id], self.doc_by_id[second_mdoc_id]]))
+
+        store = LeapMailStore(self.soledad)
+
+        batches = yield store.iter_mails(batch_size=1)
+        first_batch = yield next(batches)
+
+        self.assertEqual([first_mdoc_id], [mail.mail_id for mail in first_batch])
+        self.assertEqual(1, len(self.get_docs_calls))
+
+        second_batch = yield next(batches)
+
+        self.assertEqual([second_mdoc_id], [mail.mail_id for mail in second_batch])
+        self.assertRaises(StopIteration, next, batches)
+
     @defer.inlineCallbacks
     def test_add_mailbox(self):
         when(self.soledad).list_indexes().thenReturn(defer.succeed(MAIL_INDEXES)).thenReturn(defer.succeed(MAIL_INDEXES))
@@ -252,6 +399,53 @@ class TestLeapMailStore(TestCase):
         name = yield store._mailbox_name_from_uuid(new_uuid)
         self.assertEquals('', name)
 
+    @defer.inlineCallbacks
+    def test_mailbox_names_are_only_queried_once(self):
+        first_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        second_mdoc_id, _ = self._add_mail_fixture_to_soledad_from_file('mbox00000001')
+        store = LeapMailStore(self.soledad)
+
+        yield store.get_mail(first_mdoc_id)
+        yield store.get_mail(second_mdoc_id)
+
+        verify(self.soledad, times=1).get_from_index('by-type', 'mbox')
+
+    @defer.inlineCallbacks
+    def test_created_mailbox_is_added_to_mailbox_names(self):
+        store = LeapMailStore(self.soledad)
+        yield store.get_mailbox_names()
+        self._mock_get_mailbox('OTHER', create_new_uuid=True)
+
+        yield store.add_mailbox('OTHER')
+        names = yield store.get_mailbox_names()
+
+        self.assertEqual({'INBOX', 'OTHER'}, names)
+        verify(self.soledad, times=1).get_from_index('by-type', 'mbox')
+
+    @defer.inlineCallbacks
+    def test_deleted_mailbox_is_removed_from_mailbox_names(self):
+        _, mbox_soledad_doc = self._mock_get_mailbox('OTHER', create_new_uuid=True)
+        when(self.soledad).delete_doc(mbox_soledad_doc).thenReturn(defer.succeed(None))
+        store = LeapMailStore(self.soledad)
+        yield store.get_mailbox_names()
+
+        yield store.delete_mailbox('OTHER')
+        names = yield store.get_mailbox_names()
+
+        self.assertEqual({'INBOX'}, names)
+
+    @defer.inlineCallbacks
+    def test_refresh_after_sync_reloads_mailbox_names(self):
+        store = LeapMailStore(self.soledad)
+        yield store.get_mailbox_names()
+        self._mock_get_mailbox('SYNCED', create_new_uuid=True)
+
+        yield store.refresh_after_sync()
+        names = yield store.get_mailbox_names()
+
+        self.assertEqual({'INBOX', 'SYNCED'}, names)
+        verify(self.soledad, times=2).get_from_index('by-type', 'mbox')
+
     @defer.inlineCallbacks
     def test_add_mail(self):
         expected_message = self._add_create_mail_mocks_to_soledad_from_fixture_file('mbox00000000')
@@ -322,6 +516,34 @@ class TestLeapMailStore(TestCase):
 
         self._assert_mail_got_deleted(fdoc_id, mdoc_id)
 
+    @defer.inlineCallbacks
+    def test_delete_mails_loads_docs_in_one_batch(self):
+        first_mdoc_id, first_fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        second_mdoc_id, second_fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000001')
+        missing_mdoc_id = _format_mdoc_id(underscore_uuid(self.mbox_uuid), 'ABCDEF')
+        when(self.soledad).delete_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
+        store = LeapMailStore(self.soledad)
+
+        deleted_ids = yield store.delete_mails([first_mdoc_id, missing_mdoc_id, second_mdoc_id])
+
+        self.assertEqual([first_mdoc_id, second_mdoc_id], deleted_ids)
+        self.assertEqual(1, len(self.get_docs_calls))
+        self._assert_mail_got_deleted(first_fdoc_id, first_mdoc_id)
+        self._assert_mail_got_deleted(second_fdoc_id, second_mdoc_id)
+        verify(self.soledad, times=0).get_doc(ANY())
+
+    @defer.inlineCallbacks
+    def test_mail_changes_since_maps_changed_meta_and_flags_docs_to_mail_ids(self):
+        changes = [('M-uuid-A', 11, 'T-1'), ('F-uuid-A', 12, 'T-2'), ('F-uuid-B', 13, 'T-3'), ('H-B', 14, 'T-4'), ('C-B', 15, 'T-5')]
+        self.soledad._dbpool = mock()
+        when(self.soledad._dbpool).runU1DBQuery('whats_changed', 10).thenReturn(defer.succeed((15, 'T-5', changes)))
+        store = LeapMailStore(self.soledad)
+
+        generation, mail_ids = yield store.mail_changes_since(10)
+
+        self.assertEqual(15, generation)
+        self.assertEqual(['M-uuid-A', 'M-uuid-B'], mail_ids)
+
     @defer.inlineCallbacks
     def test_get_mailbox_mail_ids(self):
         mdoc_id, fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
@@ -358,15 +580,97 @@ class TestLeapMailStore(TestCase):
 
     @defer.inlineCallbacks
     def test_move_to_mailbox(self):
-        expected_message = self._add_create_mail_mocks_to_soledad_from_fixture_file('mbox00000000')
         mail_id, fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
-        self._mock_get_mailbox('TRASH')
+        self._mock_get_mailbox('TRASH', create_new_uuid=True)
+        when(self.soledad).put_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
         store = LeapMailStore(self.soledad)
 
         mail = yield store.move_mail_to_mailbox(mail_id, 'TRASH')
 
-        self._assert_message_docs_created(expected_message, mail, only_mdoc_and_fdoc=True)
-        self._assert_mail_got_deleted(fdoc_id, mail_id)
+        self.assertEqual(mail_id, mail.mail_id)
+        self.assertEqual('TRASH', mail.mailbox_name)
+        self.assertEqual(underscore_uuid(self.mbox_uuid_by_name['TRASH']), self.doc_by_id[fdoc_id].content['mbox_uuid'])
+        verify(self.soledad).put_doc(self.doc_by_id[fdoc_id])
+        verify(self.soledad, times=0).create_doc(ANY(), doc_id=ANY())
+        verify(self.soledad, times=0).delete_doc(ANY())
+
+    @defer.inlineCallbacks
+    def test_move_mails_to_mailbox_loads_flags_docs_in_one_batch(self):
+        first_mdoc_id, first_fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        second_mdoc_id, second_fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000001')
+        self._mock_get_mailbox('TRASH', create_new_uuid=True)
+        when(self.soledad).put_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
+        store = LeapMailStore(self.soledad)
+
+        mails = yield store.move_mails_to_mailbox([first_mdoc_id, second_mdoc_id], 'TRASH')
+
+        self.assertEqual({first_mdoc_id, second_mdoc_id}, set(mail.mail_id for mail in mails))
+        self.assertEqual(['TRASH', 'TRASH'], [mail.mailbox_name for mail in mails])
+        self.assertIn([first_fdoc_id, second_fdoc_id], self.get_docs_calls)
+        verify(self.soledad, times=0).get_doc(first_fdoc_id)
+
+    @defer.inlineCallbacks
+    def test_add_mail_relocates_mail_moved_out_of_the_mailbox_before(self):
+        self._add_create_mail_mocks_to_soledad_from_fixture_file('mbox00000000')
+        moved_mdoc_id, moved_fdoc_id = self._move_mail_fixture_in_place('mbox00000000', 'TRASH')
+        moved_docs = self.doc_by_id[moved_mdoc_id], self.doc_by_id[moved_fdoc_id]
+        relocated_mdoc_id = self._add_copy_mocks_to_soledad('mbox00000000', 'TRASH')
+        when(self.soledad).delete_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
+        store = LeapMailStore(self.soledad)
+
+        mail = yield store.add_mail('INBOX', self._load_mail_from_file('mbox00000000').as_string())
+
+        self.assertEqual(moved_mdoc_id, mail.mail_id)
+        self.assertEqual(relocated_mdoc_id, mail.relocated_mail_id)
+        verify(self.soledad).create_doc(ANY(), doc_id=relocated_mdoc_id)
+        verify(self.soledad).delete_doc(moved_docs[0])
+        verify(self.soledad).delete_doc(moved_docs[1])
+
+    @defer.inlineCallbacks
+    def test_copy_mail_back_to_the_mailbox_it_was_moved_out_of(self):
+        moved_mdoc_id, moved_fdoc_id = self._move_mail_fixture_in_place('mbox00000000', 'TRASH')
+        moved_docs = self.doc_by_id[moved_mdoc_id], self.doc_by_id[moved_fdoc_id]
+        relocated_mdoc_id = self._add_copy_mocks_to_soledad('mbox00000000', 'TRASH')
+        self._add_copy_mocks_to_soledad('mbox00000000', 'INBOX')
+        when(self.soledad).delete_doc(ANY()).thenAnswer(lambda: defer.succeed(None))
+        store = LeapMailStore(self.soledad)
+
+        mail = yield store.copy_mail_to_mailbox(moved_mdoc_id, 'INBOX')
+
+        self.assertEqual(moved_mdoc_id, mail.mail_id)
+        self.assertEqual('INBOX', mail.mailbox_name)
+        self.assertEqual(relocated_mdoc_id, mail.relocated_mail_id)
+        verify(self.soledad).create_doc(ANY(), doc_id=relocated_mdoc_id)
+        verify(self.soledad).create_doc(ANY(), doc_id=moved_mdoc_id)
+        verify(self.soledad).delete_doc(moved_docs[0])
+        verify(self.soledad).delete_doc(moved_docs[1])
+
+    @defer.inlineCallbacks
+    def test_copy_mail_to_other_mailbox_leaves_mails_in_place(self):
+        self._add_create_mail_mocks_to_soledad_from_fixture_file('mbox00000000')
+        mail_id, fdoc_id = self._add_mail_fixture_to_soledad_from_file('mbox00000000')
+        self._mock_get_mailbox('TRASH')
+        store = LeapMailStore(self.soledad)
+
+        mail = yield store.copy_mail_to_mailbox(mail_id, 'TRASH')
+
+        self.assertIsNone(mail.relocated_mail_id)
+        verify(self.soledad, times=0).delete_doc(ANY())
+
+    def _move_mail_fixture_in_place(self, mail_file, mailbox_name):
+        mdoc_id, fdoc_id = self._add_mail_fixture_to_soledad_from_file(mail_file)
+        self._mock_get_mailbox(mailbox_name, create_new_uuid=True)
+        self.doc_by_id[fdoc_id].content['mbox_uuid'] = underscore_uuid(self.mbox_uuid_by_name[mailbox_name])
+        return mdoc_id, fdoc_id
+
+    def _add_copy_mocks_to_soledad(self, mail_file, mailbox_name):
+        wrapper = self._convert_mail_to_leap_message(self._load_mail_from_file(mail_file), self.mbox_uuid_by_name[mailbox_name]).get_wrapper()
+        for doc_id, doc in ((wrapper.mdoc.future_doc_id, wrapper.mdoc), (wrapper.mdoc.fdoc, wrapper.fdoc)):
+            def create_doc(doc_id=doc_id, doc=doc):
+                self._mock_get_soledad_doc(doc_id, doc)
+                return defer.succeed(self.doc_by_id[doc_id])
+            when(self.soledad).create_doc(ANY(), doc_id=doc_id).thenAnswer(create_doc)
+        return wrapper.mdoc.future_doc_id
 
     def _assert_mail_got_deleted(self, fdoc_id, mail_id):
         verify(self.soledad).delete_doc(self.doc_by_id[mail_id])
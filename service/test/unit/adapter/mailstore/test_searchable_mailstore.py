@@ -15,7 +15,7 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 from email.parser import Parser
 import os
-from mockito import verify, mock, when
+from mockito import verify, mock, when, any as ANY
 import pkg_resources
 from twisted.internet import defer
 from twisted.trial.unittest import TestCase
@@ -23,6 +23,7 @@ from pixelated.adapter.mailstore import MailStore
 from pixelated.adapter.mailstore.leap_mailstore import LeapMail
 from pixelated.adapter.mailstore.searchable_mailstore import SearchableMailStore
 from pixelated.adapter.search import SearchEngine
+from tempdir import TempDir
 
 
 ANY_MAILBOX = 'INBOX'
@@ -35,6 +36,10 @@ class TestSearchableMailStore(TestCase):
         self.search_index = mock(mocked_obj=SearchEngine)
         self.delegate_mail_store = mock(mocked_obj=MailStore)
         self.store = SearchableMailStore(self.delegate_mail_store, self.search_index)
+        self.indexed_mails = []
+        self.search_index.index_mails = lambda mails: self.indexed_mails.extend(mails)
+        self.changed_mails = []
+        self.search_index.change_mails = lambda mail_ids, change: self.changed_mails.append((mail_ids, change))
 
     @defer.inlineCallbacks
     def test_add_mail_delegates_to_mail_store_and_updates_index(self):
@@ -58,6 +63,28 @@ class TestSearchableMailStore(TestCase):
         verify(self.delegate_mail_store).delete_mail('mail id')
         verify(self.search_index).remove_from_index('mail id')
 
+    @defer.inlineCallbacks
+    def test_delete_mails_delegates_to_mail_store_and_updates_index(self):
+        when(self.delegate_mail_store).delete_mails(['mail id', 'other id']).thenReturn(defer.succeed(['mail id', 'other id']))
+        when(self.search_index).remove_all_from_index(['mail id', 'other id']).thenReturn(None)
+
+        result = yield self.store.delete_mails(['mail id', 'other id'])
+
+        self.assertEqual(['mail id', 'other id'], result)
+        verify(self.search_index).remove_all_from_index(['mail id', 'other id'])
+
+    @defer.inlineCallbacks
+    def test_changes_go_through_index_queue_if_there_is_one(self):
+        index_queue = mock()
+        store = SearchableMailStore(self.delegate_mail_store, self.search_index, index_queue)
+        leap_mail = LeapMail('id', ANY_MAILBOX)
+        when(self.delegate_mail_store).add_mail(ANY_MAILBOX, 'raw mail').thenReturn(defer.succeed(leap_mail))
+
+        yield store.add_mail(ANY_MAILBOX, 'raw mail')
+
+        verify(index_queue).index_mail(leap_mail)
+        verify(self.search_index, times=0).index_mail(leap_mail)
+
     @defer.inlineCallbacks
     def test_update_mail_delegates_to_mail_store_and_updates_index(self):
         leap_mail = LeapMail('id', ANY_MAILBOX)
@@ -78,15 +105,79 @@ class TestSearchableMailStore(TestCase):
         self.assertEqual(copied_mail, result)
 
     @defer.inlineCallbacks
-    def test_move_mail_delegates_to_mail_store_and_updates_index(self):
-        moved_mail = LeapMail('new id', ANY_MAILBOX)
-        when(self.delegate_mail_store).move_mail_to_mailbox('mail id', ANY_MAILBOX).thenReturn(defer.succeed(moved_mail))
+    def test_copy_mail_indexes_mail_relocated_out_of_its_way(self):
+        tempdir = TempDir()
+        self.addCleanup(tempdir.dissolve)
+        search_engine = SearchEngine('k' * 32, tempdir.name)
+        store = SearchableMailStore(self.delegate_mail_store, search_engine)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Same content', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        # the mail was moved to TRASH keeping the id it had in INBOX
+        search_engine.index_mail(LeapMail('inbox id', 'TRASH', headers=headers))
+        copied_mail = LeapMail('inbox id', 'INBOX', headers=headers)
+        copied_mail.relocated_mail_id = 'trash id'
+        when(self.delegate_mail_store).copy_mail_to_mailbox('inbox id', 'INBOX').thenReturn(defer.succeed(copied_mail))
+        when(self.delegate_mail_store).get_mails(['trash id'], include_body=True).thenReturn(defer.succeed([LeapMail('trash id', 'TRASH', headers=headers)]))
+
+        yield store.copy_mail_to_mailbox('inbox id', 'INBOX')
+
+        self.assertEqual((['inbox id'], 1), (yield search_engine.search('tag:inbox')))
+        self.assertEqual((['trash id'], 1), (yield search_engine.search('tag:trash')))
+        self.assertEqual(['inbox id', 'trash id'], sorted((yield search_engine.search('content'))[0]))
 
-        result = yield self.store.move_mail_to_mailbox('mail id', ANY_MAILBOX)
+    @defer.inlineCallbacks
+    def test_add_mail_indexes_mail_relocated_out_of_its_way(self):
+        added_mail = LeapMail('mail id', ANY_MAILBOX)
+        added_mail.relocated_mail_id = 'relocated id'
+        relocated_mail = LeapMail('relocated id', 'TRASH')
+        when(self.delegate_mail_store).add_mail(ANY_MAILBOX, 'raw mail').thenReturn(defer.succeed(added_mail))
+        when(self.delegate_mail_store).get_mails(['relocated id'], include_body=True).thenReturn(defer.succeed([relocated_mail]))
+        self.search_index.index_mail = lambda mail: self.indexed_mails.append(mail)
+
+        yield self.store.add_mail(ANY_MAILBOX, 'raw mail')
+
+        self.assertEqual([added_mail, relocated_mail], self.indexed_mails)
+
+    @defer.inlineCallbacks
+    def test_move_mail_delegates_to_mail_store_and_changes_mailbox_in_index(self):
+        moved_mail = LeapMail('mail id', 'TRASH')
+        when(self.delegate_mail_store).move_mail_to_mailbox('mail id', 'TRASH').thenReturn(defer.succeed(moved_mail))
+
+        result = yield self.store.move_mail_to_mailbox('mail id', 'TRASH')
 
-        verify(self.search_index).remove_from_index('mail id')
-        verify(self.search_index).index_mail(moved_mail)
         self.assertEqual(moved_mail, result)
+        self.assertEqual([(['mail id'], 'TRASH')], [(mail_ids, change.mailbox_name) for mail_ids, change in self.changed_mails])
+
+    @defer.inlineCallbacks
+    def test_move_mails_changes_mailbox_of_moved_mails_without_loading_them(self):
+        moved_mails = [LeapMail('mail id', 'TRASH'), LeapMail('other id', 'TRASH')]
+        when(self.delegate_mail_store).move_mails_to_mailbox(['mail id', 'other id', 'deleted id'], 'TRASH').thenReturn(defer.succeed(moved_mails))
+
+        result = yield self.store.move_mails_to_mailbox(['mail id', 'other id', 'deleted id'], 'TRASH')
+
+        self.assertEqual(moved_mails, result)
+        self.assertEqual([(['mail id', 'other id'], 'TRASH')], [(mail_ids, change.mailbox_name) for mail_ids, change in self.changed_mails])
+        verify(self.delegate_mail_store, times=0).get_mails(ANY(), include_body=ANY())
+
+    @defer.inlineCallbacks
+    def test_update_flags_changes_flags_in_index_without_loading_mails(self):
+        when(self.delegate_mail_store).update_flags(['mail id', 'deleted id'], ['\\Seen'], ()).thenReturn(defer.succeed(['mail id']))
+
+        result = yield self.store.update_flags(['mail id', 'deleted id'], add=['\\Seen'])
+
+        self.assertEqual(['mail id'], result)
+        [(mail_ids, change)] = self.changed_mails
+        self.assertEqual(['mail id'], mail_ids)
+        self.assertEqual(({'\\Seen'}, set()), (change.add_flags, change.remove_flags))
+        verify(self.delegate_mail_store, times=0).get_mails(ANY(), include_body=ANY())
+
+    @defer.inlineCallbacks
+    def test_update_tags_changes_tags_in_index_without_loading_mails(self):
+        when(self.delegate_mail_store).update_tags(['mail id'], {'tag'}).thenReturn(defer.succeed(['mail id']))
+
+        yield self.store.update_tags(['mail id'], {'tag'})
+
+        self.assertEqual([(['mail id'], {'tag'})], [(mail_ids, change.tags) for mail_ids, change in self.changed_mails])
+        self.assertEqual([], self.indexed_mails)
 
     @defer.inlineCallbacks
     def test_other_methods_are_delegated(self):
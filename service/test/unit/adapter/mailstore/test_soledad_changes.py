@@ -0,0 +1,46 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from mockito import mock, when
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from pixelated.adapter.mailstore.soledad_changes import SoledadChanges
+
+
+class TestSoledadChanges(TestCase):
+
+    def setUp(self):
+        self.soledad = mock()
+        self.soledad._dbpool = mock()
+        self.changes = SoledadChanges(self.soledad)
+
+    @defer.inlineCallbacks
+    def test_current_generation_is_read_from_local_database(self):
+        when(self.soledad._dbpool).runU1DBQuery('_get_generation').thenReturn(defer.succeed(42))
+
+        generation = yield self.changes.current_generation()
+
+        self.assertEqual(42, generation)
+
+    @defer.inlineCallbacks
+    def test_doc_ids_changed_since_come_from_the_changes_feed(self):
+        changes = [('M-uuid-A', 11, 'T-1'), ('H-A', 12, 'T-2')]
+        when(self.soledad._dbpool).runU1DBQuery('whats_changed', 10).thenReturn(defer.succeed((12, 'T-2', changes)))
+
+        generation, doc_ids = yield self.changes.doc_ids_changed_since(10)
+
+        self.assertEqual(12, generation)
+        self.assertEqual(['M-uuid-A', 'H-A'], doc_ids)
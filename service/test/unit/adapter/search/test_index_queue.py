@@ -0,0 +1,162 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from twisted.internet import defer, task
+from twisted.trial.unittest import TestCase
+from pixelated.adapter.mailstore.leap_mailstore import LeapMail
+from pixelated.adapter.search.index_queue import IndexQueue
+from pixelated.adapter.search.indexed_mail_change import IndexedMailChange
+
+
+class SearchEngineStub(object):
+    def __init__(self):
+        self.commits = []
+        self.changes = []
+
+    def write_changes(self, mails, removed_mail_ids, changes):
+        self.commits.append(([mail.mail_id for mail in mails], removed_mail_ids))
+        self.changes.append(changes)
+
+
+class TestIndexQueue(TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.search_engine = SearchEngineStub()
+        self.writes = []
+        self.queue = IndexQueue(self.search_engine, max_batch_size=3, max_delay=1, clock=self.clock, run_in_writer=self._write_later)
+
+    def _write_later(self, function, *args):
+        d = defer.Deferred()
+        d.addCallback(lambda _: function(*args))
+        self.writes.append(d)
+        return d
+
+    def _finish_writes(self):
+        writes, self.writes = self.writes, []
+        for write in writes:
+            write.callback(None)
+
+    def test_changes_are_committed_together_after_max_delay(self):
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+        self.clock.advance(0.5)
+        self.queue.remove_from_index('second')
+
+        self.assertEqual(0.5, self.queue.lag)
+        self.clock.advance(0.5)
+        self._finish_writes()
+
+        self.assertEqual([(['first'], ['second'])], self.search_engine.commits)
+        self.assertEqual(0, self.queue.stats()['queued'])
+        self.assertEqual(0.0, self.queue.lag)
+
+    def test_full_batch_is_committed_right_away(self):
+        self.queue.index_mails([LeapMail(mail_id, 'INBOX') for mail_id in ('first', 'second', 'third')])
+        self._finish_writes()
+
+        self.assertEqual([(['first', 'second', 'third'], [])], self.search_engine.commits)
+
+    def test_later_change_of_a_mail_wins(self):
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+        self.queue.remove_from_index('first')
+
+        self.clock.advance(1)
+        self._finish_writes()
+
+        self.assertEqual([([], ['first'])], self.search_engine.commits)
+
+    def test_mail_added_after_its_removal_stays_in_the_index(self):
+        self.queue.remove_all_from_index(['first', 'second'])
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+
+        self.clock.advance(1)
+        self._finish_writes()
+
+        self.assertEqual([(['first'], ['second'])], self.search_engine.commits)
+
+    def test_changes_are_applied_after_what_was_queued_for_a_mail(self):
+        seen, work = IndexedMailChange(add_flags=['\\Seen']), IndexedMailChange(tags={'work'})
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+        self.queue.change_mails(['first', 'second'], seen)
+        self.queue.remove_from_index('second')
+        self.queue.change_mails(['first', 'second'], work)
+
+        self.clock.advance(1)
+        self._finish_writes()
+
+        self.assertEqual([(['first'], ['second'])], self.search_engine.commits)
+        self.assertEqual([{'first': [seen, work]}], self.search_engine.changes)
+
+    def test_change_of_a_mail_not_queued_is_applied_to_the_indexed_mail(self):
+        seen = IndexedMailChange(add_flags=['\\Seen'])
+        self.queue.change_mails(['first'], seen)
+
+        self.clock.advance(1)
+        self._finish_writes()
+
+        self.assertEqual([([], [])], self.search_engine.commits)
+        self.assertEqual([{'first': [seen]}], self.search_engine.changes)
+
+    def test_mail_indexed_again_replaces_queued_changes(self):
+        self.queue.change_mails(['first'], IndexedMailChange(add_flags=['\\Seen']))
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+
+        self.clock.advance(1)
+        self._finish_writes()
+
+        self.assertEqual([(['first'], [])], self.search_engine.commits)
+        self.assertEqual([{}], self.search_engine.changes)
+
+    def test_there_is_only_one_commit_at_a_time(self):
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+        self.clock.advance(1)
+        self.queue.index_mail(LeapMail('second', 'INBOX'))
+        self.clock.advance(1)
+
+        self.assertEqual(1, len(self.writes))
+        self._finish_writes()
+        self.assertEqual(1, len(self.writes))
+        self._finish_writes()
+
+        self.assertEqual([(['first'], []), (['second'], [])], self.search_engine.commits)
+
+    def test_flush_fires_once_queued_changes_are_committed(self):
+        flushed = []
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+
+        self.queue.flush().addCallback(flushed.append)
+
+        self.assertEqual([], flushed)
+        self._finish_writes()
+        self.assertEqual([None], flushed)
+        self.assertEqual(1, self.queue.stats()['commits'])
+
+    def test_flush_waits_for_running_commit(self):
+        flushed = []
+        self.queue.index_mail(LeapMail('first', 'INBOX'))
+        self.clock.advance(1)
+
+        self.queue.flush().addCallback(flushed.append)
+
+        self.assertEqual([], flushed)
+        self._finish_writes()
+        self.assertEqual([None], flushed)
+
+    def test_flush_without_changes_fires_right_away(self):
+        flushed = []
+
+        self.queue.flush().addCallback(flushed.append)
+
+        self.assertEqual([None], flushed)
@@ -15,9 +15,14 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
 
-import unittest
+import os
+from mock import patch
+from twisted.internet import defer
+from twisted.trial import unittest
 from pixelated.adapter.mailstore.leap_mailstore import LeapMail
+from pixelated.adapter.model.status import Status
 from pixelated.adapter.search import SearchEngine
+from pixelated.adapter.search.indexed_mail_change import IndexedMailChange
 from tempdir import TempDir
 from test.support import test_helper
 
@@ -45,6 +50,7 @@ class SearchEngineTest(unittest.TestCase):
     def tearDown(self):
         self.tempdir.dissolve()
 
+    @defer.inlineCallbacks
     def test_encoding(self):
         # given
         se = SearchEngine(INDEX_KEY, self.agent_home)
@@ -59,6 +65,180 @@ class SearchEngineTest(unittest.TestCase):
         # when
         se.index_mail(LeapMail('mailid', 'INBOX', headers=headers))   # test_helper.pixelated_mail(extra_headers=headers, chash='mailid'))
 
-        result = se.search('folker')
+        result = yield se.search('folker')
 
         self.assertEqual((['mailid'], 1), result)
+
+    def test_index_files_are_stored_with_the_compression_level_given(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home, compression_level=1)
+
+        self.assertEqual(1, se._storage.compression_level)
+
+    def test_temporary_files_are_kept_in_memory_up_to_the_limit_given(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home, temp_memory_limit=0)
+
+        self.assertEqual(0, se._storage.temp_memory_limit)
+
+    def test_bodies_are_not_stored_in_the_index(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+
+        se.index_mail(LeapMail('mailid', 'INBOX', headers=headers, body=u'the body'))
+
+        with se._index.searcher() as searcher:
+            self.assertNotIn('body', searcher.document(ident=u'mailid'))
+
+    @defer.inlineCallbacks
+    def test_flags_tags_and_mailbox_are_changed_on_the_indexed_mail(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mails([LeapMail('first', 'INBOX', headers=headers, tags={'work'}, body=u'the body'),
+                        LeapMail('second', 'INBOX', headers=headers)])
+
+        se.change_mails(['first'], IndexedMailChange(add_flags=[Status.SEEN]))
+        se.change_mails(['first', 'not indexed'], IndexedMailChange(tags={'home'}, mailbox_name='TRASH'))
+
+        self.assertEqual((['first'], 1), (yield se.search('tag:trash AND tag:home AND flags:%s' % Status.SEEN)))
+        self.assertEqual((['first'], 1), (yield se.search('body')))
+        self.assertEqual((['first'], 1), (yield se.search('sender:foo@bar.tld AND tag:trash')))
+        self.assertEqual({'inbox': 1, 'trash': 1, 'home': 1}, se._tag_counter.totals())
+        self.assertEqual({'trash': 1, 'home': 1}, se._tag_counter.read())
+
+    @defer.inlineCallbacks
+    def test_change_is_applied_to_mail_indexed_in_the_same_commit(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+
+        se.write_changes([LeapMail('first', 'INBOX', headers=headers)], [], {'first': [IndexedMailChange(remove_flags=[Status.SEEN], tags={'work'})]})
+
+        self.assertEqual((['first'], 1), (yield se.search('tag:inbox AND tag:work')))
+
+    @defer.inlineCallbacks
+    def test_index_and_checkpoint_are_kept_between_starts(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mail(LeapMail('mailid', 'INBOX', headers=headers))
+        self.assertIsNone(se.indexed_generation)
+
+        se.save_checkpoint(42)
+        restarted = SearchEngine(INDEX_KEY, self.agent_home)
+
+        self.assertEqual(42, restarted.indexed_generation)
+        self.assertEqual((['mailid'], 1), (yield restarted.search('tag:inbox')))
+
+    @defer.inlineCallbacks
+    def test_index_is_rebuilt_when_schema_changed(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mail(LeapMail('mailid', 'INBOX', headers=headers))
+        se.save_checkpoint(42)
+
+        with patch.object(SearchEngine, 'SCHEMA_VERSION', SearchEngine.SCHEMA_VERSION + 1):
+            restarted = SearchEngine(INDEX_KEY, self.agent_home)
+
+        self.assertIsNone(restarted.indexed_generation)
+        self.assertEqual(([], 0), (yield restarted.search('tag:inbox')))
+
+    @defer.inlineCallbacks
+    def test_index_is_rebuilt_without_corrupt_files(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mail(LeapMail('mailid', 'INBOX', headers=headers))
+        se.save_checkpoint(42)
+        toc = [name for name in os.listdir(se.index_folder) if name.endswith('.toc')][0]
+        with open(os.path.join(se.index_folder, toc), 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write('X')
+
+        restarted = SearchEngine(INDEX_KEY, self.agent_home)
+
+        self.assertIsNone(restarted.indexed_generation)
+        self.assertTrue(os.path.exists(os.path.join(se.index_folder, 'quarantine', toc)))
+        self.assertEqual(([], 0), (yield restarted.search('tag:inbox')))
+
+    @defer.inlineCallbacks
+    def test_remove_all_from_index(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mails([LeapMail(mail_id, 'TRASH', headers=headers) for mail_id in ('first', 'second', 'third')])
+
+        se.remove_all_from_index(['first', 'third'])
+
+        self.assertEqual((['second'], 1), (yield se.search('tag:trash')))
+
+    @defer.inlineCallbacks
+    def test_tags_are_counted_while_indexing(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mails([LeapMail('first', 'INBOX', headers=headers, tags={'work'}, flags={Status.SEEN}),
+                        LeapMail('second', 'INBOX', headers=headers)])
+        se.index_mail(LeapMail('second', 'TRASH', headers=headers))
+        se.remove_from_index('first')
+
+        tags = yield se.tags(query='', skip_default_tags=False)
+
+        counts = dict((tag['name'], tag['counts']) for tag in tags)
+        self.assertEqual({'total': 0, 'read': 0}, counts['inbox'])
+        self.assertEqual({'total': 1, 'read': 0}, counts['trash'])
+        self.assertNotIn('work', counts)
+
+    @defer.inlineCallbacks
+    def test_tag_counts_are_restored_from_index_and_checked_for_drift(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mail(LeapMail('first', 'INBOX', headers=headers, tags={'work'}, flags={Status.SEEN}))
+        se.save_checkpoint(1)
+
+        restarted = SearchEngine(INDEX_KEY, self.agent_home)
+        self.assertEqual({'inbox': 1, 'work': 1}, restarted._tag_counter.totals())
+        self.assertFalse((yield restarted.check_tag_counts()))
+
+        restarted._tag_counter.remove(u'first')
+        self.assertTrue((yield restarted.check_tag_counts()))
+        self.assertEqual({'inbox': 1, 'work': 1}, restarted._tag_counter.read())
+
+    def test_tag_counts_are_restored_without_loading_stored_documents(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mails([LeapMail('first', 'INBOX', headers=headers, tags={'work'}, flags={Status.SEEN}),
+                        LeapMail('second', 'INBOX', headers=headers, tags={'work', 'home'}),
+                        LeapMail('removed', 'INBOX', headers=headers, tags={'work'})])
+        se.remove_from_index('removed')
+        se.save_checkpoint(1)
+
+        with patch('whoosh.reading.SegmentReader.stored_fields', side_effect=AssertionError('stored fields loaded')), \
+                patch('whoosh.reading.SegmentReader.all_stored_fields', side_effect=AssertionError('stored fields loaded')):
+            restarted = SearchEngine(INDEX_KEY, self.agent_home)
+
+        self.assertEqual({'inbox': 2, 'work': 2, 'home': 1}, restarted._tag_counter.totals())
+        self.assertEqual({'inbox': 1, 'work': 1}, restarted._tag_counter.read())
+
+    @defer.inlineCallbacks
+    def test_paginated_search_results_are_cached_until_next_commit(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mail(LeapMail('first', 'INBOX', headers=headers))
+
+        with patch.object(se, '_paginated_search_mails', wraps=se._paginated_search_mails) as searched:
+            first = yield se.search('tag:inbox', window=25, page=1)
+            second = yield se.search('tag:inbox', window='25', page='1')
+            self.assertEqual(1, searched.call_count)
+            self.assertEqual(first, second)
+
+            se.index_mail(LeapMail('second', 'INBOX', headers=headers))
+            third = yield se.search('tag:inbox', window=25, page=1)
+
+        self.assertEqual(2, searched.call_count)
+        self.assertEqual(2, third[1])
+        self.assertIs(se.prepare_query('tag:inbox'), se.prepare_query('tag:inbox'))
+
+    @defer.inlineCallbacks
+    def test_total_counts_each_mail_once(self):
+        se = SearchEngine(INDEX_KEY, self.agent_home)
+        headers = {'From': 'foo@bar.tld', 'Subject': 'Some test mail', 'Date': 'Thu, 01 Oct 2015 10:00:00 +0000'}
+        se.index_mails([LeapMail(mail_id, 'INBOX', headers=headers, tags={'work', 'important'}) for mail_id in ('first', 'second', 'third')])
+
+        mail_ids, total = yield se.search('tag:inbox', window=2, page=1)
+
+        self.assertEqual(2, len(mail_ids))
+        self.assertEqual(3, total)
@@ -0,0 +1,69 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from whoosh.fields import Schema, ID
+from whoosh.filedb.filestore import RamStorage
+from pixelated.adapter.search.searcher_pool import SearcherPool
+
+
+class SearcherPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RamStorage().create_index(Schema(ident=ID(stored=True, unique=True)))
+        self.pool = SearcherPool(self.index)
+
+    def _add(self, ident):
+        with self.index.writer() as writer:
+            writer.add_document(ident=ident)
+
+    def test_searcher_is_reused_while_index_is_unchanged(self):
+        self._add(u'first')
+
+        with self.pool.searcher() as first:
+            pass
+        with self.pool.searcher() as second:
+            self.assertEqual(1, second.doc_count())
+
+        self.assertIs(first, second)
+        self.assertEqual({'idle': 1, 'opened': 1, 'refreshed': 0}, self.pool.stats())
+
+    def test_searcher_is_refreshed_after_index_changed(self):
+        self._add(u'first')
+        with self.pool.searcher():
+            pass
+
+        self._add(u'second')
+
+        with self.pool.searcher() as searcher:
+            self.assertEqual(2, searcher.doc_count())
+        self.assertEqual(1, self.pool.stats()['refreshed'])
+
+    def test_each_concurrent_user_gets_a_searcher_of_its_own(self):
+        with self.pool.searcher() as first:
+            with self.pool.searcher() as second:
+                self.assertIsNot(first, second)
+
+        self.assertEqual(2, self.pool.stats()['idle'])
+
+    def test_close_closes_idle_searchers(self):
+        with self.pool.searcher() as searcher:
+            pass
+
+        self.pool.close()
+
+        self.assertTrue(searcher.is_closed)
+        self.assertEqual(0, self.pool.stats()['idle'])
@@ -0,0 +1,47 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.search.tag_counter import TagCounter
+
+
+class TagCounterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.counter = TagCounter()
+        self.counter.seed([('first', ['inbox', 'work'], True), ('second', ['inbox'], False)])
+
+    def test_seed_counts_mails_per_tag(self):
+        self.assertEqual({'inbox': 2, 'work': 1}, self.counter.totals())
+        self.assertEqual({'inbox': 1, 'work': 1}, self.counter.read())
+
+    def test_update_replaces_the_counts_of_the_mail(self):
+        self.counter.update('first', ['trash'], False)
+
+        self.assertEqual({'inbox': 1, 'trash': 1}, self.counter.totals())
+        self.assertEqual({}, self.counter.read())
+
+    def test_remove_forgets_the_mail(self):
+        self.counter.remove('second')
+        self.counter.remove('unknown')
+
+        self.assertEqual({'inbox': 1, 'work': 1}, self.counter.totals())
+
+    def test_seed_starts_over(self):
+        self.counter.seed([('third', ['sent'], True)])
+
+        self.assertEqual({'sent': 1}, self.counter.totals())
+        self.assertEqual({'sent': 1}, self.counter.read())
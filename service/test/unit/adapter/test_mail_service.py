@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 from twisted.trial import unittest
-from pixelated.adapter.mailstore.leap_mailstore import LeapMail
+from pixelated.adapter.mailstore.leap_mailstore import LeapMail, MailSummary
 from pixelated.adapter.model.mail import InputMail
 from pixelated.adapter.model.status import Status
 
@@ -42,6 +42,15 @@ class TestMailService(unittest.TestCase):
     def tearDown(self):
         unstub()
 
+    @defer.inlineCallbacks
+    def test_iter_mails_delegates_to_mail_store(self):
+        batches = iter([defer.succeed([LeapMail('id', 'INBOX')])])
+        when(self.mail_store).iter_mails().thenReturn(defer.succeed(batches))
+
+        result = yield self.mail_service.iter_mails()
+
+        self.assertIs(batches, result)
+
     def test_send_mail(self):
         when(InputMail).from_dict(ANY()).thenReturn('inputmail')
         when(self.mail_sender).sendmail(ANY()).thenReturn(defer.Deferred())
@@ -102,45 +111,83 @@ class TestMailService(unittest.TestCase):
             verify(self.mail_sender).sendmail("inputmail")
             verifyNoMoreInteractions(self.drafts)
 
+    @defer.inlineCallbacks
+    def test_mails_loads_summaries_of_search_results(self):
+        summaries = [MailSummary('id1', 'INBOX'), MailSummary('id2', 'INBOX')]
+        when(self.search_engine).search('in:inbox', 25, 1).thenReturn(defer.succeed((['id1', 'id2'], 2)))
+        when(self.mail_store).get_mail_summaries(['id1', 'id2']).thenReturn(defer.succeed(summaries))
+
+        mails, total = yield self.mail_service.mails('in:inbox', 25, 1)
+
+        self.assertEqual(summaries, mails)
+        self.assertEqual(2, total)
+
     @defer.inlineCallbacks
     def test_mark_as_read(self):
-        mail = LeapMail(1, 'INBOX')
-        when(self.mail_store).get_mail(1, include_body=True).thenReturn(mail)
-        yield self.mail_service.mark_as_read(1)
+        when(self.mail_store).update_flags([1, 2], add=[Status.SEEN]).thenReturn(defer.succeed([1, 2]))
+
+        yield self.mail_service.mark_as_read([1, 2])
 
-        self.assertIn(Status.SEEN, mail.flags)
-        verify(self.mail_store).update_mail(mail)
+        verify(self.mail_store).update_flags([1, 2], add=[Status.SEEN])
+        verify(self.mail_store, times=0).get_mail(ANY(), include_body=True)
 
     @defer.inlineCallbacks
     def test_mark_as_unread(self):
-        mail = LeapMail(1, 'INBOX')
-        mail.flags.add(Status.SEEN)
+        when(self.mail_store).update_flags([1, 2], remove=[Status.SEEN]).thenReturn(defer.succeed([1, 2]))
 
-        when(self.mail_store).get_mail(1, include_body=True).thenReturn(mail)
-        yield self.mail_service.mark_as_unread(1)
+        yield self.mail_service.mark_as_unread([1, 2])
 
-        verify(self.mail_store).update_mail(mail)
-
-        self.assertNotEqual(mail.status, Status.SEEN)
+        verify(self.mail_store).update_flags([1, 2], remove=[Status.SEEN])
 
     @defer.inlineCallbacks
     def test_delete_mail(self):
         mail_to_delete = LeapMail(1, 'INBOX')
-        when(self.mail_store).get_mail(1, include_body=True).thenReturn(defer.succeed(mail_to_delete))
+        when(self.mail_store).get_mails([1]).thenReturn(defer.succeed([mail_to_delete]))
+        when(self.mail_store).move_mails_to_mailbox([1], 'TRASH').thenReturn(defer.succeed([mail_to_delete]))
 
         yield self.mail_service.delete_mail(1)
 
-        verify(self.mail_store).move_mail_to_mailbox(1, 'TRASH')
+        verify(self.mail_store).move_mails_to_mailbox([1], 'TRASH')
+
+    @defer.inlineCallbacks
+    def test_delete_mails_moves_to_trash_in_one_go_and_deletes_mails_already_in_trash(self):
+        mails = [LeapMail(1, 'INBOX'), LeapMail(2, 'TRASH'), LeapMail(3, 'SENT')]
+        when(self.mail_store).get_mails([1, 2, 3]).thenReturn(defer.succeed(mails))
+        when(self.mail_store).delete_mails([2]).thenReturn(defer.succeed([2]))
+        when(self.mail_store).move_mails_to_mailbox([1, 3], 'TRASH').thenReturn(defer.succeed([]))
+
+        yield self.mail_service.delete_mails([1, 2, 3])
+
+        verify(self.mail_store).delete_mails([2])
+        verify(self.mail_store).move_mails_to_mailbox([1, 3], 'TRASH')
+
+    @defer.inlineCallbacks
+    def test_empty_trash_deletes_all_its_mails(self):
+        when(self.mail_store).get_mailbox_mail_ids('TRASH').thenReturn(defer.succeed([1, 2]))
+        when(self.mail_store).delete_mails([1, 2]).thenReturn(defer.succeed([1, 2]))
+
+        yield self.mail_service.empty_mailbox('TRASH')
+
+        verify(self.mail_store).delete_mails([1, 2])
+
+    @defer.inlineCallbacks
+    def test_empty_other_mailbox_moves_its_mails_to_trash(self):
+        when(self.mail_store).get_mailbox_mail_ids('INBOX').thenReturn(defer.succeed([1, 2]))
+        when(self.mail_store).move_mails_to_mailbox([1, 2], 'TRASH').thenReturn(defer.succeed([]))
+
+        yield self.mail_service.empty_mailbox('INBOX')
+
+        verify(self.mail_store).move_mails_to_mailbox([1, 2], 'TRASH')
+        verify(self.mail_store, times=0).delete_mails(ANY())
 
     @defer.inlineCallbacks
     def test_recover_mail(self):
         mail_to_recover = LeapMail(1, 'TRASH')
-        when(self.mail_service).mail(1).thenReturn(mail_to_recover)
-        when(self.mail_store).move_mail_to_mailbox(1, 'INBOX').thenReturn(mail_to_recover)
+        when(self.mail_store).move_mails_to_mailbox([1], 'INBOX').thenReturn(defer.succeed([mail_to_recover]))
 
         yield self.mail_service.recover_mail(1)
 
-        verify(self.mail_store).move_mail_to_mailbox(1, 'INBOX')
+        verify(self.mail_store).move_mails_to_mailbox([1], 'INBOX')
 
     @defer.inlineCallbacks
     def test_get_attachment(self):
@@ -153,11 +200,12 @@ class TestMailService(unittest.TestCase):
 
     @defer.inlineCallbacks
     def test_update_tags_return_a_set_with_the_current_tags(self):
-        mail = LeapMail(1, 'INBOX', tags={'custom_1', 'custom_2'})
-        when(self.mail_store).get_mail(1, include_body=True).thenReturn(mail)
-        when(self.search_engine).tags(query='', skip_default_tags=True).thenReturn([])
+        mail = LeapMail(1, 'INBOX', tags={'custom_1', 'custom_3'})
+        when(self.mail_store).update_tags([1], {'custom_1', 'custom_3'}).thenReturn(defer.succeed([1]))
+        when(self.mail_store).get_mail(1, include_body=False).thenReturn(defer.succeed(mail))
+        when(self.search_engine).tags(query='', skip_default_tags=True).thenReturn(defer.succeed([]))
 
         updated_mail = yield self.mail_service.update_tags(1, {'custom_1', 'custom_3'})
 
-        verify(self.mail_store).update_mail(mail)
+        verify(self.mail_store).update_tags([1], {'custom_1', 'custom_3'})
         self.assertEqual({'custom_1', 'custom_3'}, updated_mail.tags)
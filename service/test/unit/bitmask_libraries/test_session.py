@@ -49,6 +49,21 @@ class SessionTest(AbstractLeapTest):
                 yield session.sync()
                 self.soledad_session.sync.assert_called_once()
 
+    def test_that_soledad_sync_refreshes_mail_store(self):
+        with patch('pixelated.bitmask_libraries.session.reactor.callFromThread', new=_execute_func) as _:
+            session = self._create_session()
+            session._on_soledad_sync()
+            self.mail_store.refresh_after_sync.assert_called_once_with()
+
+    def test_failing_refresh_after_soledad_sync_is_printed(self):
+        self.mail_store.refresh_after_sync.return_value = defer.fail(Exception('refresh failed'))
+        with patch('pixelated.bitmask_libraries.session.reactor.callFromThread', new=_execute_func) as _:
+            with patch('pixelated.bitmask_libraries.session.sys.stderr') as stderr:
+                session = self._create_session()
+                session._on_soledad_sync()
+
+                self.assertIn('refresh failed', ''.join(call[0][0] for call in stderr.write.call_args_list))
+
     def _create_session(self):
         return LeapSession(self.provider, self.auth, self.mail_store, self.soledad_session, self.nicknym, self.smtp_mock)
 
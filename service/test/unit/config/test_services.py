@@ -0,0 +1,69 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from mockito import mock, when, verify, any as ANY
+from twisted.internet import defer, task
+from twisted.trial.unittest import TestCase
+from pixelated.adapter.mailstore.leap_mailstore import LeapMail
+from pixelated.adapter.search import SearchEngine
+from pixelated.adapter.search.index_queue import IndexQueue
+from pixelated.adapter.services.mail_service import MailService
+from pixelated.config.services import Services
+
+
+class TestServices(TestCase):
+
+    def setUp(self):
+        self.services = Services(None, None)
+        self.services.mail_service = mock(mocked_obj=MailService)
+        self.services.search_engine = mock(mocked_obj=SearchEngine)
+        self.written_changes = []
+        self.services.search_engine.write_changes = lambda mails, removed_ids, changes: self.written_changes.append((mails, removed_ids))
+        self.services.search_engine.save_checkpoint = lambda generation: self.written_changes.append(generation)
+        self.services.index_queue = IndexQueue(self.services.search_engine, clock=task.Clock(), run_in_writer=lambda function, *args: function(*args))
+
+    @defer.inlineCallbacks
+    def test_index_is_rebuilt_without_checkpoint(self):
+        self.services.search_engine.indexed_generation = None
+        mail = LeapMail('mail id', 'INBOX')
+        when(self.services.mail_service).current_generation().thenReturn(defer.succeed(7))
+        when(self.services.mail_service).iter_mails().thenReturn(defer.succeed(iter([defer.succeed([mail, None])])))
+
+        yield self.services.index_all_mails()
+
+        self.assertEqual([([mail], []), 7], self.written_changes)
+        verify(self.services.mail_service, times=0).mail_changes_since(ANY())
+
+    @defer.inlineCallbacks
+    def test_only_mails_changed_since_checkpoint_are_indexed(self):
+        self.services.search_engine.indexed_generation = 5
+        changed_mail = LeapMail('changed id', 'INBOX', body=u'the body')
+        when(self.services.mail_service).mail_changes_since(5).thenReturn(defer.succeed((9, ['changed id', 'deleted id'])))
+        when(self.services.mail_service).mails_by_id(['changed id', 'deleted id'], include_body=True).thenReturn(defer.succeed([changed_mail, None]))
+
+        yield self.services.index_all_mails()
+
+        verify(self.services.mail_service, times=0).iter_mails()
+        self.assertEqual([([changed_mail], ['deleted id']), 9], self.written_changes)
+
+    @defer.inlineCallbacks
+    def test_nothing_is_indexed_without_changes(self):
+        self.services.search_engine.indexed_generation = 5
+        when(self.services.mail_service).mail_changes_since(5).thenReturn(defer.succeed((5, [])))
+
+        yield self.services.index_all_mails()
+
+        verify(self.services.mail_service, times=0).mails_by_id(ANY(), include_body=True)
+        self.assertEqual([5], self.written_changes)
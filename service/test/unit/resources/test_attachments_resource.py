@@ -0,0 +1,94 @@
+import base64
+from mockito import mock, when, verify
+from twisted.internet import defer
+from twisted.trial import unittest
+from twisted.web.test.requesthelper import DummyRequest
+from pixelated.adapter.mailstore.attachment_content import AttachmentContent
+from pixelated.resources.attachments_resource import AttachmentsResource
+from test.unit.resources import DummySite
+
+
+ATTACHMENT_DATA = ''.join(chr(i % 256) for i in xrange(1000))
+
+
+class TestAttachmentsResource(unittest.TestCase):
+    def setUp(self):
+        self.mail_service = mock()
+        self.web = DummySite(AttachmentsResource(self.mail_service))
+        content = AttachmentContent(base64.encodestring(ATTACHMENT_DATA), 'application/octet-stream', 'base64')
+        when(self.mail_service).attachment_content('attachment id').thenReturn(defer.succeed(content))
+
+    def _get(self, range_header=None):
+        request = DummyRequest(['attachment id'])
+        if range_header:
+            request.headers['range'] = range_header
+        return self.web.get(request)
+
+    def test_sends_whole_attachment(self):
+        d = self._get()
+
+        def assert_whole_attachment(request):
+            self.assertEqual(200, request.code)
+            self.assertEqual(ATTACHMENT_DATA, ''.join(request.written))
+            self.assertEqual('1000', request.outgoingHeaders.get('content-length'))
+            self.assertEqual('bytes', request.outgoingHeaders.get('accept-ranges'))
+
+        d.addCallback(assert_whole_attachment)
+        return d
+
+    def test_sends_requested_range(self):
+        d = self._get('bytes=100-199')
+
+        def assert_partial_content(request):
+            self.assertEqual(206, request.code)
+            self.assertEqual(ATTACHMENT_DATA[100:200], ''.join(request.written))
+            self.assertEqual('100', request.outgoingHeaders.get('content-length'))
+            self.assertEqual('bytes 100-199/1000', request.outgoingHeaders.get('content-range'))
+
+        d.addCallback(assert_partial_content)
+        return d
+
+    def test_sends_suffix_range(self):
+        d = self._get('bytes=-10')
+
+        def assert_last_bytes(request):
+            self.assertEqual(206, request.code)
+            self.assertEqual(ATTACHMENT_DATA[-10:], ''.join(request.written))
+            self.assertEqual('bytes 990-999/1000', request.outgoingHeaders.get('content-range'))
+
+        d.addCallback(assert_last_bytes)
+        return d
+
+    def test_range_beyond_attachment_is_not_satisfiable(self):
+        d = self._get('bytes=1000-')
+
+        def assert_not_satisfiable(request):
+            self.assertEqual(416, request.code)
+            self.assertEqual('bytes */1000', request.outgoingHeaders.get('content-range'))
+
+        d.addCallback(assert_not_satisfiable)
+        return d
+
+    def test_sends_etag_and_immutable_cache_headers(self):
+        d = self._get()
+
+        def assert_cache_headers(request):
+            self.assertEqual('"attachment id"', request.outgoingHeaders.get('etag'))
+            self.assertIn('immutable', request.outgoingHeaders.get('cache-control'))
+
+        d.addCallback(assert_cache_headers)
+        return d
+
+    def test_matching_etag_is_not_modified(self):
+        request = DummyRequest(['attachment id'])
+        request.headers['if-none-match'] = '"other id", "attachment id"'
+
+        d = self.web.get(request)
+
+        def assert_not_modified(request):
+            self.assertEqual(304, request.code)
+            self.assertEqual([], request.written)
+            verify(self.mail_service, times=0).attachment_content('attachment id')
+
+        d.addCallback(assert_not_modified)
+        return d
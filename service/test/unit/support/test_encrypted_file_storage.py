@@ -13,10 +13,31 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import hmac
 import os
 import shutil
 import unittest
+from hashlib import sha256
+from mock import patch
+from whoosh.fields import Schema, ID, TEXT
+from pixelated.support import encrypted_file_storage
 from pixelated.support.encrypted_file_storage import EncryptedFileStorage
+from pixelated.support.lru_cache import LRUCache
+
+
+class PausedRemover(object):
+    """ Removes the files handed over only when waited for """
+
+    def __init__(self):
+        self.paths = []
+
+    def remove(self, path):
+        self.paths.append(path)
+
+    def wait(self):
+        for path in self.paths:
+            os.remove(path)
+        self.paths = []
 
 
 class EncryptedFileStorageTest(unittest.TestCase):
@@ -27,6 +48,10 @@ class EncryptedFileStorageTest(unittest.TestCase):
         self.path = os.path.join('tmp', 'search_test')
         self._cleanup_path()
         self.storage = EncryptedFileStorage(self.path, self.key)
+        # every test starts without decrypted chunks of the files of the tests before
+        decrypted = patch.object(EncryptedFileStorage, '_decrypted', LRUCache(EncryptedFileStorage.DECRYPTED_CACHE_BUDGET))
+        decrypted.start()
+        self.addCleanup(decrypted.stop)
 
     def tearDown(self):
         self._cleanup_path()
@@ -66,3 +91,309 @@ class EncryptedFileStorageTest(unittest.TestCase):
             self.fail('MAC is not detecting corrupt ciphertext')
         except:
             pass
+
+    def _write(self, name, content):
+        self.storage.create()
+        with self.storage.create_file(name) as f:
+            f.write(content)
+
+    def test_decrypted_chunks_are_shared_between_opens(self):
+        self._write('segment', self.msg)
+        hits = EncryptedFileStorage.cache_stats()['hits']
+
+        with patch('pixelated.support.encrypted_file_storage.decrypt_sym') as decrypt_sym:
+            first = self.storage.open_file('segment')
+            second = self.storage.open_file('segment')
+
+            self.assertEqual(self.msg, first.read())
+            self.assertEqual(self.msg, second.read())
+            self.assertFalse(decrypt_sym.called)
+        self.assertEqual(len(self.msg), self.storage.file_length('segment'))
+        self.assertEqual(hits + 2, EncryptedFileStorage.cache_stats()['hits'])
+
+    def test_only_chunks_read_from_are_decrypted(self):
+        with patch.object(EncryptedFileStorage, 'CHUNK_SIZE', 8):
+            self._write('segment', self.msg)
+        self.storage._forget_decrypted('segment')
+
+        with patch('pixelated.support.encrypted_file_storage.decrypt_sym', wraps=encrypted_file_storage.decrypt_sym) as decrypt_sym:
+            f = self.storage.open_file('segment')
+            f.seek(10)
+            self.assertEqual(self.msg[10:20], f.read(10))
+            f.seek(-4, os.SEEK_END)
+            self.assertEqual(self.msg[-4:], f.read())
+
+        self.assertEqual(3, decrypt_sym.call_count)
+
+    def test_reads_lines_across_chunks(self):
+        with patch.object(EncryptedFileStorage, 'CHUNK_SIZE', 4):
+            self._write('segment', 'first line\nsecond line\n')
+
+        f = self.storage.open_file('segment')
+
+        self.assertEqual('first line\n', f.readline())
+        self.assertEqual('second line\n', f.readline())
+        self.assertEqual('', f.readline())
+
+    def test_mac_against_modified_chunk(self):
+        with patch.object(EncryptedFileStorage, 'CHUNK_SIZE', 8):
+            self._write('segment', self.msg)
+        self.storage._forget_decrypted('segment')
+        with open(self.storage._fpath('segment'), 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write('X')
+
+        f = self.storage.open_file('segment')
+
+        self.assertEqual(self.msg[:8], f.read(8))
+        self.assertRaises(Exception, f.read)
+
+    def test_file_of_former_format_is_migrated(self):
+        self.storage.create()
+        with open(self.storage._fpath('segment'), 'wb') as f:
+            f.write(self.storage.encrypt(self.msg))
+
+        self.assertEqual(self.msg, self.storage.open_file('segment').read())
+
+        with open(self.storage._fpath('segment'), 'rb') as f:
+            self.assertEqual(EncryptedFileStorage.FORMAT_MAGIC, f.read(4))
+        self.storage._forget_decrypted('segment')
+        self.assertEqual(self.msg, self.storage.open_file('segment').read())
+
+    def test_file_of_former_format_is_left_as_it_is_when_not_migrating(self):
+        self.storage.create()
+        with open(self.storage._fpath('segment'), 'wb') as f:
+            f.write(self.storage.encrypt(self.msg))
+        storage = EncryptedFileStorage(self.path, self.key, migrate_former_format=False)
+
+        self.assertEqual(self.msg, storage.open_file('segment').read())
+
+        with open(self.storage._fpath('segment'), 'rb') as f:
+            self.assertNotEqual(EncryptedFileStorage.FORMAT_MAGIC, f.read(4))
+
+    def test_storage_given_a_cache_keeps_its_chunks_apart(self):
+        self._write('segment', self.msg)
+        size = EncryptedFileStorage.cache_stats()['size']
+        cache = LRUCache(EncryptedFileStorage.DECRYPTED_CACHE_BUDGET)
+        storage = EncryptedFileStorage(self.path, self.key, decrypted_cache=cache)
+
+        self.assertEqual(self.msg, storage.open_file('segment').read())
+
+        self.assertEqual(len(self.msg), cache.stats()['size'])
+        self.assertEqual(size, EncryptedFileStorage.cache_stats()['size'])
+
+    def test_changed_file_is_decrypted_again(self):
+        self._write('segment', self.msg)
+        with open(self.storage._fpath('segment'), 'wb') as f:
+            f.write(self.storage.encrypt('another message'))
+
+        self.assertEqual('another message', self.storage.open_file('segment').read())
+
+    def test_deleted_file_is_forgotten(self):
+        self._write('segment', self.msg)
+        size = EncryptedFileStorage.cache_stats()['size']
+
+        self.storage.delete_file('segment')
+
+        self.assertEqual(size - len(self.msg), EncryptedFileStorage.cache_stats()['size'])
+
+    def test_subset_reads_from_the_shared_content(self):
+        self._write('segment', self.msg)
+
+        subset = self.storage.open_file('segment').subset(8, 4)
+
+        self.assertEqual(self.msg[8:12], subset.read())
+        self.assertEqual(self.msg[9:11], subset.get(1, 2))
+
+    def test_compressed_chunks_are_flagged_in_the_header(self):
+        self.storage = EncryptedFileStorage(self.path, self.key, compression_level=1)
+        content = 'a compressible line\n' * 100
+        with patch.object(EncryptedFileStorage, 'CHUNK_SIZE', 256):
+            self._write('segment', content)
+        self.storage._forget_decrypted('segment')
+
+        with open(self.storage._fpath('segment'), 'rb') as f:
+            header = f.read(6)
+        self.assertEqual(EncryptedFileStorage.COMPRESSED, ord(header[5]) & EncryptedFileStorage.COMPRESSED)
+        self.assertLess(os.path.getsize(self.storage._fpath('segment')), len(content))
+        f = self.storage.open_file('segment')
+        f.seek(1000)
+        self.assertEqual(content[1000:1300], f.read(300))
+
+    def test_no_compression_by_default(self):
+        self._write('segment', self.msg)
+        self.storage._forget_decrypted('segment')
+
+        with open(self.storage._fpath('segment'), 'rb') as f:
+            self.assertEqual(0, ord(f.read(6)[5]))
+        self.assertEqual(self.msg, self.storage.open_file('segment').read())
+
+    def test_file_of_version_2_is_read(self):
+        self.storage = EncryptedFileStorage(self.path, self.key, compression_level=0)
+        self._write('segment', self.msg)
+        self.storage._forget_decrypted('segment')
+        with open(self.storage._fpath('segment'), 'rb') as f:
+            header, mac, records = f.read(66), f.read(32), f.read()
+        header = header[:4] + chr(2) + header[6:]
+        with open(self.storage._fpath('segment'), 'wb') as f:
+            f.write(header + hmac.new(self.storage.signkey, header, sha256).digest() + records)
+
+        self.assertEqual(self.msg, self.storage.open_file('segment').read())
+
+    def test_failed_write_keeps_the_former_file(self):
+        self._write('segment', self.msg)
+
+        with patch('pixelated.support.encrypted_file_storage.encrypt_sym', side_effect=IOError):
+            self.assertRaises(IOError, self._write, 'segment', 'another message')
+
+        self.storage._forget_decrypted('segment')
+        self.assertEqual(self.msg, self.storage.open_file('segment').read())
+
+    def test_deleted_files_are_removed_in_the_background(self):
+        self._write('segment', self.msg)
+
+        self.storage.delete_file('segment')
+
+        self.assertFalse(self.storage.file_exists('segment'))
+        EncryptedFileStorage._remover.wait()
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_files_are_synced_when_the_index_is_committed(self):
+        self._write('first_segment', self.msg)
+        self._write('second_segment', self.msg)
+        self._write('_mails_1.toc.temp', self.msg)
+
+        with patch.object(EncryptedFileStorage, '_fsync') as fsync:
+            self.storage.rename_file('second_segment', 'renamed_segment')
+            self.assertFalse(fsync.called)
+
+            self.storage.rename_file('_mails_1.toc.temp', '_mails_1.toc')
+
+        synced = set(call[0][0] for call in fsync.call_args_list)
+        self.assertEqual(set(self.storage._fpath(name) for name in ('first_segment', 'renamed_segment', '_mails_1.toc.temp')) | {self.path}, synced)
+
+    def test_recover_quarantines_corrupt_files(self):
+        self._write('segment', self.msg)
+        self._write('truncated', self.msg)
+        self._write('modified', self.msg)
+        with open(self.storage._fpath('truncated'), 'r+b') as f:
+            f.truncate(os.path.getsize(self.storage._fpath('truncated')) - 1)
+        with open(self.storage._fpath('modified'), 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write('X')
+        with open(self.storage._fpath('~segment.left.writing'), 'wb') as f:
+            f.write('left by a crash')
+
+        quarantined = self.storage.recover()
+
+        self.assertEqual(['modified', 'truncated'], sorted(quarantined))
+        self.assertEqual(['quarantine', 'segment'], sorted(os.listdir(self.path)))
+        self.assertEqual(['modified', 'truncated'], sorted(os.listdir(os.path.join(self.path, 'quarantine'))))
+        self.assertEqual(self.msg, self.storage.open_file('segment').read())
+
+    def test_chunk_failing_to_authenticate_when_read_is_quarantined_by_next_recover(self):
+        with patch.object(EncryptedFileStorage, 'CHUNK_SIZE', 8):
+            self._write('segment', self.msg)
+        self.storage._forget_decrypted('segment')
+        with open(self.storage._fpath('segment'), 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write('X')
+
+        with patch.object(EncryptedFileStorage, 'FULLY_VERIFIED_SIZE', 0):
+            self.assertEqual([], self.storage.recover())
+            self.assertRaises(Exception, self.storage.open_file('segment').read)
+
+            self.assertEqual(['segment'], self.storage.recover())
+        self.assertEqual(['segment'], os.listdir(os.path.join(self.path, 'quarantine')))
+
+    def test_clean_tolerates_files_removed_meanwhile(self):
+        self._write('segment', self.msg)
+
+        with patch.object(self.storage, 'list', return_value=['segment', 'removed_meanwhile']):
+            self.storage.clean()
+
+        self.assertEqual([], os.listdir(self.path))
+
+
+class TempStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join('tmp', 'search_test')
+        self.storage = EncryptedFileStorage(self.path, os.urandom(64), temp_memory_limit=16).create()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_small_files_are_kept_in_memory(self):
+        temp_storage = self.storage.temp_storage('mails.tmp')
+
+        # whoosh writes and reads its sort runs through the raw files
+        with temp_storage.create_file('first.run').raw_file() as f:
+            f.write('sorted postings')
+
+        self.assertEqual('sorted postings', temp_storage.open_file('first.run').raw_file().read())
+        self.assertEqual([], os.listdir(self.path))
+        self.assertEqual({'memory_size': 15, 'memory_files': 1, 'disk_files': 0}, temp_storage.stats())
+
+    def test_files_beyond_the_limit_are_written_to_disk_encrypted(self):
+        temp_storage = self.storage.temp_storage('mails.tmp')
+        with temp_storage.create_file('first.run') as f:
+            f.write('sorted postings')
+
+        with temp_storage.create_file('second.run') as f:
+            f.write('more sorted postings')
+
+        self.assertEqual('more sorted postings', temp_storage.open_file('second.run').read())
+        self.assertEqual({'memory_size': 15, 'memory_files': 1, 'disk_files': 1}, temp_storage.stats())
+        folder = os.path.join(self.path, os.listdir(self.path)[0])
+        with open(os.path.join(folder, 'second.run'), 'rb') as f:
+            self.assertEqual(EncryptedFileStorage.FORMAT_MAGIC, f.read(4))
+
+        temp_storage.destroy()
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_destroy_waits_for_files_removed_in_the_background(self):
+        remover = PausedRemover()
+        temp_storage = self.storage.temp_storage('mails.tmp')
+        with patch.object(EncryptedFileStorage, '_remover', remover):
+            with temp_storage.create_file('first.run') as f:
+                f.write('more than sixteen bytes')
+            temp_storage.delete_file('first.run')
+
+            temp_storage.destroy()
+
+        self.assertEqual([], remover.paths)
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_deleted_files_free_their_memory(self):
+        temp_storage = self.storage.temp_storage('mails.tmp')
+        with temp_storage.create_file('first.run') as f:
+            f.write('sorted postings')
+
+        temp_storage.delete_file('first.run')
+        with temp_storage.create_file('second.run') as f:
+            f.write('sorted postings')
+
+        self.assertEqual(['second.run'], temp_storage.list())
+        self.assertEqual(0, temp_storage.stats()['disk_files'])
+
+    def test_commits_spilling_to_disk_leave_no_temporary_folders(self):
+        index = self.storage.create_index(Schema(ident=ID(stored=True), body=TEXT(stored=True)), indexname='mails')
+
+        # whoosh spills the stored fields of a segment to its temporary storage beyond 32KB
+        for commit in xrange(3):
+            with index.writer() as writer:
+                for number in xrange(300):
+                    writer.add_document(ident=u'%d-%d' % (commit, number), body=unicode(os.urandom(128).encode('hex')))
+
+        self.assertEqual([], [name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name))])
+        self.assertEqual(900, index.doc_count())
+
+    def test_recover_removes_temporary_folders_left_behind(self):
+        temp_storage = self.storage.temp_storage('mails.tmp')
+        with temp_storage.create_file('first.run') as f:
+            f.write('more than sixteen bytes')
+
+        self.assertEqual([], self.storage.recover())
+
+        self.assertEqual([], os.listdir(self.path))
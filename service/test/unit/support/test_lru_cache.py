@@ -0,0 +1,61 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from twisted.trial import unittest
+
+from pixelated.support.lru_cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(budget=10)
+
+    def test_returns_cached_values_and_counts_hits_and_misses(self):
+        self.cache.put('a', 'value', 4)
+
+        self.assertEqual('value', self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual({'entries': 1, 'size': 4, 'budget': 10, 'hits': 1, 'misses': 1, 'evictions': 0}, self.cache.stats())
+
+    def test_evicts_least_recently_used_values_when_over_budget(self):
+        self.cache.put('a', 'a', 4)
+        self.cache.put('b', 'b', 4)
+        self.cache.get('a')
+
+        self.cache.put('c', 'c', 4)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual('a', self.cache.get('a'))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_does_not_keep_values_larger_than_budget(self):
+        self.cache.put('a', 'a', 11)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(0, self.cache.stats()['size'])
+
+    def test_unusable_values_are_misses(self):
+        self.cache.put('a', 'a', 4)
+
+        self.assertIsNone(self.cache.get('a', usable=lambda value: False))
+        self.assertEqual(1, self.cache.stats()['misses'])
+
+    def test_pop_removes_value(self):
+        self.cache.put('a', 'a', 4)
+
+        self.assertEqual('a', self.cache.pop('a'))
+        self.assertEqual(0, self.cache.stats()['size'])
+        self.assertIsNone(self.cache.pop('a'))
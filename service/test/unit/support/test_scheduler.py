@@ -0,0 +1,84 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from pixelated.support.scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(parallelism=2)
+        self.pending = {}
+
+    def _job(self, item):
+        self.pending[item] = defer.Deferred()
+        return self.pending[item]
+
+    def test_keeps_at_most_parallelism_jobs_in_flight(self):
+        self.scheduler.map(self._job, range(5))
+
+        self.assertEqual([0, 1], sorted(self.pending.keys()))
+        self.assertEqual({'parallelism': 2, 'queued': 3, 'in_flight': 2, 'completed': 0}, self.scheduler.stats())
+
+        self.pending[0].callback(None)
+
+        self.assertEqual([0, 1, 2], sorted(self.pending.keys()))
+        self.assertEqual(2, self.scheduler.queue_depth)
+        self.assertEqual(2, self.scheduler.in_flight)
+
+    def test_results_keep_the_order_of_the_items(self):
+        d = self.scheduler.map(self._job, ['a', 'b', 'c'])
+
+        self.pending['b'].callback('B')
+        self.pending['c'].callback('C')
+        self.pending['a'].callback('A')
+
+        self.assertEqual(['A', 'B', 'C'], self.successResultOf(d))
+        self.assertEqual(3, self.scheduler.stats()['completed'])
+
+    def test_supports_synchronous_functions(self):
+        d = self.scheduler.map(lambda item: item * 2, [1, 2, 3])
+
+        self.assertEqual([2, 4, 6], self.successResultOf(d))
+
+    def test_empty_items_fire_immediately(self):
+        d = self.scheduler.map(self._job, [])
+
+        self.assertEqual([], self.successResultOf(d))
+
+    def test_first_failure_stops_scheduling_and_is_passed_on(self):
+        d = self.scheduler.map(self._job, range(5))
+
+        self.pending[0].errback(ValueError('failed'))
+        self.pending[1].callback(None)
+
+        self.failureResultOf(d, ValueError)
+        self.assertEqual([0, 1], sorted(self.pending.keys()))
+        self.assertEqual(0, self.scheduler.queue_depth)
+
+    def test_cancel_stops_scheduling_further_items(self):
+        d = self.scheduler.map(self._job, range(5))
+
+        d.cancel()
+        self.pending[0].callback(None)
+        self.pending[1].callback(None)
+
+        self.failureResultOf(d, defer.CancelledError)
+        self.assertEqual([0, 1], sorted(self.pending.keys()))
+        self.assertEqual(0, self.scheduler.queue_depth)
+        self.assertEqual(0, self.scheduler.in_flight)
@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2015 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import threading
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from pixelated.support.thread_pool import MeasuredThreadPool
+
+
+class TestMeasuredThreadPool(TestCase):
+
+    def setUp(self):
+        self.pool = MeasuredThreadPool('test', 2)
+
+    @defer.inlineCallbacks
+    def test_runs_function_in_a_thread_of_the_pool(self):
+        thread_name = yield self.pool.run(lambda: threading.current_thread().name)
+
+        self.assertNotEqual(threading.current_thread().name, thread_name)
+        self.assertIn('test', thread_name)
+
+    @defer.inlineCallbacks
+    def test_passes_arguments_and_result(self):
+        result = yield self.pool.run(lambda first, second=None: (first, second), 'first', second='second')
+
+        self.assertEqual(('first', 'second'), result)
+
+    @defer.inlineCallbacks
+    def test_failures_are_passed_on(self):
+        def fail():
+            raise ValueError('failed')
+
+        yield self.assertFailure(self.pool.run(fail), ValueError)
+
+        self.assertEqual(1, self.pool.stats()['completed'])
+
+    @defer.inlineCallbacks
+    def test_stats_count_finished_calls(self):
+        d = self.pool.run(lambda: None)
+        self.assertEqual(1, self.pool.stats()['pending'])
+
+        yield d
+
+        stats = self.pool.stats()
+        self.assertEqual(0, stats['pending'])
+        self.assertEqual(1, stats['completed'])
+        self.assertEqual('test', stats['name'])
+        self.assertEqual(2, stats['size'])
+        self.assertTrue(stats['max_run'] >= stats['average_run'] >= 0)